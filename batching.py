@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import time
+import queue
+import threading
+import numpy as np
+from concurrent.futures import Future
+from executor import BoundedExecutor, ExecutorOverload
+from buffer_pool import BatchBufferPool
+import metrics
+
+
+class BatchRequest(object):
+
+    def __init__(self, image_batch, output_split):
+        self.image_batch = image_batch
+        self.output_split = output_split
+        self.future = Future()
+        self.enqueue_time = time.time()
+
+    @property
+    def size(self):
+        return len(self.image_batch)
+
+    @property
+    def shape(self):
+        return self.image_batch[0].shape if len(self.image_batch) else None
+
+
+class BatchScheduler(object):
+    """
+    Coalesce the concurrent requests of one interface into a single session run.
+    The worker takes whatever is queued (waiting at most `max_wait` seconds for more)
+    up to `max_batch_size` images, groups them by input shape and fans the decoded
+    text back out to the future of each request.
+    When an executor is given, the batches are run on it with at most `concurrency`
+    batches of this scheduler in flight, and at most `max_queue_size` requests wait in
+    the queue before new submissions are rejected with ExecutorOverload.
+    A lone request whose images are one contiguous tensor is fed as it is, the images of several requests
+    are stacked into a buffer of `buffers` (when the shapes match) instead of a new tensor.
+    """
+
+    def __init__(self, run_func, max_batch_size=32, max_wait=0., name=None,
+                 executor: BoundedExecutor = None, concurrency=1, max_queue_size=0, buffers: BatchBufferPool = None):
+        self.run_func = run_func
+        self.max_batch_size = max(int(max_batch_size), 1)
+        self.max_wait = max(float(max_wait), 0.)
+        self.name = name
+        self.executor = executor
+        self.buffers = buffers
+        self.slots = threading.BoundedSemaphore(max(int(concurrency), 1))
+        self.queue = queue.Queue(maxsize=max(int(max_queue_size), 0))
+        self.stopped = False
+        self.closing = False
+        self.thread = threading.Thread(target=self._loop, name="batcher-{}".format(name), daemon=True)
+        self.thread.start()
+
+    def submit(self, image_batch, output_split) -> Future:
+        request = BatchRequest(image_batch, output_split)
+        if self.stopped:
+            request.future.set_exception(RuntimeError("The batch scheduler of {} is stopped.".format(self.name)))
+            return request.future
+        try:
+            self.queue.put_nowait(request)
+        except queue.Full:
+            raise ExecutorOverload(self.name)
+        if self.stopped:
+            # Stopped while queuing, the worker may already be gone.
+            self._fail_queued()
+        return request.future
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def shutdown(self, wait=False):
+        # The queued requests are run, the ones queued behind the sentinel fail. Without room for the sentinel
+        # the worker stops once the queue is empty.
+        self.stopped = True
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        if wait:
+            self.thread.join()
+
+    def _fail_queued(self):
+        while True:
+            try:
+                request = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if request is not None and not request.future.done():
+                request.future.set_exception(RuntimeError("The batch scheduler of {} is stopped.".format(self.name)))
+
+    def _collect(self, first: BatchRequest):
+        pending = [first]
+        total = first.size
+        deadline = time.time() + self.max_wait
+        while total < self.max_batch_size:
+            timeout = deadline - time.time()
+            try:
+                request = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self.closing = True
+                break
+            pending.append(request)
+            total += request.size
+        return pending
+
+    def _loop(self):
+        while not self.closing:
+            try:
+                request = self.queue.get(timeout=1)
+            except queue.Empty:
+                if self.stopped:
+                    break
+                continue
+            if request is None:
+                break
+            pending = self._collect(request)
+            self.slots.acquire()
+            if not self.executor:
+                self._flush(pending)
+            else:
+                try:
+                    self.executor.submit(self._flush, pending)
+                except ExecutorOverload as e:
+                    self.slots.release()
+                    for item in pending:
+                        item.future.set_exception(e)
+            # Do not hold the images while idle, their buffers may be leased (the shared slots of a process pool).
+            request = pending = None
+        self._fail_queued()
+
+    def _flush(self, pending: list):
+        try:
+            self._dispatch(pending)
+        except Exception as e:
+            for request in pending:
+                if not request.future.done():
+                    request.future.set_exception(e)
+        finally:
+            self.slots.release()
+
+    def _dispatch(self, pending: list):
+        groups = {}
+        for request in pending:
+            groups.setdefault(request.shape, []).append(request)
+        for requests in groups.values():
+            self._run_group(requests)
+
+    def _run_group(self, requests: list):
+        images = []
+        now = time.time()
+        for request in requests:
+            images.extend(request.image_batch)
+            metrics.observe('queue_wait', now - request.enqueue_time, self.name)
+        metrics.batch_size.observe(len(images), model=self.name or '')
+        if len(requests) == 1 and isinstance(requests[0].image_batch, np.ndarray):
+            images = requests[0].image_batch
+        elif self.buffers and requests[0].shape == self.buffers.shape:
+            images = self.buffers.stack(images)
+        try:
+            texts = self.run_func(images)
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        offset = 0
+        for request in requests:
+            decoded = texts[offset: offset + request.size]
+            offset += request.size
+            # Without output_split the texts of the images are returned as a list.
+            request.future.set_result(decoded if request.output_split is None else request.output_split.join(decoded))
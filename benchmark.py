@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import io
+import re
+import cv2
+import copy
+import time
+import optparse
+import numpy as np
+from PIL import Image as PIL_Image
+from config import Config, ModelConfig
+from pretreatment import preprocessing, preprocessing_by_func, PreprocessPlan
+from utils import Arithmetic
+from middleware.impl.gif_frames import concat_frames, blend_frame
+from middleware.impl.rgb_filter import rgb_filter
+
+
+def timeit(func, times):
+    func()
+    start_time = time.perf_counter()
+    for _ in range(times):
+        func()
+    return (time.perf_counter() - start_time) * 1000 / times
+
+
+def sample_bytes(model: ModelConfig, resized=False):
+    # The resized samples are up to twice as large as the model input, they go through the resize.
+    height, width = model.image_height, model.image_width
+    if resized:
+        height, width = np.random.randint(height // 2, height * 2), np.random.randint(width // 2, width * 2)
+    image_arr = np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+    data_stream = io.BytesIO()
+    PIL_Image.fromarray(image_arr).save(data_stream, format='PNG')
+    return data_stream.getvalue()
+
+
+def legacy_load_image(model: ModelConfig, image_bytes: bytes, param_key=None, extract_rgb: list = None):
+    # The per-request preprocessing before the compiled plans, kept as the baseline.
+    data_stream = io.BytesIO(image_bytes)
+    pil_image = PIL_Image.open(data_stream)
+
+    gif_handle = model.pre_concat_frames != -1 or model.pre_blend_frames != -1
+
+    if pil_image.mode == 'P' and not gif_handle:
+        pil_image = pil_image.convert('RGB')
+
+    rgb = pil_image.split()
+    size = pil_image.size
+
+    if (len(rgb) > 3 and model.pre_replace_transparent) and not gif_handle:
+        background = PIL_Image.new('RGB', pil_image.size, (255, 255, 255))
+        try:
+            background.paste(pil_image, (0, 0, size[0], size[1]), pil_image)
+            pil_image = background
+        except:
+            pil_image = pil_image.convert('RGB')
+
+    if len(pil_image.split()) > 3 and model.image_channel == 3:
+        pil_image = pil_image.convert('RGB')
+
+    if model.pre_concat_frames != -1:
+        im = concat_frames(pil_image, model.pre_concat_frames)
+    elif model.pre_blend_frames != -1:
+        im = blend_frame(pil_image, model.pre_blend_frames)
+    else:
+        im = np.asarray(pil_image)
+
+    if extract_rgb:
+        im = rgb_filter(im, extract_rgb)
+
+    im = preprocessing_by_func(
+        exec_map=model.exec_map,
+        key=param_key,
+        src_arr=im
+    )
+
+    if model.image_channel == 1 and len(im.shape) == 3:
+        im = cv2.cvtColor(im, cv2.COLOR_RGB2GRAY)
+
+    im = preprocessing(
+        image=im,
+        binaryzation=model.pre_binaryzation,
+    )
+
+    if model.pre_horizontal_stitching:
+        up_slice = im[0: int(size[1] / 2), 0: size[0]]
+        down_slice = im[int(size[1] / 2): size[1], 0: size[0]]
+        im = np.concatenate((up_slice, down_slice), axis=1)
+
+    image = im.astype(np.float32)
+    if model.resize[0] == -1:
+        ratio = model.resize[1] / size[1]
+        resize_width = int(ratio * size[0])
+        image = cv2.resize(image, (resize_width, model.resize[1]))
+    else:
+        image = cv2.resize(image, (model.resize[0], model.resize[1]))
+    image = image.swapaxes(0, 1)
+    return (image[:, :, np.newaxis] if model.image_channel == 1 else image[:, :]) / 255.
+
+
+class LegacyArithmetic(object):
+    # The regular expression evaluator before the shunting-yard one, kept as the baseline.
+
+    def calc(self, formula):
+        formula = re.sub(' ', '', formula)
+        formula_ret = 0
+        match_brackets = re.search(r'\([^()]+\)', formula)
+        if match_brackets:
+            calc_result = self.calc(match_brackets.group().strip("(,)"))
+            formula = formula.replace(match_brackets.group(), str(calc_result))
+            return self.calc(formula)
+        else:
+            formula = formula.replace('--', '+').replace('++', '+').replace('-+', '-').replace('+-', '-')
+            while re.findall(r"[*/]", formula):
+                get_formula = re.search(r"[.\d]+[*/]+[-]?[.\d]+", formula)
+                if get_formula:
+                    get_formula_str = get_formula.group()
+                    if get_formula_str.count("*"):
+                        formula_list = get_formula_str.split("*")
+                        ret = float(formula_list[0]) * float(formula_list[1])
+                    else:
+                        formula_list = get_formula_str.split("/")
+                        ret = float(formula_list[0]) / float(formula_list[1])
+                    formula = formula.replace(get_formula_str, str(ret)).replace('--', '+').replace('++', '+')
+            formula = re.findall(r'[-]?[.\d]+', formula)
+            for num in formula:
+                formula_ret += float(num)
+        return formula_ret
+
+
+ARITHMETIC_SAMPLES = ("3+5", "12-7", "6*8", "9/3", "(3+5)*2", "2*(3+4)-1", "10-2*3", "(8-2)/(1+2)")
+
+
+def bench_arithmetic(times: int):
+    legacy = LegacyArithmetic()
+    arithmetic = Arithmetic()
+    formulas = ["{}=?".format(f) for f in ARITHMETIC_SAMPLES]
+    # The legacy evaluator ignores neither `=` nor `?`, it is fed the bare formulas.
+    before = timeit(lambda: [legacy.calc(f.split('=')[0]) for f in formulas], times) / len(formulas)
+    cold = timeit(lambda: [Arithmetic.evaluate.__wrapped__(f) for f in formulas], times) / len(formulas)
+    after = timeit(lambda: [arithmetic.calc(f) for f in formulas], times) / len(formulas)
+    parity = all(legacy.calc(f.split('=')[0]) == arithmetic.calc(f) for f in formulas)
+    print("[Arithmetic] Before[{:.4f} ms] - After[{:.4f} ms] - Memoized[{:.4f} ms] - Parity[{}]".format(
+        before, cold, after, parity
+    ))
+
+
+def bench_preprocess(model: ModelConfig, image_bytes: bytes, times: int, param_key=None):
+    plan = model.preprocess_plan
+    output_shape = plan.output_shape
+    out = np.empty(output_shape, dtype=plan.dtype) if output_shape else None
+
+    # Both sides are measured up to a contiguous tensor that can be fed to the session.
+    before = timeit(lambda: np.asarray([legacy_load_image(model, image_bytes, param_key=param_key)]), times)
+    after = timeit(lambda: plan.apply(PIL_Image.open(io.BytesIO(image_bytes)), param_key=param_key, out=out), times)
+    parity = np.array_equal(
+        legacy_load_image(model, image_bytes, param_key=param_key),
+        normalized(plan.apply(PIL_Image.open(io.BytesIO(image_bytes)), param_key=param_key))
+    )
+    print("[Preprocess] {} - Before[{:.3f} ms] - After[{:.3f} ms] - Parity[{}]".format(
+        model.model_name, before, after, parity
+    ))
+
+
+def normalized(tensor: np.ndarray):
+    # The uint8 tensors are normalized by the graph.
+    return tensor / np.float32(255.) if tensor.dtype == np.uint8 else tensor
+
+
+def plan_variant(model: ModelConfig, **kwargs):
+    variant = copy.copy(model)
+    for key, value in kwargs.items():
+        setattr(variant, key, value)
+    return PreprocessPlan(variant)
+
+
+def bench_uint8(model: ModelConfig, samples: list, times: int, param_key=None):
+    # The float32 resize (as trained) against the uint8 resize, the difference is reported in pixel levels.
+    baseline = plan_variant(model, uint8_resize=False, input_dtype='float32')
+    candidate = plan_variant(model, uint8_resize=True, input_dtype='float32')
+    raw = plan_variant(model, uint8_resize=True, input_dtype='uint8')
+    times = max(times // len(samples), 1)
+    for name, plan in (('Float32', baseline), ('Uint8Resize', candidate), ('InputDtype.uint8', raw)):
+        cost = timeit(lambda: [
+            plan.apply(PIL_Image.open(io.BytesIO(sample)), param_key=param_key) for sample in samples
+        ], times) / len(samples)
+        diff = np.array([
+            np.abs(
+                normalized(plan.apply(PIL_Image.open(io.BytesIO(sample)), param_key=param_key)) -
+                baseline.apply(PIL_Image.open(io.BytesIO(sample)), param_key=param_key)
+            ).max() * 255 for sample in samples
+        ])
+        print("[Uint8] {} - {} - Cost[{:.3f} ms] - MaxDiff[{:.3f}] - Exact[{}/{}]".format(
+            model.model_name, name, cost, diff.max(), int((diff == 0).sum()), len(samples)
+        ))
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-c', '--config', type="str", default='config.yaml', dest="config")
+    parser.add_option('-m', '--model', type="str", dest="model")
+    parser.add_option('-i', '--image', type="str", default=None, dest="image")
+    parser.add_option('-k', '--param_key', type="str", default=None, dest="param_key")
+    parser.add_option('-n', '--times', type="int", default=1000, dest="times")
+    parser.add_option('-a', '--arithmetic', action="store_true", default=False, dest="arithmetic")
+    parser.add_option('-u', '--uint8', action="store_true", default=False, dest="uint8")
+    opt, args = parser.parse_args()
+
+    if opt.arithmetic:
+        bench_arithmetic(opt.times)
+        exit(0)
+
+    system_config = Config(conf_path=opt.config, model_path="model", graph_path="graph")
+    model_conf = ModelConfig(system_config, opt.model)
+    if opt.image:
+        with open(opt.image, "rb") as f:
+            sample = f.read()
+    else:
+        sample = sample_bytes(model_conf)
+    if opt.uint8:
+        bench_uint8(model_conf, [sample] + [sample_bytes(model_conf, resized=True) for _ in range(15)], opt.times)
+        exit(0)
+    bench_preprocess(model_conf, sample, opt.times, opt.param_key)
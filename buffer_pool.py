@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import weakref
+import numpy as np
+
+
+class Lease(object):
+    """The lease of a leased buffer, the buffer is released once the lease is garbage collected."""
+
+
+class LeasedView(np.ndarray):
+    """A view of a leased buffer, the view and the views taken from it keep the lease alive."""
+
+    def __new__(cls, array: np.ndarray, lease: Lease):
+        view = array.view(cls)
+        view.lease = lease
+        return view
+
+    def __array_finalize__(self, obj):
+        self.lease = getattr(obj, 'lease', None)
+
+
+def lease(array: np.ndarray, callback, *args):
+    view = LeasedView(array, Lease())
+    weakref.finalize(view.lease, callback, *args)
+    return view
+
+
+class BatchBufferPool(object):
+    """
+    The contiguous batch tensors of one interface, reused instead of being allocated (and stacked) per batch.
+    The buffers are kept by batch size rounded up to a power of two, at most `max_buffers` of each size,
+    a batch gets the first rows of a buffer as a contiguous view which is fed to the session as it is.
+    The buffer returns to the pool when the last view of the batch is released.
+    """
+
+    def __init__(self, shape: tuple, dtype, max_buffers=4):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.max_buffers = max(int(max_buffers), 0)
+        # No lock, the release may run from the garbage collector in the middle of an acquire.
+        self.free = {}
+
+    @staticmethod
+    def bucket(size: int):
+        return 1 << (max(int(size), 1) - 1).bit_length()
+
+    def acquire(self, size: int) -> LeasedView:
+        bucket = self.bucket(size)
+        try:
+            buffer = self.free.get(bucket, []).pop()
+        except IndexError:
+            buffer = np.empty((bucket, ) + self.shape, dtype=self.dtype)
+        return lease(buffer[:size], self.release, bucket, buffer)
+
+    def release(self, bucket: int, buffer: np.ndarray):
+        buffers = self.free.setdefault(bucket, [])
+        if len(buffers) < self.max_buffers:
+            buffers.append(buffer)
+
+    def stack(self, images: list) -> LeasedView:
+        batch = self.acquire(len(images))
+        np.stack(images, out=batch)
+        return batch
@@ -1,12 +1,11 @@
+# -*- coding: utf-8 -*-
 # Generated by the protocol buffer compiler.  DO NOT EDIT!
 # source: grpc.proto
-
-import sys
-_b=sys.version_info[0]<3 and (lambda x:x) or (lambda x:x.encode('latin1'))
+"""Generated protocol buffer code."""
 from google.protobuf import descriptor as _descriptor
-from google.protobuf import message as _message
-from google.protobuf import reflection as _reflection
+from google.protobuf import descriptor_pool as _descriptor_pool
 from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
 # @@protoc_insertion_point(imports)
 
 _sym_db = _symbol_database.Default()
@@ -14,168 +13,21 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor.FileDescriptor(
-  name='grpc.proto',
-  package='',
-  syntax='proto3',
-  serialized_options=None,
-  serialized_pb=_b('\n\ngrpc.proto\"\x83\x01\n\x0ePredictRequest\x12\r\n\x05image\x18\x01 \x01(\t\x12\x12\n\nsplit_char\x18\x02 \x01(\t\x12\x12\n\nmodel_name\x18\x03 \x01(\t\x12\x12\n\nmodel_type\x18\x04 \x01(\t\x12\x12\n\nmodel_site\x18\x05 \x01(\t\x12\x12\n\nneed_color\x18\x06 \x01(\t\">\n\rPredictResult\x12\x0e\n\x06result\x18\x01 \x01(\t\x12\x0c\n\x04\x63ode\x18\x02 \x01(\x05\x12\x0f\n\x07success\x18\x03 \x01(\x08\x32\x37\n\x07Predict\x12,\n\x07predict\x12\x0f.PredictRequest\x1a\x0e.PredictResult\"\x00\x62\x06proto3')
-)
-
-
-
-
-_PREDICTREQUEST = _descriptor.Descriptor(
-  name='PredictRequest',
-  full_name='PredictRequest',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  fields=[
-    _descriptor.FieldDescriptor(
-      name='image', full_name='PredictRequest.image', index=0,
-      number=1, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=_b("").decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR),
-    _descriptor.FieldDescriptor(
-      name='split_char', full_name='PredictRequest.split_char', index=1,
-      number=2, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=_b("").decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR),
-    _descriptor.FieldDescriptor(
-      name='model_name', full_name='PredictRequest.model_name', index=2,
-      number=3, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=_b("").decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR),
-    _descriptor.FieldDescriptor(
-      name='model_type', full_name='PredictRequest.model_type', index=3,
-      number=4, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=_b("").decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR),
-    _descriptor.FieldDescriptor(
-      name='model_site', full_name='PredictRequest.model_site', index=4,
-      number=5, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=_b("").decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR),
-    _descriptor.FieldDescriptor(
-      name='need_color', full_name='PredictRequest.need_color', index=5,
-      number=6, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=_b("").decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  serialized_options=None,
-  is_extendable=False,
-  syntax='proto3',
-  extension_ranges=[],
-  oneofs=[
-  ],
-  serialized_start=15,
-  serialized_end=146,
-)
-
-
-_PREDICTRESULT = _descriptor.Descriptor(
-  name='PredictResult',
-  full_name='PredictResult',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  fields=[
-    _descriptor.FieldDescriptor(
-      name='result', full_name='PredictResult.result', index=0,
-      number=1, type=9, cpp_type=9, label=1,
-      has_default_value=False, default_value=_b("").decode('utf-8'),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR),
-    _descriptor.FieldDescriptor(
-      name='code', full_name='PredictResult.code', index=1,
-      number=2, type=5, cpp_type=1, label=1,
-      has_default_value=False, default_value=0,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR),
-    _descriptor.FieldDescriptor(
-      name='success', full_name='PredictResult.success', index=2,
-      number=3, type=8, cpp_type=7, label=1,
-      has_default_value=False, default_value=False,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      serialized_options=None, file=DESCRIPTOR),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  serialized_options=None,
-  is_extendable=False,
-  syntax='proto3',
-  extension_ranges=[],
-  oneofs=[
-  ],
-  serialized_start=148,
-  serialized_end=210,
-)
-
-DESCRIPTOR.message_types_by_name['PredictRequest'] = _PREDICTREQUEST
-DESCRIPTOR.message_types_by_name['PredictResult'] = _PREDICTRESULT
-_sym_db.RegisterFileDescriptor(DESCRIPTOR)
-
-PredictRequest = _reflection.GeneratedProtocolMessageType('PredictRequest', (_message.Message,), dict(
-  DESCRIPTOR = _PREDICTREQUEST,
-  __module__ = 'grpc_pb2'
-  # @@protoc_insertion_point(class_scope:PredictRequest)
-  ))
-_sym_db.RegisterMessage(PredictRequest)
-
-PredictResult = _reflection.GeneratedProtocolMessageType('PredictResult', (_message.Message,), dict(
-  DESCRIPTOR = _PREDICTRESULT,
-  __module__ = 'grpc_pb2'
-  # @@protoc_insertion_point(class_scope:PredictResult)
-  ))
-_sym_db.RegisterMessage(PredictResult)
-
-
-
-_PREDICT = _descriptor.ServiceDescriptor(
-  name='Predict',
-  full_name='Predict',
-  file=DESCRIPTOR,
-  index=0,
-  serialized_options=None,
-  serialized_start=212,
-  serialized_end=267,
-  methods=[
-  _descriptor.MethodDescriptor(
-    name='predict',
-    full_name='Predict.predict',
-    index=0,
-    containing_service=None,
-    input_type=_PREDICTREQUEST,
-    output_type=_PREDICTRESULT,
-    serialized_options=None,
-  ),
-])
-_sym_db.RegisterServiceDescriptor(_PREDICT)
-
-DESCRIPTOR.services_by_name['Predict'] = _PREDICT
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\ngrpc.proto\"\xb7\x01\n\x0ePredictRequest\x12\r\n\x05image\x18\x01 \x01(\t\x12\x12\n\nsplit_char\x18\x02 \x01(\t\x12\x12\n\nmodel_name\x18\x03 \x01(\t\x12\x12\n\nmodel_type\x18\x04 \x01(\t\x12\x12\n\nmodel_site\x18\x05 \x01(\t\x12\x12\n\nneed_color\x18\x06 \x01(\t\x12\x13\n\x0bimage_bytes\x18\x07 \x01(\x0c\x12\x11\n\tparam_key\x18\x08 \x01(\t\x12\n\n\x02id\x18\t \x01(\t\"J\n\rPredictResult\x12\x0e\n\x06result\x18\x01 \x01(\t\x12\x0c\n\x04\x63ode\x18\x02 \x01(\x05\x12\x0f\n\x07success\x18\x03 \x01(\x08\x12\n\n\x02id\x18\x04 \x01(\t\"5\n\x13PredictBatchRequest\x12\x1e\n\x05items\x18\x01 \x03(\x0b\x32\x0f.PredictRequest\"5\n\x12PredictBatchResult\x12\x1f\n\x07results\x18\x01 \x03(\x0b\x32\x0e.PredictResult2\xac\x01\n\x07Predict\x12,\n\x07predict\x12\x0f.PredictRequest\x1a\x0e.PredictResult\"\x00\x12\x36\n\rPredictStream\x12\x0f.PredictRequest\x1a\x0e.PredictResult\"\x00(\x01\x30\x01\x12;\n\x0cPredictBatch\x12\x14.PredictBatchRequest\x1a\x13.PredictBatchResult\"\x00\x62\x06proto3')
 
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'grpc_pb2', _globals)
+if _descriptor._USE_C_DESCRIPTORS == False:
+  DESCRIPTOR._options = None
+  _globals['_PREDICTREQUEST']._serialized_start=15
+  _globals['_PREDICTREQUEST']._serialized_end=198
+  _globals['_PREDICTRESULT']._serialized_start=200
+  _globals['_PREDICTRESULT']._serialized_end=274
+  _globals['_PREDICTBATCHREQUEST']._serialized_start=276
+  _globals['_PREDICTBATCHREQUEST']._serialized_end=329
+  _globals['_PREDICTBATCHRESULT']._serialized_start=331
+  _globals['_PREDICTBATCHRESULT']._serialized_end=384
+  _globals['_PREDICT']._serialized_start=387
+  _globals['_PREDICT']._serialized_end=559
 # @@protoc_insertion_point(module_scope)
@@ -1,46 +1,132 @@
 # Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
+"""Client and server classes corresponding to protobuf-defined services."""
 import grpc
 
 from compat import grpc_pb2 as grpc__pb2
 
 
 class PredictStub(object):
-  # missing associated documentation comment in .proto file
-  pass
+    """Missing associated documentation comment in .proto file."""
 
-  def __init__(self, channel):
-    """Constructor.
+    def __init__(self, channel):
+        """Constructor.
 
-    Args:
-      channel: A grpc.Channel.
-    """
-    self.predict = channel.unary_unary(
-        '/Predict/predict',
-        request_serializer=grpc__pb2.PredictRequest.SerializeToString,
-        response_deserializer=grpc__pb2.PredictResult.FromString,
-        )
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.predict = channel.unary_unary(
+                '/Predict/predict',
+                request_serializer=grpc__pb2.PredictRequest.SerializeToString,
+                response_deserializer=grpc__pb2.PredictResult.FromString,
+                )
+        self.PredictStream = channel.stream_stream(
+                '/Predict/PredictStream',
+                request_serializer=grpc__pb2.PredictRequest.SerializeToString,
+                response_deserializer=grpc__pb2.PredictResult.FromString,
+                )
+        self.PredictBatch = channel.unary_unary(
+                '/Predict/PredictBatch',
+                request_serializer=grpc__pb2.PredictBatchRequest.SerializeToString,
+                response_deserializer=grpc__pb2.PredictBatchResult.FromString,
+                )
 
 
 class PredictServicer(object):
-  # missing associated documentation comment in .proto file
-  pass
+    """Missing associated documentation comment in .proto file."""
 
-  def predict(self, request, context):
-    # missing associated documentation comment in .proto file
-    pass
-    context.set_code(grpc.StatusCode.UNIMPLEMENTED)
-    context.set_details('Method not implemented!')
-    raise NotImplementedError('Method not implemented!')
+    def predict(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def PredictStream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def PredictBatch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
 
 
 def add_PredictServicer_to_server(servicer, server):
-  rpc_method_handlers = {
-      'predict': grpc.unary_unary_rpc_method_handler(
-          servicer.predict,
-          request_deserializer=grpc__pb2.PredictRequest.FromString,
-          response_serializer=grpc__pb2.PredictResult.SerializeToString,
-      ),
-  }
-  generic_handler = grpc.method_handlers_generic_handler(
-      'Predict', rpc_method_handlers)
-  server.add_generic_rpc_handlers((generic_handler,))
+    rpc_method_handlers = {
+            'predict': grpc.unary_unary_rpc_method_handler(
+                    servicer.predict,
+                    request_deserializer=grpc__pb2.PredictRequest.FromString,
+                    response_serializer=grpc__pb2.PredictResult.SerializeToString,
+            ),
+            'PredictStream': grpc.stream_stream_rpc_method_handler(
+                    servicer.PredictStream,
+                    request_deserializer=grpc__pb2.PredictRequest.FromString,
+                    response_serializer=grpc__pb2.PredictResult.SerializeToString,
+            ),
+            'PredictBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.PredictBatch,
+                    request_deserializer=grpc__pb2.PredictBatchRequest.FromString,
+                    response_serializer=grpc__pb2.PredictBatchResult.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'Predict', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+
+
+ # This class is part of an EXPERIMENTAL API.
+class Predict(object):
+    """Missing associated documentation comment in .proto file."""
+
+    @staticmethod
+    def predict(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Predict/predict',
+            grpc__pb2.PredictRequest.SerializeToString,
+            grpc__pb2.PredictResult.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def PredictStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(request_iterator, target, '/Predict/PredictStream',
+            grpc__pb2.PredictRequest.SerializeToString,
+            grpc__pb2.PredictResult.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def PredictBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/Predict/PredictBatch',
+            grpc__pb2.PredictBatchRequest.SerializeToString,
+            grpc__pb2.PredictBatchResult.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
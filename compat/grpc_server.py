@@ -3,73 +3,295 @@
 # Author: kerlomz <kerlomz@gmail.com>
 
 import time
+import json
+import asyncio
 import threading
 from concurrent import futures
 
 import grpc
 from compat import grpc_pb2_grpc, grpc_pb2
 import optparse
-from utils import ImageUtils
-from interface import InterfaceManager
+from utils import ImageUtils, Arithmetic
+from interface import InterfaceManager, Interface
+from executor import ExecutorManager, ExecutorOverload
+from result_cache import ResultCache
 from config import Config
+from constants import Response
 from middleware import *
+import metrics
 from event_loop import event_loop
 
 _ONE_DAY_IN_SECONDS = 60 * 60 * 24
 
+arithmetic = Arithmetic()
+
 
 class Predict(grpc_pb2_grpc.PredictServicer):
+    """
+    The requests share the path of the HTTP server: the result cache, the preprocess executor
+    and the batch scheduler of the model, the concurrent requests of a model are run as one batch.
+    The image is either the base64 `image` or the raw `image_bytes`, the `id` is echoed in the result.
+    """
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.image_utils = ImageUtils(system_config)
+        self.status_bool_key = system_config.response_def_map['StatusBool']
+        self.status_code_key = system_config.response_def_map['StatusCode']
+        self.exception = Response(system_config.response_def_map)
 
-    def predict(self, request, context):
-        start_time = time.time()
-        bytes_batch, status = self.image_utils.get_bytes_batch(request.image)
+    @staticmethod
+    def result(request, result="", code=0, success=None, model_name=''):
+        metrics.requests_total.inc(model=model_name, code=code)
+        return grpc_pb2.PredictResult(
+            result=result, code=code, success=code == 0 if success is None else success, id=request.id
+        )
 
+    @staticmethod
+    def calc_arithmetic(interface: Interface, result: str):
+        if 'ARITHMETIC' in interface.model_category:
+            if '=' in result or '+' in result or '-' in result or '×' in result or '÷' in result:
+                value = arithmetic.calc(result)
+                # The malformed formula is returned as it was recognized.
+                result = result if value is None else str(int(value))
+        return result
+
+    def prepare(self, request):
+        # Returns the result when the request is answered without the session, otherwise the job to run.
         if interface_manager.total == 0:
             logger.info('There is currently no model deployment and services are not available.')
-            return {"result": "", "success": False, "code": -999}
+            return self.result(request, code=-999), None
 
+        with metrics.timer('base64_decode'):
+            bytes_batch, status = self.image_utils.get_bytes_batch(request.image_bytes or request.image)
         if not bytes_batch:
-            return grpc_pb2.PredictResult(result="", success=status['success'], code=status['code'])
+            return self.result(request, code=status[self.status_code_key], success=status[self.status_bool_key]), None
 
-        image_sample = bytes_batch[0]
-        image_size = ImageUtils.size_of_image(image_sample)
+        image_size = ImageUtils.size_of_image(bytes_batch[0])
         size_string = "{}x{}".format(image_size[0], image_size[1])
+        # The interface is held until the job is finished, a swap drains it instead of closing it under us.
         if request.model_name:
-            interface = interface_manager.get_by_name(request.model_name)
+            interface = interface_manager.get_by_name(request.model_name, acquire=True)
         else:
-            interface = interface_manager.get_by_size(size_string)
+            interface = interface_manager.get_by_size(size_string, acquire=True)
         if not interface:
             logger.info('Service is not ready!')
-            return {"result": "", "success": False, "code": 999}
+            return self.result(request, code=999), None
+        try:
+            result, job = self.prepare_job(request, interface, bytes_batch, size_string)
+        except BaseException:
+            interface.release()
+            raise
+        if job is None:
+            interface.release()
+        return result, job
+
+    def prepare_job(self, request, interface: Interface, bytes_batch: list, size_string: str):
+        model_conf = interface.model_conf
+        param_key = request.param_key or None
+        exec_map = model_conf.exec_map
+        if exec_map and len(exec_map.keys()) > 1 and not param_key:
+            return self.result(request, "Missing the parameter [param_key].", 474, model_name=interface.name), None
+        elif exec_map and param_key and param_key not in exec_map:
+            return self.result(request, "Not support the parameter [param_key].", 474, model_name=interface.name), None
+        elif exec_map and len(exec_map.keys()) == 1:
+            param_key = list(exec_map.keys())[0]
+        output_split = request.split_char if request.split_char else model_conf.output_split
 
-        if request.need_color:
-            bytes_batch = [color_extract.separate_color(_, color_map[request.need_color]) for _ in bytes_batch]
+        cache_key = result_cache.key(bytes_batch, interface, param_key, output_split=output_split)
+        result = result_cache.get(cache_key)
+        if result is not None:
+            return self.result(request, result, model_name=interface.name), None
 
-        image_batch, status = ImageUtils.get_image_batch(interface.model_conf, bytes_batch)
+        if model_conf.corp_params:
+            bytes_batch = corp_to_multi.parse_multi_img(bytes_batch, model_conf.corp_params)
+        if model_conf.pre_freq_frames != -1:
+            bytes_batch = gif_frames.all_frames(bytes_batch)
 
-        if not image_batch:
-            return grpc_pb2.PredictResult(result="", success=status['success'], code=status['code'])
+        return None, dict(
+            request=request,
+            interface=interface,
+            images=bytes_batch,
+            param_key=param_key,
+            output_split=output_split,
+            cache_key=cache_key,
+            size=size_string,
+            start_time=time.time()
+        )
 
-        result = interface.predict_batch(image_batch, request.split_char)
+    def finish(self, job: dict, texts: list):
+        interface: Interface = job['interface']
+        model_conf = interface.model_conf
+        request = job['request']
+        if model_conf.pre_freq_frames != -1:
+            result = gif_frames.get_continuity_max([
+                i for i in texts if model_conf.max_label_num >= len(i) >= model_conf.min_label_num
+            ])
+        else:
+            result = self.calc_arithmetic(interface, job['output_split'].join(texts))
+        if model_conf.corp_params and model_conf.output_coord:
+            # The result field is a string, the coordinates are sent as their JSON text.
+            result = json.dumps(
+                corp_to_multi.get_coordinate(label=result, param_group=model_conf.corp_params, title_index=[0])
+            )
+        result_cache.put(job['cache_key'], result)
         logger.info('[{}] - Size[{}] - Type[{}] - Site[{}] - Predict Result[{}] - {} ms'.format(
             interface.name,
-            size_string,
+            job['size'],
             request.model_type,
             request.model_site,
             result,
-            (time.time() - start_time) * 1000
+            round((time.time() - job['start_time']) * 1000)
         ))
-        return grpc_pb2.PredictResult(result=result, success=status['success'], code=status['code'])
+        return self.result(request, result, model_name=interface.name)
+
+    def failure(self, job: dict, e: Exception):
+        interface: Interface = job['interface']
+        code = 503 if isinstance(e, ExecutorOverload) else 500
+        if code == 500:
+            logger.error('[{}] - Prediction failed: {}'.format(interface.name, e))
+        return self.result(job['request'], system_config.error_message[code], code, model_name=interface.name)
+
+    def run(self, job: dict) -> futures.Future:
+        # Preprocess on the preprocess executor and predict through the batch scheduler of the model,
+        # the returned future always resolves to a PredictResult.
+        future = futures.Future()
+        interface: Interface = job['interface']
+        future.add_done_callback(interface.release)
+
+        def predicted(f):
+            try:
+                future.set_result(self.finish(job, f.result()))
+            except Exception as e:
+                future.set_result(self.failure(job, e))
+
+        def preprocessed(f):
+            try:
+                image_batch, status = f.result()
+                if image_batch is None:
+                    return future.set_result(self.result(
+                        job['request'],
+                        code=status[self.status_code_key],
+                        success=status[self.status_bool_key],
+                        model_name=interface.name
+                    ))
+                interface.predict_texts_async(image_batch).add_done_callback(predicted)
+            except Exception as e:
+                future.set_result(self.failure(job, e))
+
+        try:
+            executor_manager.preprocess.submit(
+                interface.get_image_batch, job['images'], param_key=job['param_key']
+            ).add_done_callback(preprocessed)
+        except ExecutorOverload as e:
+            future.set_result(self.failure(job, e))
+        return future
+
+    def submit(self, request) -> futures.Future:
+        # Every request gets a PredictResult, an error never escapes to the stream of the request.
+        try:
+            result, job = self.prepare(request)
+        except (OSError, ValueError):
+            status = self.exception.IMAGE_DAMAGE
+            result = self.result(request, code=status[self.status_code_key], success=status[self.status_bool_key])
+            job = None
+        except Exception as e:
+            logger.error('Prediction failed: {}'.format(e))
+            result = self.result(request, system_config.error_message[500], 500)
+            job = None
+        if job is None:
+            future = futures.Future()
+            future.set_result(result)
+            return future
+        return self.run(job)
+
+    def predict(self, request, context):
+        return self.submit(request).result()
+
+    def PredictStream(self, request_iterator, context):
+        # The results are returned in the order of the requests.
+        for request in request_iterator:
+            yield self.submit(request).result()
+
+    def PredictBatch(self, request, context):
+        # The items are submitted together, the batch scheduler groups the items of the same model.
+        submitted = [self.submit(item) for item in request.items]
+        return grpc_pb2.PredictBatchResult(results=[future.result() for future in submitted])
+
+
+class AsyncPredict(Predict):
+    """
+    The `grpc.aio` servicer, the requests of a stream are predicted concurrently (at most `stream_concurrency`
+    of them in flight) and their results are returned as soon as they complete, matched by the `id`.
+    """
+
+    def __init__(self, stream_concurrency=64, **kwargs):
+        super().__init__(**kwargs)
+        self.stream_concurrency = stream_concurrency
+
+    async def predict(self, request, context):
+        # The request is prepared (decode, size probe, cache key, crops and frames) on the preprocess executor,
+        # the event loop only awaits it.
+        try:
+            future = await asyncio.get_running_loop().run_in_executor(
+                executor_manager.preprocess, self.submit, request
+            )
+        except ExecutorOverload:
+            return self.result(request, system_config.error_message[503], 503)
+        return await asyncio.wrap_future(future)
+
+    async def PredictStream(self, request_iterator, context):
+        semaphore = asyncio.Semaphore(self.stream_concurrency)
+        queue = asyncio.Queue()
+        total = 0
+
+        def done(task):
+            semaphore.release()
+            queue.put_nowait(task)
+
+        async def read():
+            nonlocal total
+            try:
+                async for request in request_iterator:
+                    await semaphore.acquire()
+                    total += 1
+                    asyncio.ensure_future(self.predict(request, context)).add_done_callback(done)
+            finally:
+                queue.put_nowait(None)
+
+        reader = asyncio.ensure_future(read())
+        finished = False
+        sent = 0
+        while not finished or sent < total:
+            task = await queue.get()
+            if task is None:
+                finished = True
+                continue
+            sent += 1
+            yield task.result()
+        await reader
+
+    async def PredictBatch(self, request, context):
+        results = await asyncio.gather(*[self.predict(item, context) for item in request.items])
+        return grpc_pb2.PredictBatchResult(results=results)
+
+
+def server_options():
+    options = [
+        ('grpc.max_receive_message_length', system_config.stream_max_body_size),
+        ('grpc.max_send_message_length', system_config.stream_max_body_size),
+    ]
+    return options
 
 
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=opt.workers),
+        options=server_options(),
+        maximum_concurrent_rpcs=opt.max_concurrent_rpcs or None
+    )
     grpc_pb2_grpc.add_PredictServicer_to_server(Predict(), server)
-    server.add_insecure_port('[::]:50054')
+    server.add_insecure_port('[::]:{}'.format(server_port))
     server.start()
     try:
         while True:
@@ -78,23 +300,45 @@ def serve():
         server.stop(0)
 
 
+async def serve_async():
+    server = grpc.aio.server(options=server_options(), maximum_concurrent_rpcs=opt.max_concurrent_rpcs or None)
+    grpc_pb2_grpc.add_PredictServicer_to_server(AsyncPredict(stream_concurrency=opt.stream_concurrency), server)
+    server.add_insecure_port('[::]:{}'.format(server_port))
+    await server.start()
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(0)
+
+
 if __name__ == '__main__':
     parser = optparse.OptionParser()
     parser.add_option('-p', '--port', type="int", default=50054, dest="port")
     parser.add_option('-c', '--config', type="str", default='./config.yaml', dest="config")
     parser.add_option('-m', '--model_path', type="str", default='model', dest="model_path")
     parser.add_option('-g', '--graph_path', type="str", default='graph', dest="graph_path")
+    parser.add_option('-w', '--workers', type="int", default=10, dest="workers")
+    parser.add_option('--max_concurrent_rpcs', type="int", default=0, dest="max_concurrent_rpcs")
+    parser.add_option('--stream_concurrency', type="int", default=64, dest="stream_concurrency")
+    parser.add_option('--aio', action="store_true", default=False, dest="aio")
     opt, args = parser.parse_args()
     server_port = opt.port
     conf_path = opt.config
     model_path = opt.model_path
     graph_path = opt.graph_path
     system_config = Config(conf_path=conf_path, model_path=model_path, graph_path=graph_path)
-    interface_manager = InterfaceManager()
+    executor_manager = ExecutorManager.shared(system_config)
+    result_cache = ResultCache(system_config)
+    interface_manager = InterfaceManager(cache=result_cache)
     threading.Thread(target=lambda: event_loop(system_config, model_path, interface_manager)).start()
 
     logger = system_config.logger
     server_host = "0.0.0.0"
 
-    logger.info('Running on http://{}:{}/ <Press CTRL + C to quit>'.format(server_host, server_port))
-    serve()
+    logger.info('Running on grpc://{}:{}/{} <Press CTRL + C to quit>'.format(
+        server_host, server_port, " - AsyncIO" if opt.aio else ""
+    ))
+    if opt.aio:
+        asyncio.run(serve_async())
+    else:
+        serve()
@@ -80,9 +80,9 @@ def common_request(request):
     if 'need_color' in request.json and request.json['need_color']:
         bytes_batch = [color_extract.separate_color(_, color_map[request.json['need_color']]) for _ in bytes_batch]
 
-    image_batch, response = ImageUtils.get_image_batch(interface.model_conf, bytes_batch)
+    image_batch, response = interface.get_image_batch(bytes_batch)
 
-    if not image_batch:
+    if image_batch is None:
         logger.error('[{}] - Size[{}] - Name[{}] - Response[{}] - {} ms'.format(
             interface.name, size_string, request.json.get('model_name'), response,
             (time.time() - start_time) * 1000)
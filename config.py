@@ -9,8 +9,10 @@ import yaml
 import hashlib
 import logging
 import logging.handlers
+import numpy as np
 from category import *
-from constants import SystemConfig, ModelField, ModelScene
+from pretreatment import PreprocessPlan
+from constants import SystemConfig, ModelField, ModelScene, ModelBackend
 
 MODEL_SCENE_MAP = {
     'Classification': ModelScene.Classification
@@ -21,6 +23,18 @@ MODEL_FIELD_MAP = {
     'Text': ModelField.Text
 }
 
+MODEL_BACKEND_MAP = {
+    'tensorflow': ModelBackend.TensorFlow,
+    'onnx': ModelBackend.ONNX,
+    'tflite': ModelBackend.TFLite
+}
+
+COMPILE_MODEL_SUFFIX = {
+    ModelBackend.TensorFlow: 'pb',
+    ModelBackend.ONNX: 'onnx',
+    ModelBackend.TFLite: 'tflite'
+}
+
 BLACKLIST_PATH = "blacklist.json"
 WHITELIST_PATH = "whitelist.json"
 
@@ -48,6 +62,16 @@ def get_default(src, default):
     return src if src else default
 
 
+def get_route_fill(src: list, default: list, classes: tuple):
+    if not src:
+        return default
+    routed = {i.get('Class') for i in src}
+    missing = [i for i in default if i['Class'] in classes and i['Class'] not in routed]
+    # The routes are matched in order, the missing ones go before the catch-all route.
+    position = next((index for index, i in enumerate(src) if i.get('Route') == '.*'), len(src))
+    return src[:position] + missing + src[position:]
+
+
 def get_dict_fill(src: dict, default: dict):
     if not src:
         return default
@@ -80,16 +104,22 @@ def whitelist() -> list:
         return ["127.0.0.1", "localhost"]
 
 
-def set_blacklist(ip):
+def save_blacklist(addresses: list):
+    # Written to a temporary file first, the readers never see a partial list.
     try:
-        old_blacklist = blacklist()
-        old_blacklist.append(ip)
-        with open(BLACKLIST_PATH, "w+", encoding="utf8") as f_blacklist:
-            f_blacklist.write(json.dumps(old_blacklist, ensure_ascii=False, indent=2))
+        with open(BLACKLIST_PATH + ".tmp", "w", encoding="utf8") as f_blacklist:
+            f_blacklist.write(json.dumps(list(addresses), ensure_ascii=False, indent=2))
+        os.replace(BLACKLIST_PATH + ".tmp", BLACKLIST_PATH)
     except Exception as e:
         print(e)
 
 
+def set_blacklist(ip):
+    old_blacklist = blacklist()
+    old_blacklist.append(ip)
+    save_blacklist(old_blacklist)
+
+
 class Config(object):
     def __init__(self, conf_path: str, graph_path: str = None, model_path: str = None):
         self.model_path = model_path
@@ -104,7 +134,9 @@ class Config(object):
             self.default_port = 19952
         self.split_flag = self.sys_cf['System']['SplitFlag']
         self.split_flag = self.split_flag if isinstance(self.split_flag, bytes) else SystemConfig.split_flag
-        self.route_map = get_default(self.sys_cf.get('RouteMap'), SystemConfig.default_route)
+        self.route_map = get_route_fill(
+            self.sys_cf.get('RouteMap'), SystemConfig.default_route, SystemConfig.merged_route_classes
+        )
         self.log_path = "logs"
         self.request_def_map = get_default(self.sys_cf.get('RequestDef'), SystemConfig.default_config['RequestDef'])
         self.response_def_map = get_default(self.sys_cf.get('ResponseDef'), SystemConfig.default_config['ResponseDef'])
@@ -133,6 +165,61 @@ class Config(object):
             default={}
         )
         self.blacklist_trigger_times = get_default(self.sys_cf['System'].get("BlacklistTriggerTimes"), -1)
+        self.max_batch_size = get_default(self.sys_cf['System'].get("MaxBatchSize"), 32)
+        self.max_batch_wait = get_default(self.sys_cf['System'].get("MaxBatchWait"), 0)
+        self.model_load_workers = get_default(self.sys_cf['System'].get("ModelLoadWorkers"), 4)
+        # The default number of worker processes of a model with ProcessPool, every such model has its own.
+        self.process_pool_workers = get_default(self.sys_cf['System'].get("ProcessPoolWorkers"), 2)
+        self.stream_max_body_size = get_default(self.sys_cf['System'].get("StreamMaxBodySize"), 10485760)
+        self.batch_max_items = get_default(self.sys_cf['System'].get("BatchMaxItems"), 256)
+        self.hot_reload_conf: dict = get_dict_fill(
+            self.sys_cf['System'].get('HotReload'), dict(SystemConfig.default_config['System']['HotReload'])
+        )
+        self.reload_debounce = self.hot_reload_conf.get('Debounce')
+        self.drain_timeout = self.hot_reload_conf.get('DrainTimeout')
+        self.warm_up_conf: dict = get_dict_fill(
+            self.sys_cf['System'].get('WarmUp'), dict(SystemConfig.default_config['System']['WarmUp'])
+        )
+        self.warm_up_enable = self.warm_up_conf.get('Enable')
+        self.warm_up_batch_sizes = self.warm_up_conf.get('BatchSizes')
+        self.warm_up_rounds = self.warm_up_conf.get('Rounds')
+
+        self.executor_conf: dict = get_dict_fill(
+            self.sys_cf['System'].get('Executor'), dict(SystemConfig.default_config['System']['Executor'])
+        )
+        self.executor_decode_workers = get_default(
+            src=self.executor_conf.get('DecodeWorkers'),
+            default=os.cpu_count() or 1
+        )
+        self.executor_preprocess_workers = get_default(
+            src=self.executor_conf.get('PreprocessWorkers'),
+            default=os.cpu_count() or 1
+        )
+        self.executor_inference_workers = self.executor_conf.get('InferenceWorkers')
+        self.executor_io_workers = self.executor_conf.get('IOWorkers')
+        self.executor_max_queue_size = self.executor_conf.get('MaxQueueSize')
+        self.executor_model_concurrency = self.executor_conf.get('ModelConcurrency')
+
+        self.result_cache_conf: dict = get_dict_fill(
+            self.sys_cf['System'].get('ResultCache'), dict(SystemConfig.default_config['System']['ResultCache'])
+        )
+        self.result_cache_enable = self.result_cache_conf.get('Enable')
+        self.result_cache_max_bytes = self.result_cache_conf.get('MaxBytes')
+        self.result_cache_ttl = self.result_cache_conf.get('TTL')
+
+        self.limiter_conf: dict = get_dict_fill(
+            self.sys_cf['System'].get('Limiter'), dict(SystemConfig.default_config['System']['Limiter'])
+        )
+        self.limiter_max_keys = self.limiter_conf.get('MaxKeys')
+
+        self.sample_writer_conf: dict = get_dict_fill(
+            self.sys_cf['System'].get('SampleWriter'), dict(SystemConfig.default_config['System']['SampleWriter'])
+        )
+        self.sample_rate = self.sample_writer_conf.get('SampleRate')
+        self.sample_shard_max_bytes = self.sample_writer_conf.get('ShardMaxBytes')
+        self.sample_shard_max_age = self.sample_writer_conf.get('ShardMaxAge')
+        self.sample_queue_size = self.sample_writer_conf.get('QueueSize')
+        self.sample_dedup_size = self.sample_writer_conf.get('DedupSize')
 
         self.use_whitelist: dict = get_default(
             src=self.sys_cf['System'].get('Whitelist'),
@@ -286,6 +373,27 @@ class ModelConfig(Model):
         self.checkpoint_tag = 'checkpoint'
         self.system_root: dict = self.model_conf['System']
         self.memory_usage: float = self.system_root.get('MemoryUsage')
+        self.backend_param: str = str(self.get_var(self.system_root, 'Backend', 'tensorflow')).lower()
+        self.backend: ModelBackend = ModelConfig.param_convert(
+            source=self.backend_param,
+            param_map=MODEL_BACKEND_MAP,
+            text="Current model backend ({backend}) is not supported".format(backend=self.backend_param),
+            code=50003
+        )
+        # ONNX Runtime session options, 0 lets the runtime decide the number of threads.
+        self.intra_op_threads: int = self.get_var(self.system_root, 'IntraOpThreads', 0)
+        self.inter_op_threads: int = self.get_var(self.system_root, 'InterOpThreads', 0)
+        self.graph_optimization: str = self.get_var(self.system_root, 'GraphOptimization', 'all')
+        self.execution_mode: str = self.get_var(self.system_root, 'ExecutionMode', 'sequential')
+        # Preprocess in worker processes, 0 workers is the System ProcessPoolWorkers and 0 slots is sized from the workers.
+        self.process_pool: bool = self.get_var(self.system_root, 'ProcessPool', False)
+        self.process_pool_workers: int = self.get_var(self.system_root, 'ProcessPoolWorkers', 0)
+        self.process_pool_slots: int = self.get_var(self.system_root, 'ProcessPoolSlots', 0)
+        # Resize in uint8, and the dtype of the graph input (uint8 feeds the raw pixels).
+        self.uint8_resize: bool = self.get_var(self.system_root, 'Uint8Resize', False)
+        self.input_dtype: str = self.get_var(self.system_root, 'InputDtype', 'float32')
+        # The reusable batch tensors kept per batch size (rounded up to a power of two), 0 disables them.
+        self.batch_buffers: int = self.get_var(self.system_root, 'BatchBuffers', 4)
 
         """FIELD PARAM - IMAGE"""
         self.field_root: dict = self.model_conf['FieldParam']
@@ -297,6 +405,8 @@ class ModelConfig(Model):
             )
         self.category: list = SPACE_TOKEN + self.category_value
         self.category_num: int = len(self.category)
+        # index -> token lookup, the extra slot decodes the blank (-1 and category_num).
+        self.category_table = np.array(self.category + [""], dtype=object)
         self.image_channel: int = self.field_root.get('ImageChannel')
         self.image_width: int = self.field_root.get('ImageWidth')
         self.image_height: int = self.field_root.get('ImageHeight')
@@ -320,9 +430,12 @@ class ModelConfig(Model):
         self.pre_blend_frames = self.get_var(self.pretreatment_root, 'BlendFrames', -1)
         self.pre_freq_frames = self.get_var(self.pretreatment_root, 'FreqFrames', -1)
         self.exec_map = self.get_var(self.pretreatment_root, 'ExecuteMap', None)
+        self.preprocess_plan = PreprocessPlan(self)
 
         """COMPILE_MODEL"""
-        self.compile_model_path = os.path.join(self.graph_path, '{}.pb'.format(self.model_name))
+        self.compile_model_path = os.path.join(
+            self.graph_path, '{}.{}'.format(self.model_name, COMPILE_MODEL_SUFFIX[self.backend])
+        )
         if not os.path.exists(self.compile_model_path):
             if not os.path.exists(self.graph_path):
                 os.makedirs(self.graph_path)
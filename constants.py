@@ -17,8 +17,19 @@ class ModelField(Enum):
     Text = 'Text'
 
 
+@unique
+class ModelBackend(Enum):
+    """推理后端枚举"""
+    TensorFlow = 'tensorflow'
+    ONNX = 'onnx'
+    TFLite = 'tflite'
+
+
 class SystemConfig:
     split_flag = b'\x99\x99\x99\x00\xff\xff\xff\x00\x99\x99\x99'
+    # The handlers added after the RouteMap of the existing deployments was written,
+    # their default routes are merged into a custom RouteMap that does not route them.
+    merged_route_classes = ("StreamHandler", "BatchHandler", "MetricsHandler")
     default_route = [
             {
                 "Class": "AuthHandler",
@@ -32,6 +43,14 @@ class SystemConfig:
                 "Class": "SimpleHandler",
                 "Route": "/captcha/v3"
             },
+            {
+                "Class": "StreamHandler",
+                "Route": "/captcha/stream"
+            },
+            {
+                "Class": "BatchHandler",
+                "Route": "/captcha/batch"
+            },
             {
                 "Class": "HeartBeatHandler",
                 "Route": "/check_backend_active.html"
@@ -48,6 +67,10 @@ class SystemConfig:
                 "Class": "ServiceHandler",
                 "Route": "/service/info"
             },
+            {
+                "Class": "MetricsHandler",
+                "Route": "/metrics"
+            },
             {
                 "Class": "FileHandler",
                 "Route": "/service/logs/(.*)",
@@ -73,6 +96,44 @@ class SystemConfig:
             "IllegalTimeMessage": "The maximum number of requests has been exceeded.",
             "ExceededMessage": "Illegal access time, please request in open hours.",
             "BlacklistTriggerTimes": -1,
+            "MaxBatchSize": 32,
+            "MaxBatchWait": 0,
+            "ModelLoadWorkers": 4,
+            "ProcessPoolWorkers": 2,
+            "StreamMaxBodySize": 10485760,
+            "BatchMaxItems": 256,
+            "HotReload": {
+                "Debounce": 1,
+                "DrainTimeout": 30
+            },
+            "WarmUp": {
+                "Enable": True,
+                "BatchSizes": [1, 8, 32],
+                "Rounds": 1
+            },
+            "Executor": {
+                "DecodeWorkers": 0,
+                "PreprocessWorkers": 0,
+                "InferenceWorkers": 4,
+                "IOWorkers": 2,
+                "MaxQueueSize": 1000,
+                "ModelConcurrency": 2
+            },
+            "ResultCache": {
+                "Enable": False,
+                "MaxBytes": 67108864,
+                "TTL": 300
+            },
+            "Limiter": {
+                "MaxKeys": 1000000
+            },
+            "SampleWriter": {
+                "SampleRate": 1.0,
+                "ShardMaxBytes": 268435456,
+                "ShardMaxAge": 3600,
+                "QueueSize": 10000,
+                "DedupSize": 100000
+            },
             "Whitelist": False,
             "ErrorMessage": {
                 400: "Bad Request",
@@ -80,7 +141,9 @@ class SystemConfig:
                 403: "Forbidden",
                 404: "404 Not Found",
                 405: "Method Not Allowed",
-                500: "Internal Server Error"
+                413: "Payload Too Large",
+                500: "Internal Server Error",
+                503: "Service Unavailable"
             }
         },
         "RouteMap": default_route,
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import io
+import cv2
+import numpy as np
+from PIL import Image as PIL_Image
+
+
+class DecodedImage(object):
+    """
+    One image of a request, parsed once and passed through the size routing, the middleware and the preprocessing.
+    Opening the PIL image only reads the header (size, mode, format), the pixels are decoded on first use.
+    The images produced by the middleware (crops, frames) are kept as arrays without any PNG round trip.
+    """
+
+    def __init__(self, raw: bytes = None, image_format: str = None, pil_image=None, array: np.ndarray = None):
+        self._raw = raw
+        self._pil = pil_image
+        self._array = array
+        self.format = image_format
+
+    @classmethod
+    def of(cls, image):
+        return image if isinstance(image, cls) else cls(raw=image)
+
+    @classmethod
+    def from_array(cls, array: np.ndarray):
+        return cls(array=array, image_format='array')
+
+    @property
+    def raw(self) -> bytes:
+        if self._raw is None:
+            array = self.array
+            if len(array.shape) == 3 and array.shape[2] == 3:
+                array = cv2.cvtColor(array, cv2.COLOR_RGB2BGR)
+            self._raw = bytes(bytearray(cv2.imencode('.png', array)[1]))
+        return self._raw
+
+    @property
+    def source(self):
+        # The form the image was parsed from (the encoded bytes or the pixels), to be sent to another process.
+        return self._raw if self._raw is not None else self.array
+
+    @classmethod
+    def from_source(cls, source):
+        return cls.from_array(source) if isinstance(source, np.ndarray) else cls(raw=source)
+
+    @property
+    def pil(self):
+        if self._pil is None:
+            if self._raw is not None:
+                self._pil = PIL_Image.open(io.BytesIO(self._raw))
+            else:
+                self._pil = PIL_Image.fromarray(self._array)
+        return self._pil
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._array is None:
+            self._array = np.asarray(self.pil.convert('RGB'))
+        return self._array
+
+    @property
+    def size(self):
+        if self._array is not None and self._pil is None:
+            return self._array.shape[1], self._array.shape[0]
+        try:
+            return self.pil.size
+        except OSError:
+            return -1, -1
+        except ValueError:
+            return -1, -1
@@ -3,11 +3,14 @@
 # Author: kerlomz <kerlomz@gmail.com>
 import os
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from watchdog.events import *
 from config import ModelConfig, Config
-from graph_session import GraphSession
+from graph_session import create_session
 from interface import InterfaceManager, Interface
-from utils import PathUtils
+from utils import PathUtils, ImageUtils
+from decoded_image import DecodedImage
 
 
 class FileEventHandler(FileSystemEventHandler):
@@ -16,15 +19,28 @@ class FileEventHandler(FileSystemEventHandler):
         self.conf = conf
         self.logger = self.conf.logger
         self.name_map = {}
+        # The online interface of each yaml key, a reload replaces it and a delete removes exactly it.
+        self.interfaces = {}
         self.model_conf_path = model_conf_path
         self.interface_manager = interface_manager
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.name_lock = threading.Lock()
         self.init()
 
     def init(self):
         model_list = os.listdir(self.model_conf_path)
-        model_list = [os.path.join(self.model_conf_path, i) for i in model_list if i.endswith("yaml")]
-        for model in model_list:
-            self._add(model, is_first=True)
+        model_list = sorted([os.path.join(self.model_conf_path, i) for i in model_list if i.endswith("yaml")])
+        # The models are loaded in parallel, the backends release the GIL while parsing and optimizing the graphs,
+        # then they are put online one by one in the order of the files (the first one is the default model).
+        if model_list:
+            workers = max(min(int(self.conf.model_load_workers), len(model_list)), 1)
+            with ThreadPoolExecutor(workers, thread_name_prefix="model-loader") as executor:
+                loaded = list(executor.map(self.try_load, model_list))
+            for model_path, result in zip(model_list, loaded):
+                self.commit(model_path, result, is_first=True)
+        self.interface_manager.ready.set()
         if self.interface_manager.total == 0:
             self.logger.info(
                 "\n - Number of interfaces: {}"
@@ -34,121 +50,197 @@ class FileEventHandler(FileSystemEventHandler):
                     self.interface_manager.total,
                 ))
         else:
-            self.logger.info(
-                "\n - Number of interfaces: {}"
-                "\n - Current online interface: \n\t - {}"
-                "\n - The default Interface is: {}".format(
-                    self.interface_manager.total,
-                    "\n\t - ".join(["[{}]".format(v) for k, v in self.name_map.items()]),
-                    self.interface_manager.default_name
-                ))
+            self.log_interfaces()
 
-    def _add(self, src_path, is_first=False, count=0):
+    def log_interfaces(self):
+        with self.name_lock:
+            names = ["[{}]".format(v) for k, v in self.name_map.items()]
+        self.logger.info(
+            "\n - Number of interfaces: {}"
+            "\n - Current online interface: \n\t - {}"
+            "\n - The default Interface is: {}".format(
+                self.interface_manager.total,
+                "\n\t - ".join(names),
+                self.interface_manager.default_name
+            ))
+
+    def load(self, model_path: str):
+        # Parse, load and warm up the model, it does not touch the online interfaces (thread-safe).
+        if 'model_demo.yaml' in model_path:
+            self.logger.warning(
+                "\n-------------------------------------------------------------------\n"
+                "- Found that the model_demo.yaml file exists, \n"
+                "- the loading is automatically ignored. \n"
+                "- If it is used for the first time, \n"
+                "- please copy it as a template. \n"
+                "- and do not use the reserved character \"model_demo.yaml\" as the file name."
+                "\n-------------------------------------------------------------------"
+            )
+            return None
+        model_conf = ModelConfig(self.conf, model_path)
+        graph_session = create_session(model_conf)
+        if not graph_session.loaded:
+            return model_conf, None
+        interface = Interface(graph_session)
+        self.warm_up(interface, model_path)
+        return model_conf, interface
+
+    def try_load(self, model_path: str):
         try:
-            model_path = str(src_path)
-            path_exists = os.path.exists(model_path)
-            if not path_exists and count > 0:
-                self.logger.error("{} not found, retry attempt is terminated.".format(model_path))
-                return
-            if 'model_demo.yaml' in model_path:
-                self.logger.warning(
-                    "\n-------------------------------------------------------------------\n"
-                    "- Found that the model_demo.yaml file exists, \n"
-                    "- the loading is automatically ignored. \n"
-                    "- If it is used for the first time, \n"
-                    "- please copy it as a template. \n"
-                    "- and do not use the reserved character \"model_demo.yaml\" as the file name."
-                    "\n-------------------------------------------------------------------"
-                )
-                return
-            if model_path.endswith("yaml"):
-                model_conf = ModelConfig(self.conf, model_path)
-                inner_name = model_conf.model_name
-                inner_size = model_conf.size_string
-                inner_key = PathUtils.get_file_name(model_path)
-                for k, v in self.name_map.items():
-                    if inner_size in v:
-                        self.logger.warning(
-                            "\n-------------------------------------------------------------------\n"
-                            "- The current model {} is the same size [{}] as the loaded model {}. \n"
-                            "- Only one of the smart calls can be called. \n"
-                            "- If you want to refer to one of them, \n"
-                            "- please use the model key or model type to find it."
-                            "\n-------------------------------------------------------------------".format(
-                                inner_key, inner_size, k
-                            )
+            return self.load(model_path)
+        except Exception as e:
+            return e
+
+    def commit(self, src_path, result, is_first=False):
+        # Put a loaded model online, returns False when it could not be loaded.
+        if result is None:
+            return True
+        if isinstance(result, Exception):
+            self.interface_manager.report(src_path)
+            self.logger.error(result)
+            return False
+        model_conf, interface = result
+        if interface is None:
+            self.interface_manager.report(src_path)
+            return False
+        with self.name_lock:
+            inner_name = model_conf.model_name
+            inner_size = model_conf.size_string
+            inner_key = PathUtils.get_file_name(src_path)
+            for k, v in self.name_map.items():
+                if inner_size in v:
+                    self.logger.warning(
+                        "\n-------------------------------------------------------------------\n"
+                        "- The current model {} is the same size [{}] as the loaded model {}. \n"
+                        "- Only one of the smart calls can be called. \n"
+                        "- If you want to refer to one of them, \n"
+                        "- please use the model key or model type to find it."
+                        "\n-------------------------------------------------------------------".format(
+                            inner_key, inner_size, k
                         )
-                        break
-
-                inner_value = model_conf.model_name
-                graph_session = GraphSession(model_conf)
-                if graph_session.loaded:
-                    interface = Interface(graph_session)
-                    if inner_name == self.conf.default_model:
-                        self.interface_manager.set_default(interface)
-                    else:
-                        self.interface_manager.add(interface)
-                    self.logger.info("{} a new model: {} ({})".format(
-                        "Inited" if is_first else "Added", inner_value, inner_key
-                    ))
-                    self.name_map[inner_key] = inner_value
-                    if src_path in self.interface_manager.invalid_group:
-                        self.interface_manager.invalid_group.pop(src_path)
-                else:
-                    self.interface_manager.report(src_path)
-                    if count < 12 and not is_first:
-                        time.sleep(5)
-                        return self._add(src_path, is_first=is_first, count=count+1)
+                    )
+                    break
 
+            previous = self.interfaces.get(inner_key)
+            # The previous interface of the same yaml is replaced atomically and drained in the background.
+            self.interface_manager.swap(interface, previous, default=inner_name == self.conf.default_model)
+            self.logger.info("{} a new model: {} ({})".format(
+                "Inited" if is_first else "Reloaded" if previous else "Added", inner_name, inner_key
+            ))
+            self.name_map[inner_key] = inner_name
+            self.interfaces[inner_key] = interface
+            if src_path in self.interface_manager.invalid_group:
+                self.interface_manager.invalid_group.pop(src_path)
+        return True
+
+    def _add(self, src_path, is_first=False, count=0):
+        model_path = str(src_path)
+        if not model_path.endswith("yaml"):
+            return
+        if not os.path.exists(model_path) and count > 0:
+            self.logger.error("{} not found, retry attempt is terminated.".format(model_path))
+            return
+        if not self.commit(src_path, self.try_load(model_path), is_first=is_first) and count < 12 and not is_first:
+            time.sleep(5)
+            return self._add(src_path, is_first=is_first, count=count+1)
+
+    @staticmethod
+    def warm_up_samples(model_conf: ModelConfig, model_path: str):
+        # The optional sample images are placed in the directory <yaml name>_warmup next to the yaml file.
+        sample_dir = "{}_warmup".format(os.path.splitext(model_path)[0])
+        if not os.path.isdir(sample_dir):
+            return []
+        param_keys = list(model_conf.exec_map.keys()) if model_conf.exec_map else [None]
+        sample_batches = []
+        for file_name in sorted(os.listdir(sample_dir)):
+            with open(os.path.join(sample_dir, file_name), "rb") as f:
+                sample = f.read()
+            image_format = ImageUtils.test_image(sample)
+            if not image_format:
+                continue
+            for param_key in param_keys:
+                image_batch, _ = ImageUtils.get_image_batch(
+                    model_conf, [DecodedImage(raw=sample, image_format=image_format)], param_key=param_key
+                )
+                if image_batch is not None:
+                    sample_batches.append(image_batch)
+        return sample_batches
+
+    def warm_up(self, interface: Interface, model_path: str):
+        if not self.conf.warm_up_enable:
+            return
+        try:
+            warm_up_time = interface.warm_up(
+                batch_sizes=self.conf.warm_up_batch_sizes,
+                sample_batches=self.warm_up_samples(interface.model_conf, model_path),
+                rounds=self.conf.warm_up_rounds
+            )
+            self.logger.info("Warmed up the model: {} - {} ms".format(interface.name, warm_up_time))
         except Exception as e:
-            self.interface_manager.report(src_path)
-            self.logger.error(e)
+            self.logger.warning("Failed to warm up the model: {} - {}".format(interface.name, e))
 
     def delete(self, src_path):
         try:
             model_path = str(src_path)
             if model_path.endswith("yaml"):
                 inner_key = PathUtils.get_file_name(model_path)
-                graph_name = self.name_map.get(inner_key)
-                self.interface_manager.remove_by_name(graph_name)
-                self.name_map.pop(inner_key)
+                with self.name_lock:
+                    graph_name = self.name_map.pop(inner_key)
+                    self.interface_manager.remove(self.interfaces.pop(inner_key, None))
                 self.logger.info("Unload the model: {} ({})".format(graph_name, inner_key))
         except Exception as e:
             self.logger.error("Config File [{}] does not exist.".format(str(e).replace("'", "")))
 
+    def schedule(self, src_path):
+        # The events of one yaml file are debounced: a burst of events (the yaml and the graph copied together,
+        # an overwrite seen as delete + create) results in a single reload once the file is quiet.
+        model_path = str(src_path)
+        if not model_path.endswith("yaml"):
+            return
+        with self.pending_lock:
+            timer = self.pending.get(model_path)
+            if timer:
+                timer.cancel()
+            timer = threading.Timer(self.conf.reload_debounce, self.reload, (model_path, ))
+            timer.daemon = True
+            self.pending[model_path] = timer
+            timer.start()
+
+    def reload(self, model_path):
+        with self.pending_lock:
+            if self.pending.get(model_path) is threading.current_thread():
+                self.pending.pop(model_path)
+        with self.reload_lock:
+            if os.path.exists(model_path):
+                self._add(model_path)
+            else:
+                if model_path in self.interface_manager.invalid_group:
+                    self.interface_manager.invalid_group.pop(model_path)
+                inner_key = PathUtils.get_file_name(model_path)
+                if inner_key in self.name_map:
+                    self.delete(model_path)
+            self.log_interfaces()
+
     def on_created(self, event):
         if event.is_directory:
             self.logger.info("directory created:{0}".format(event.src_path))
         else:
-            model_path = str(event.src_path)
-            self._add(model_path)
-            self.logger.info(
-                "\n - Number of interfaces: {}"
-                "\n - Current online interface: \n\t - {}"
-                "\n - The default Interface is: {}".format(
-                    len(self.interface_manager.group),
-                    "\n\t - ".join(["[{}]".format(v) for k, v in self.name_map.items()]),
-                    self.interface_manager.default_name
-                ))
+            self.schedule(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.schedule(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.schedule(event.src_path)
+            self.schedule(event.dest_path)
 
     def on_deleted(self, event):
         if event.is_directory:
             self.logger.info("directory deleted:{0}".format(event.src_path))
         else:
-            model_path = str(event.src_path)
-            if model_path in self.interface_manager.invalid_group:
-                self.interface_manager.invalid_group.pop(model_path)
-            inner_key = PathUtils.get_file_name(model_path)
-            if inner_key in self.name_map:
-                self.delete(model_path)
-            self.logger.info(
-                "\n - Number of interfaces: {}"
-                "\n - Current online interface: \n\t - {}"
-                "\n - The default Interface is: {}".format(
-                    len(self.interface_manager.group),
-                    "\n\t - ".join(["[{}]".format(v) for k, v in self.name_map.items()]),
-                    self.interface_manager.default_name
-                ))
+            self.schedule(event.src_path)
 
 
 if __name__ == "__main__":
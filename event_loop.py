@@ -9,7 +9,7 @@ from event_handler import FileEventHandler
 def event_loop(system_config, model_path, interface_manager):
     observer = Observer()
     event_handler = FileEventHandler(system_config, model_path, interface_manager)
-    observer.schedule(event_handler, event_handler.model_conf_path, True)
+    observer.schedule(event_handler, event_handler.model_conf_path, recursive=True)
     observer.start()
     try:
         while True:
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from config import Config
+
+
+class ExecutorOverload(Exception):
+
+    def __init__(self, name):
+        Exception.__init__(self, "The {} executor is overloaded.".format(name))
+        self.name = name
+
+
+class BoundedExecutor(object):
+    """
+    A thread pool that accepts at most `max_workers + max_queue_size` outstanding tasks,
+    further submissions are rejected immediately with ExecutorOverload.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue_size: int):
+        self.name = name
+        self.max_workers = max(int(max_workers), 1)
+        self.max_queue_size = max(int(max_queue_size), 0)
+        self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix=name)
+        self.semaphore = threading.BoundedSemaphore(self.max_workers + self.max_queue_size)
+        self.lock = threading.Lock()
+        self.outstanding = 0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        if not self.semaphore.acquire(blocking=False):
+            raise ExecutorOverload(self.name)
+        with self.lock:
+            self.outstanding += 1
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, *_):
+        with self.lock:
+            self.outstanding -= 1
+        self.semaphore.release()
+
+    @property
+    def queue_depth(self):
+        return max(self.outstanding - self.max_workers, 0)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+class ExecutorManager(object):
+    """
+    The process-wide executors:
+     - decode: request parsing, base64 and image header decoding, frame splitting and postprocessing.
+     - preprocess: image decoding and preprocessing (CPU bound).
+     - inference: session runs, each model is limited to `model_concurrency` concurrent runs.
+     - io: blocking disk and network writes.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, conf: Config):
+        self.conf = conf
+        self.max_queue_size = conf.executor_max_queue_size
+        self.model_concurrency = conf.executor_model_concurrency
+        self.decode = BoundedExecutor("decode", conf.executor_decode_workers, self.max_queue_size)
+        self.preprocess = BoundedExecutor("preprocess", conf.executor_preprocess_workers, self.max_queue_size)
+        self.inference = BoundedExecutor("inference", conf.executor_inference_workers, self.max_queue_size)
+        self.io = BoundedExecutor("io", conf.executor_io_workers, self.max_queue_size)
+
+    @classmethod
+    def shared(cls, conf: Config = None):
+        with cls._shared_lock:
+            if cls._shared is None:
+                if conf is None:
+                    raise RuntimeError("The executor manager has not been initialized.")
+                cls._shared = cls(conf)
+            return cls._shared
+
+    @property
+    def queue_depth(self):
+        return {
+            "decode": self.decode.queue_depth,
+            "preprocess": self.preprocess.queue_depth,
+            "inference": self.inference.queue_depth,
+            "io": self.io.queue_depth,
+        }
+
+    def shutdown(self, wait=True):
+        self.decode.shutdown(wait)
+        self.preprocess.shutdown(wait)
+        self.inference.shutdown(wait)
+        self.io.shutdown(wait)
@@ -2,16 +2,36 @@
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
 import os
-import tensorflow as tf
-tf.compat.v1.disable_v2_behavior()
-from tensorflow.python.framework.errors_impl import NotFoundError
+import threading
+import numpy as np
 from config import ModelConfig
+from constants import ModelBackend
 
 os.environ['TF_XLA_FLAGS'] = '--tf_xla_cpu_global_jit'
 os.environ['CUDA_VISIBLE_DEVICES'] = '1'
 
+_tf = None
+_tf_lock = threading.Lock()
+
+
+def tensorflow():
+    # TensorFlow is only imported when a model of the tensorflow/tflite backend is loaded.
+    global _tf
+    with _tf_lock:
+        if _tf is None:
+            import tensorflow as tf
+            tf.compat.v1.disable_v2_behavior()
+            _tf = tf
+    return _tf
+
 
 class GraphSession(object):
+    """
+    The inference session of one model, all the backends share the same contract:
+    the `input:0` tensor is fed with the image batch and `dense_decoded:0` is fetched.
+    The dtype of `input:0` must be the `InputDtype` of the model (float32 unless the graph casts the pixels).
+    """
+
     def __init__(self, model_conf: ModelConfig):
         self.model_conf = model_conf
         self.logger = self.model_conf.logger
@@ -19,6 +39,51 @@ class GraphSession(object):
         self.model_name = self.model_conf.model_name
         self.graph_name = self.model_conf.model_name
         self.version = self.model_conf.model_version
+        self.sess = None
+        self.loaded = self.load_model()
+
+    def load_model(self):
+        raise NotImplementedError
+
+    def run(self, image_batch):
+        raise NotImplementedError
+
+    @property
+    def input_dtype(self):
+        return self.model_conf.preprocess_plan.dtype
+
+    def check_input_dtype(self, dtype):
+        if np.dtype(dtype) == self.input_dtype:
+            return True
+        self.logger.error('The input of {} is {} but the InputDtype is {}.'.format(
+            self.model_name, np.dtype(dtype), self.input_dtype
+        ))
+        return False
+
+    @property
+    def session(self):
+        return self.sess
+
+    def destroy(self):
+        self.sess = None
+
+
+class TensorFlowSession(GraphSession):
+
+    def __init__(self, model_conf: ModelConfig):
+        self.graph = None
+        self.dense_decoded = None
+        self.x = None
+        super().__init__(model_conf)
+
+    def load_model(self):
+        # Here is for debugging, positioning error source use.
+        # with self.graph.as_default():
+        #     saver = tf.train.import_meta_graph('graph/***.meta')
+        #     saver.restore(self.sess, tf.train.latest_checkpoint('graph'))
+        if not self.model_conf.model_exists:
+            return False
+        tf = tensorflow()
         self.graph = tf.compat.v1.Graph()
         self.sess = tf.compat.v1.Session(
             graph=self.graph,
@@ -34,36 +99,147 @@ class GraphSession(object):
                 )
             )
         )
-        self.graph_def = self.graph.as_graph_def()
-        self.loaded = self.load_model()
-
-    def load_model(self):
-        # Here is for debugging, positioning error source use.
-        # with self.graph.as_default():
-        #     saver = tf.train.import_meta_graph('graph/***.meta')
-        #     saver.restore(self.sess, tf.train.latest_checkpoint('graph'))
-        if not self.model_conf.model_exists:
-            self.destroy()
-            return False
+        graph_def = self.graph.as_graph_def()
         try:
             with tf.io.gfile.GFile(self.model_conf.compile_model_path, "rb") as f:
                 graph_def_file = f.read()
-            self.graph_def.ParseFromString(graph_def_file)
+            graph_def.ParseFromString(graph_def_file)
             with self.graph.as_default():
                 self.sess.run(tf.compat.v1.global_variables_initializer())
-                _ = tf.import_graph_def(self.graph_def, name="")
+                _ = tf.import_graph_def(graph_def, name="")
+            self.dense_decoded = self.graph.get_tensor_by_name("dense_decoded:0")
+            self.x = self.graph.get_tensor_by_name('input:0')
+            self.graph.finalize()
+            if not self.check_input_dtype(self.x.dtype.as_numpy_dtype):
+                self.destroy()
+                return False
 
             self.logger.info('TensorFlow Session {} Loaded.'.format(self.model_conf.model_name))
             return True
-        except NotFoundError:
+        except tf.errors.NotFoundError:
             self.logger.error('The system cannot find the model specified.')
             self.destroy()
             return False
 
-    @property
-    def session(self):
-        return self.sess
+    def run(self, image_batch):
+        return self.sess.run(self.dense_decoded, feed_dict={
+            self.x: image_batch,
+        })
 
     def destroy(self):
-        self.sess.close()
-        del self.sess
+        if self.sess:
+            self.sess.close()
+        self.sess = None
+
+
+class ONNXSession(GraphSession):
+
+    graph_optimization_map = {
+        'disable': 'ORT_DISABLE_ALL',
+        'basic': 'ORT_ENABLE_BASIC',
+        'extended': 'ORT_ENABLE_EXTENDED',
+        'all': 'ORT_ENABLE_ALL',
+    }
+
+    execution_mode_map = {
+        'sequential': 'ORT_SEQUENTIAL',
+        'parallel': 'ORT_PARALLEL',
+    }
+
+    input_type_map = {
+        'tensor(float)': np.float32,
+        'tensor(uint8)': np.uint8,
+    }
+
+    def session_options(self, ort):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = int(self.model_conf.intra_op_threads)
+        options.inter_op_num_threads = int(self.model_conf.inter_op_threads)
+        options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel,
+            self.graph_optimization_map.get(str(self.model_conf.graph_optimization).lower(), 'ORT_ENABLE_ALL')
+        )
+        options.execution_mode = getattr(
+            ort.ExecutionMode,
+            self.execution_mode_map.get(str(self.model_conf.execution_mode).lower(), 'ORT_SEQUENTIAL')
+        )
+        return options
+
+    def load_model(self):
+        if not self.model_conf.model_exists:
+            return False
+        import onnxruntime as ort
+        try:
+            self.sess = ort.InferenceSession(
+                self.model_conf.compile_model_path,
+                sess_options=self.session_options(ort),
+                providers=ort.get_available_providers()
+            )
+            input_type = self.sess.get_inputs()[0].type
+            if not self.check_input_dtype(self.input_type_map.get(input_type, np.float32)):
+                self.destroy()
+                return False
+            self.logger.info('ONNXRuntime Session {} Loaded.'.format(self.model_conf.model_name))
+            return True
+        except Exception as e:
+            self.logger.error('The system cannot load the model specified: {}'.format(e))
+            self.destroy()
+            return False
+
+    def run(self, image_batch):
+        return self.sess.run(["dense_decoded:0"], input_feed={
+            "input:0": np.asarray(image_batch, dtype=self.input_dtype),
+        })[0]
+
+
+class TFLiteSession(GraphSession):
+
+    def __init__(self, model_conf: ModelConfig):
+        # The interpreter is not thread-safe and is resized to the shape of every batch.
+        self.lock = threading.Lock()
+        self.input_index = None
+        self.output_index = None
+        super().__init__(model_conf)
+
+    def load_model(self):
+        if not self.model_conf.model_exists:
+            return False
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            Interpreter = tensorflow().lite.Interpreter
+        try:
+            self.sess = Interpreter(model_path=self.model_conf.compile_model_path)
+            self.sess.allocate_tensors()
+            self.input_index = self.sess.get_input_details()[0]['index']
+            self.output_index = self.sess.get_output_details()[0]['index']
+            if not self.check_input_dtype(self.sess.get_input_details()[0]['dtype']):
+                self.destroy()
+                return False
+            self.logger.info('TensorFlow Lite Interpreter {} Loaded.'.format(self.model_conf.model_name))
+            return True
+        except (ValueError, RuntimeError) as e:
+            self.logger.error('The system cannot load the model specified: {}'.format(e))
+            self.destroy()
+            return False
+
+    def run(self, image_batch):
+        image_batch = np.asarray(image_batch, dtype=self.input_dtype)
+        with self.lock:
+            if tuple(self.sess.get_input_details()[0]['shape']) != image_batch.shape:
+                self.sess.resize_tensor_input(self.input_index, image_batch.shape)
+                self.sess.allocate_tensors()
+            self.sess.set_tensor(self.input_index, image_batch)
+            self.sess.invoke()
+            return self.sess.get_tensor(self.output_index)
+
+
+SESSION_MAP = {
+    ModelBackend.TensorFlow: TensorFlowSession,
+    ModelBackend.ONNX: ONNXSession,
+    ModelBackend.TFLite: TFLiteSession,
+}
+
+
+def create_session(model_conf: ModelConfig) -> GraphSession:
+    return SESSION_MAP[model_conf.backend](model_conf)
@@ -3,8 +3,17 @@
 # Author: kerlomz <kerlomz@gmail.com>
 import os
 import time
+import threading
+import numpy as np
+from concurrent.futures import Future
 from graph_session import GraphSession
-from predict import predict_func
+from predict import run_func
+from batching import BatchScheduler
+from executor import ExecutorManager
+from result_cache import ResultCache
+from process_pool import PreprocessPool
+from buffer_pool import BatchBufferPool
+from utils import ImageUtils
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 
@@ -18,11 +27,37 @@ class Interface(object):
         self.graph_name = self.graph_sess.graph_name
         self.version = self.graph_sess.version
         self.model_category = self.model_conf.category_param
+        self.warm_up_time = None
+        # The in-flight predictions, a retired interface is destroyed once they are drained.
+        self.refs = 0
+        self.retired = False
+        self.drained = threading.Event()
+        self.ref_lock = threading.Lock()
+        self.batcher = None
+        self.preprocess_pool = None
+        self.buffer_pool = None
+        if self.graph_sess.loaded and self.model_conf.process_pool:
+            try:
+                self.preprocess_pool = PreprocessPool(self.model_conf)
+            except (ValueError, OSError) as e:
+                self.model_conf.logger.warning('The process pool of {} is disabled: {}'.format(self.graph_name, e))
+        plan = self.model_conf.preprocess_plan
+        if self.graph_sess.loaded and plan.output_shape and self.model_conf.batch_buffers > 0:
+            self.buffer_pool = BatchBufferPool(
+                plan.output_shape, plan.dtype, self.model_conf.batch_buffers
+            )
         if self.graph_sess.loaded:
-            self.sess = self.graph_sess.session
-            self.dense_decoded = self.sess.graph.get_tensor_by_name("dense_decoded:0")
-            self.x = self.sess.graph.get_tensor_by_name('input:0')
-            self.sess.graph.finalize()
+            executor_manager = ExecutorManager.shared(self.model_conf.conf)
+            self.batcher = BatchScheduler(
+                run_func=self.predict_texts,
+                max_batch_size=self.model_conf.conf.max_batch_size,
+                max_wait=self.model_conf.conf.max_batch_wait / 1000,
+                name=self.graph_name,
+                executor=executor_manager.inference,
+                concurrency=executor_manager.model_concurrency,
+                max_queue_size=executor_manager.max_queue_size,
+                buffers=self.buffer_pool
+            )
 
     @property
     def name(self):
@@ -32,37 +67,185 @@ class Interface(object):
     def size(self):
         return self.size_str
 
-    def destroy(self):
+    def acquire(self):
+        with self.ref_lock:
+            self.refs += 1
+
+    def try_acquire(self):
+        # Hold the interface for a request, fails once it is retired (the index already has its replacement).
+        with self.ref_lock:
+            if self.retired:
+                return False
+            self.refs += 1
+            return True
+
+    def release(self, *_):
+        with self.ref_lock:
+            self.refs -= 1
+            if self.retired and self.refs <= 0:
+                self.drained.set()
+
+    def retire(self):
+        with self.ref_lock:
+            self.retired = True
+            if self.refs <= 0:
+                self.drained.set()
+
+    def destroy(self, timeout=None):
+        # Wait for the in-flight predictions (at most `timeout` seconds) before closing the session.
+        self.retire()
+        self.drained.wait(self.model_conf.conf.drain_timeout if timeout is None else timeout)
+        if self.batcher:
+            self.batcher.shutdown()
+        if self.preprocess_pool:
+            self.preprocess_pool.shutdown()
+        self.preprocess_pool = None
+        self.buffer_pool = None
         self.graph_sess.destroy()
 
-    def predict_batch(self, image_batch, output_split=None):
-        predict_text = predict_func(
+    def get_image_batch(self, bytes_batch, param_key=None, extract_rgb: list = None):
+        return ImageUtils.get_image_batch(
+            self.model_conf, bytes_batch, param_key=param_key, extract_rgb=extract_rgb,
+            preprocess_pool=self.preprocess_pool, buffer_pool=self.buffer_pool
+        )
+
+    def predict_texts(self, image_batch):
+        return run_func(
             image_batch,
-            self.sess,
-            self.dense_decoded,
-            self.x,
-            self.model_conf,
-            output_split
+            self.graph_sess,
+            self.model_conf
         )
-        return predict_text
+
+    def warm_up(self, batch_sizes: list, sample_batches: list = None, rounds=1):
+        # Run the session directly (bypassing the batch scheduler) before the interface goes online,
+        # the graph optimization and the allocator growth happen here instead of in the first requests.
+        start_time = time.time()
+        plan = self.model_conf.preprocess_plan
+        shape = plan.dsize((self.model_conf.image_width, self.model_conf.image_height))
+        shape = shape + (self.model_conf.image_channel, )
+        for _ in range(max(int(rounds), 1)):
+            for batch_size in batch_sizes:
+                self.predict_texts(np.zeros((int(batch_size), ) + shape, dtype=plan.dtype))
+            for image_batch in sample_batches or []:
+                self.predict_texts(image_batch)
+        self.warm_up_time = round((time.time() - start_time) * 1000)
+        return self.warm_up_time
+
+    def submit(self, image_batch, output_split=None) -> Future:
+        self.acquire()
+        if self.batcher:
+            try:
+                future = self.batcher.submit(image_batch, output_split)
+            except Exception:
+                self.release()
+                raise
+        else:
+            future = Future()
+            try:
+                texts = self.predict_texts(image_batch)
+                future.set_result(texts if output_split is None else output_split.join(texts))
+            except Exception as e:
+                future.set_exception(e)
+        future.add_done_callback(self.release)
+        return future
+
+    def predict_async(self, image_batch, output_split=None) -> Future:
+        output_split = self.model_conf.output_split if output_split is None else output_split
+        return self.submit(image_batch, output_split)
+
+    def predict_texts_async(self, image_batch) -> Future:
+        # The text of every image of the batch, as a list.
+        return self.submit(image_batch)
+
+    def predict_batch(self, image_batch, output_split=None):
+        return self.predict_async(image_batch, output_split).result()
+
+
+class InterfaceIndex(object):
+    """
+    An immutable snapshot of the online interfaces with the routing dictionaries built once:
+    name -> interface and size -> interfaces sorted by version (highest first).
+    A name (and the default model) resolves to its highest version, the first one added wins a tie.
+    """
+
+    def __init__(self, group: tuple = ()):
+        self.group = group
+        self.by_name = {}
+        self.by_size = {}
+        for interface in group:
+            current = self.by_name.get(interface.name)
+            if current is None or interface.version > current.version:
+                self.by_name[interface.name] = interface
+            self.by_size.setdefault(interface.size_str, []).append(interface)
+        for interfaces in self.by_size.values():
+            interfaces.sort(key=lambda i: i.version, reverse=True)
+        self.default = self.by_name[group[0].name] if group else None
 
 
 class InterfaceManager(object):
+    """
+    The watchdog thread rebuilds the index under a lock and swaps it in with a single assignment (copy-on-write),
+    the request handlers only read the current snapshot, without any lock.
+    The handlers resolve the interface with `acquire=True` and release it once the response is finished,
+    an interface is never destroyed between its lookup and the prediction.
+    An interface swapped in for a previous one (the same yaml reloaded) replaces it atomically, an interface of
+    the same name from another yaml is kept next to it and the highest version is served.
+    The replaced (or removed) interface is destroyed in the background once its in-flight predictions are drained.
+    """
 
-    def __init__(self, interface: Interface = None):
-        self.group = []
+    def __init__(self, interface: Interface = None, cache: ResultCache = None):
+        self.lock = threading.Lock()
+        self.index = InterfaceIndex()
+        # Set once the models found at startup have been loaded (or failed to load).
+        self.ready = threading.Event()
         self.invalid_group = {}
+        self.cache = cache
         self.set_default(interface)
 
+    @property
+    def group(self):
+        return self.index.group
+
+    def invalidate(self, interface: Interface):
+        if self.cache and interface:
+            self.cache.invalidate(interface.name)
+
+    def retire(self, interface: Interface):
+        def drain():
+            interface.destroy()
+            # The results of the drained predictions may have been cached after the swap.
+            self.invalidate(interface)
+        interface.retire()
+        threading.Thread(target=drain, name="drain-{}".format(interface.name), daemon=True).start()
+
+    def swap(self, interface: Interface, previous: Interface = None, default=False):
+        with self.lock:
+            group = self.index.group
+            if interface in group:
+                return
+            if previous not in group:
+                previous = None
+            if default:
+                group = (interface, ) + tuple(i for i in group if i is not previous)
+            elif previous:
+                group = tuple(interface if i is previous else i for i in group)
+            else:
+                group = group + (interface, )
+            self.invalidate(interface)
+            self.index = InterfaceIndex(group)
+        if previous:
+            self.retire(previous)
+
     def add(self, interface: Interface):
-        if interface in self.group:
-            return
-        self.group.append(interface)
+        self.swap(interface)
 
     def remove(self, interface: Interface):
-        if interface in self.group:
-            interface.destroy()
-            self.group.remove(interface)
+        with self.lock:
+            if interface not in self.index.group:
+                return
+            self.invalidate(interface)
+            self.index = InterfaceIndex(tuple(i for i in self.index.group if i is not interface))
+        self.retire(interface)
 
     def report(self, model):
         self.invalid_group[model] = {"create_time": time.asctime(time.localtime(time.time()))}
@@ -71,25 +254,35 @@ class InterfaceManager(object):
         interface = self.get_by_name(graph_name, False)
         self.remove(interface)
 
-    def get_by_size(self, size: str, return_default=True):
-
-        match_ids = [i for i in range(len(self.group)) if self.group[i].size_str == size]
-        if not match_ids:
-            return self.default if return_default else None
-        else:
-            ver = [self.group[i].version for i in match_ids]
-            return self.group[match_ids[ver.index(max(ver))]]
+    @staticmethod
+    def resolve(lookup, acquire=False):
+        # An interface retired between the lookup and the acquire is looked up again in the new index.
+        while True:
+            interface = lookup()
+            if not acquire or interface is None or interface.try_acquire():
+                return interface
 
-    def get_by_name(self, key: str, return_default=True):
-        for interface in self.group:
-            if interface.name == key:
+    def get_by_size(self, size: str, return_default=True, acquire=False):
+        def lookup():
+            index = self.index
+            interfaces = index.by_size.get(size)
+            if not interfaces:
+                return index.default if return_default else None
+            return interfaces[0]
+        return self.resolve(lookup, acquire)
 
-                return interface
-        return self.default if return_default else None
+    def get_by_name(self, key: str, return_default=True, acquire=False):
+        def lookup():
+            index = self.index
+            interface = index.by_name.get(key)
+            if interface is None and return_default:
+                return index.default
+            return interface
+        return self.resolve(lookup, acquire)
 
     @property
     def default(self):
-        return self.group[0] if len(self.group) > 0 else None
+        return self.index.default
 
     @property
     def default_name(self):
@@ -100,13 +293,13 @@ class InterfaceManager(object):
 
     @property
     def total(self):
-        return len(self.group)
+        return len(self.index.group)
 
     @property
     def online_names(self):
-        return [i.name for i in self.group]
+        return [i.name for i in self.index.group]
 
     def set_default(self, interface: Interface):
         if not interface:
             return
-        self.group.insert(0, interface)
+        self.swap(interface, default=True)
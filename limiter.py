@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import os
+import ipaddress
+import threading
+from config import Config, BLACKLIST_PATH, blacklist, save_blacklist
+from executor import ExecutorOverload
+from shared_store import LocalStore
+
+
+def parse_network(address: str):
+    """
+    The network of a blacklist/whitelist entry: an address, a CIDR block or, as the entries
+    were matched with `startswith` before, a dotted IPv4 prefix such as `192.168.` (192.168.0.0/16).
+    """
+    address = str(address).strip()
+    if address == 'localhost':
+        return [ipaddress.ip_network('127.0.0.1'), ipaddress.ip_network('::1')]
+    try:
+        return [ipaddress.ip_network(address, strict=False)]
+    except ValueError:
+        pass
+    octets = [i for i in address.split('.') if i]
+    if not octets or len(octets) > 3 or not all(i.isdigit() and int(i) < 256 for i in octets):
+        return []
+    network = ".".join(octets + ['0'] * (4 - len(octets)))
+    return [ipaddress.ip_network("{}/{}".format(network, len(octets) * 8))]
+
+
+class NetworkTrie(object):
+    """
+    A binary prefix trie of the networks, an address matches when one of its prefixes is a network,
+    the lookup costs at most 32 (IPv4) or 128 (IPv6) steps whatever the number of networks.
+    """
+
+    # The children are keyed by the bit (0 or 1), a node that ends a network holds the leaf key.
+    leaf = 'leaf'
+
+    def __init__(self, addresses: list = None):
+        self.roots = {4: {}, 6: {}}
+        self.addresses = []
+        for address in addresses or []:
+            self.add(address)
+
+    def add(self, address: str):
+        networks = parse_network(address)
+        for network in networks:
+            node = self.roots[network.version]
+            bits = int(network.network_address)
+            for i in range(network.prefixlen):
+                if node.get(self.leaf):
+                    break
+                node = node.setdefault((bits >> (network.max_prefixlen - 1 - i)) & 1, {})
+            else:
+                node.clear()
+                node[self.leaf] = True
+        self.addresses.append(address)
+        return bool(networks)
+
+    def match(self, ip: str):
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        node = self.roots[address.version]
+        bits = int(address)
+        for i in range(address.max_prefixlen):
+            if node.get(self.leaf):
+                return True
+            node = node.get((bits >> (address.max_prefixlen - 1 - i)) & 1)
+            if node is None:
+                return False
+        return bool(node.get(self.leaf))
+
+    def __contains__(self, ip: str):
+        return self.match(ip)
+
+
+class Limiter(object):
+    """
+    The request limits and the IP lists.
+    The counters are sliding windows kept by the store (a LocalStore or its SharedStore proxy for the workers),
+    any object with the same `window_incr`, `window_incr_many`, `get_value`, `set_value` and `list_add_unique`
+    methods can back it. Only the calls to a LocalStore of this process do not block (`local`).
+    The blacklist and the whitelist are matched against prefix tries, the blacklist is reloaded from the store
+    (or from `blacklist.json` once it changed) by `refresh`, the bans are written to the file in the background.
+    """
+
+    def __init__(self, conf: Config, store, executor=None):
+        self.conf = conf
+        self.store = store
+        self.local = isinstance(store, LocalStore)
+        self.executor = executor
+        self.logger = conf.logger
+        self.max_keys = conf.limiter_max_keys
+        self.lock = threading.Lock()
+        # The file is only touched under its own lock, the request handlers never wait for the disk.
+        self.file_lock = threading.Lock()
+        self.whitelist = NetworkTrie()
+        self.blacklist = NetworkTrie()
+        self.blacklist_mtime = None
+
+    def load_whitelist(self, addresses: list):
+        self.whitelist = NetworkTrie(addresses)
+
+    def hit(self, ip: str, delta=1):
+        return self.store.window_incr('request_count', ip, self.conf.request_count_interval, delta, self.max_keys)
+
+    def undo(self, ip: str, delta=1):
+        return self.hit(ip, -delta)
+
+    def hit_global(self, delta=1):
+        return self.store.window_incr('global_request_count', '', self.conf.g_request_count_interval, delta)
+
+    def undo_global(self, delta=1):
+        return self.hit_global(-delta)
+
+    def hit_all(self, ip: str, delta=1):
+        # The IP and the global counters of a request in one store call, returns both counts.
+        return self.store.window_incr_many([
+            ('request_count', ip, self.conf.request_count_interval, delta, self.max_keys),
+            ('global_request_count', '', self.conf.g_request_count_interval, delta, 0),
+        ])
+
+    def undo_all(self, ip: str, delta=1):
+        return self.hit_all(ip, -delta)
+
+    def risk(self, ip: str, delta=1):
+        return self.store.window_incr('ip_risk_times', ip, self.conf.request_count_interval, delta, self.max_keys)
+
+    def strike(self, ip: str, times=1):
+        # Requests over the IP limit, the IP is banned once it was over the limit too many times.
+        risk_times = self.risk(ip, times)
+        trigger_times = self.conf.blacklist_trigger_times
+        if trigger_times != -1 and risk_times > trigger_times:
+            self.ban(ip)
+        return risk_times
+
+    def blacklisted(self, ip: str):
+        return self.blacklist.match(ip)
+
+    def whitelisted(self, ip: str):
+        return self.whitelist.match(ip)
+
+    def refresh(self):
+        # Reload the file only when it was changed outside (or by another worker), then sync from the store.
+        with self.file_lock:
+            try:
+                mtime = os.path.getmtime(BLACKLIST_PATH)
+            except OSError:
+                mtime = None
+            if mtime != self.blacklist_mtime:
+                self.blacklist_mtime = mtime
+                self.store.set_value('ip_blacklist', blacklist())
+        addresses = self.store.get_value('ip_blacklist', [])
+        if addresses != self.blacklist.addresses:
+            trie = NetworkTrie(addresses)
+            with self.lock:
+                self.blacklist = trie
+
+    def ban(self, ip: str):
+        if self.blacklist.match(ip):
+            return False
+        # The membership is checked against the store, the trie of this worker may be stale.
+        added, addresses = self.store.list_add_unique('ip_blacklist', ip)
+        trie = NetworkTrie(addresses)
+        with self.lock:
+            self.blacklist = trie
+        if not added:
+            return False
+        if not self.executor:
+            self.persist(addresses)
+            return True
+        try:
+            self.executor.submit(self.persist, addresses)
+        except ExecutorOverload:
+            self.logger.warning('The blacklist is not saved, the io executor is overloaded.')
+        return True
+
+    def persist(self, addresses: list):
+        # The latest list is written, a ban persisted out of order does not drop the bans after it.
+        with self.file_lock:
+            save_blacklist(self.store.get_value('ip_blacklist', addresses))
+            try:
+                self.blacklist_mtime = os.path.getmtime(BLACKLIST_PATH)
+            except OSError:
+                pass
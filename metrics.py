@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import time
+import threading
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names: tuple, values: tuple, extra: str = None):
+    labels = ['{}="{}"'.format(k, escape(v)) for k, v in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """
+    A metric family, the series are keyed by the label values in the order of `label_names`.
+    When `collect` is given the series are sampled at scrape time instead,
+    it returns the pairs of (labels: dict, value).
+    """
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.collect = collect
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def key(self, labels: dict):
+        return tuple(labels.get(k, '') for k in self.label_names)
+
+    def header(self):
+        return ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} {}".format(self.name, self.kind)]
+
+    def samples(self):
+        if self.collect:
+            return [(self.key(labels), value) for labels, value in self.collect()]
+        with self.lock:
+            return list(self.series.items())
+
+    def render(self):
+        lines = self.header()
+        for key, value in self.samples():
+            lines.append("{}{} {}".format(self.name, format_labels(self.label_names, key), format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + value
+
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.series[self.key(labels)] = value
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0, 0.]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            series = [(key, (list(counts), total, amount)) for key, (counts, total, amount) in self.series.items()]
+        for key, (counts, total, amount) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(
+                    self.name, format_labels(self.label_names, key, 'le="{}"'.format(format_value(bound))), cumulative
+                ))
+            lines.append("{}_bucket{} {}".format(
+                self.name, format_labels(self.label_names, key, 'le="+Inf"'), total
+            ))
+            lines.append("{}_sum{} {}".format(self.name, format_labels(self.label_names, key), repr(amount)))
+            lines.append("{}_count{} {}".format(self.name, format_labels(self.label_names, key), total))
+        return lines
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+requests_total = registry.register(Counter(
+    "captcha_requests_total", "Prediction requests by model and response status code.", ("model", "code")
+))
+batch_size = registry.register(Histogram(
+    "captcha_batch_size", "Images per session run.", ("model", ), BATCH_BUCKETS
+))
+stage_seconds = registry.register(Histogram(
+    "captcha_stage_seconds", "Latency of each stage of a prediction request.", ("stage", "model")
+))
+
+
+def observe(stage: str, seconds: float, model: str = ''):
+    stage_seconds.observe(seconds, stage=stage, model=model or '')
+
+
+@contextmanager
+def timer(stage: str, model: str = ''):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start_time, model)
+
+
+def register_service(executor_manager, result_cache, interface_manager, sample_writer=None):
+    registry.register(Gauge(
+        "captcha_executor_queue_depth", "Tasks waiting for a worker of each executor.", ("executor", ),
+        collect=lambda: [({"executor": k}, v) for k, v in executor_manager.queue_depth.items()]
+    ))
+    registry.register(Gauge(
+        "captcha_batch_queue_depth", "Requests waiting in the batch scheduler of each model.", ("model", ),
+        collect=lambda: [
+            ({"model": i.name}, i.batcher.queue_depth) for i in interface_manager.group if i.batcher
+        ]
+    ))
+    registry.register(Gauge(
+        "captcha_models_online", "Models currently online.",
+        collect=lambda: [({}, interface_manager.total)]
+    ))
+    registry.register(Gauge(
+        "captcha_cache_entries", "Entries in the prediction cache.",
+        collect=lambda: [({}, result_cache.stats['entries'])]
+    ))
+    registry.register(Gauge(
+        "captcha_cache_bytes", "Accounted size of the prediction cache.",
+        collect=lambda: [({}, result_cache.stats['bytes'])]
+    ))
+    registry.register(Counter(
+        "captcha_cache_hits_total", "Prediction cache hits.",
+        collect=lambda: [({}, result_cache.stats['hits'])]
+    ))
+    registry.register(Counter(
+        "captcha_cache_misses_total", "Prediction cache misses.",
+        collect=lambda: [({}, result_cache.stats['misses'])]
+    ))
+    if not sample_writer:
+        return
+    registry.register(Counter(
+        "captcha_samples_written_total", "Samples saved to the shards.",
+        collect=lambda: [({}, sample_writer.stats['written'])]
+    ))
+    registry.register(Counter(
+        "captcha_samples_dropped_total", "Samples dropped since the writer queue was full.",
+        collect=lambda: [({}, sample_writer.stats['dropped'])]
+    ))
+    registry.register(Counter(
+        "captcha_samples_duplicates_total", "Samples skipped as duplicates.",
+        collect=lambda: [({}, sample_writer.stats['duplicates'])]
+    ))
@@ -1,10 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
-import io
-import cv2
-import PIL.Image as Pil_Image
-import numpy as np
+from decoded_image import DecodedImage
 
 
 def coord_calc(param, is_range=True, is_integer=True):
@@ -27,22 +24,14 @@ def coord_calc(param, is_range=True, is_integer=True):
     return result_group
 
 
-def parse_multi_img(image_bytes, param_group):
-    img_bytes = image_bytes[0]
-    image_arr = np.array(Pil_Image.open(io.BytesIO(img_bytes)).convert('RGB'))
-    if len(image_arr.shape) == 3:
-        image_arr = cv2.cvtColor(image_arr, cv2.COLOR_BGR2RGB)
-    # image_arr = np.fromstring(img_bytes, np.uint8)
-    # print(image_arr.shape)
-    image_arr = image_arr.swapaxes(0, 1)
+def parse_multi_img(image_batch, param_group):
+    image_arr = DecodedImage.of(image_batch[0]).array
     group = []
     for p in param_group:
         pos_ranges = coord_calc(p, True, True)
         for pos_range in pos_ranges:
-            corp_arr = image_arr[pos_range[0][0]: pos_range[0][1], pos_range[1][0]: pos_range[1][1]]
-            corp_arr = cv2.imencode('.png', np.swapaxes(corp_arr, 0, 1))[1]
-            corp_bytes = bytes(bytearray(corp_arr))
-            group.append(corp_bytes)
+            corp_arr = image_arr[pos_range[1][0]: pos_range[1][1], pos_range[0][0]: pos_range[0][1]]
+            group.append(DecodedImage.from_array(corp_arr))
     return group
 
 
@@ -92,7 +81,7 @@ if __name__ == '__main__':
         with open(path, "rb") as f:
             file_bytes = [f.read()]
         group = parse_multi_img(file_bytes, _param_group)
-        for b in group:
+        for b in [i.raw for i in group]:
             tag = hashlib.md5(b).hexdigest()
             p = os.path.join(target_dir, "{}.png".format(tag))
             with open(p, "wb") as f:
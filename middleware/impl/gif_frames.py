@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
-import io
 import cv2
 import numpy as np
 from itertools import groupby
-from PIL import ImageSequence, Image
+from PIL import ImageSequence
+from decoded_image import DecodedImage
 
 
 def split_frames(image_obj, need_frame=None):
@@ -63,14 +63,11 @@ def blend_frame(image_obj, need_frame=None):
 def all_frames(image_obj):
     if isinstance(image_obj, list):
         image_obj = image_obj[0]
-    stream = io.BytesIO(image_obj)
-    pil_image = Image.open(stream)
+    pil_image = DecodedImage.of(image_obj).pil
     image_seq = ImageSequence.all_frames(pil_image)
-    array_seq = [np.asarray(im.convert("RGB")) for im in image_seq]
     # [1::2]
-    bytes_arr = [cv2.imencode('.png', img_arr)[1] for img_arr in array_seq]
-    split_flag = b'\x99\x99\x99\x00\xff\xff999999.........99999\xff\x00\x99\x99\x99'
-    return split_flag.join(bytes_arr).split(split_flag)
+    # The channels are reversed as the frames used to be encoded from RGB arrays as BGR PNG.
+    return [DecodedImage.from_array(np.asarray(im.convert("RGB"))[:, :, ::-1]) for im in image_seq]
 
 
 def get_continuity_max(src: list):
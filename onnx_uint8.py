@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import io
+import copy
+import optparse
+import numpy as np
+from PIL import Image as PIL_Image
+from config import Config, ModelConfig
+from pretreatment import PreprocessPlan
+
+INPUT_NAME = "input:0"
+
+
+def rename_input(graph, name: str, new_name: str):
+    # The nodes of the subgraphs (Loop/If/Scan bodies) may read the input from the outer scope.
+    for node in graph.node:
+        for i, value in enumerate(node.input):
+            if value == name:
+                node.input[i] = new_name
+        for attribute in node.attribute:
+            if attribute.g.ByteSize():
+                rename_input(attribute.g, name, new_name)
+            for subgraph in attribute.graphs:
+                rename_input(subgraph, name, new_name)
+
+
+def convert(src_path: str, dst_path: str):
+    """
+    Writes a copy of the float32 graph which takes the uint8 pixels, `input:0` is cast and divided by 255
+    in front of the graph (as the preprocess plan does), the model can then be deployed with `InputDtype: uint8`.
+    """
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+    model = onnx.load(src_path)
+    graph = model.graph
+    inputs = [i for i in graph.input if i.name == INPUT_NAME]
+    if not inputs:
+        raise ValueError("The graph has no input named {}.".format(INPUT_NAME))
+    tensor_type = inputs[0].type.tensor_type
+    if tensor_type.elem_type != TensorProto.FLOAT:
+        raise ValueError("The input of the graph is not float32.")
+    normalized_name = INPUT_NAME + "/normalized"
+    rename_input(graph, INPUT_NAME, normalized_name)
+    graph.initializer.append(numpy_helper.from_array(np.array(255., dtype=np.float32), INPUT_NAME + "/scale"))
+    nodes = [
+        helper.make_node("Cast", [INPUT_NAME], [INPUT_NAME + "/cast"], to=TensorProto.FLOAT),
+        helper.make_node("Div", [INPUT_NAME + "/cast", INPUT_NAME + "/scale"], [normalized_name]),
+    ]
+    for node in reversed(nodes):
+        graph.node.insert(0, node)
+    tensor_type.elem_type = TensorProto.UINT8
+    onnx.checker.check_model(model)
+    onnx.save(model, dst_path)
+
+
+def verify(model: ModelConfig, src_path: str, dst_path: str, samples: list):
+    # Both graphs are run on the same samples, each fed by its own plan (float32 resize / uint8 resize).
+    import onnxruntime as ort
+    raw_model = copy.copy(model)
+    raw_model.input_dtype = 'uint8'
+    plans = (model.preprocess_plan, PreprocessPlan(raw_model))
+    sessions = [ort.InferenceSession(path, providers=ort.get_available_providers()) for path in (src_path, dst_path)]
+    matched = 0
+    for sample in samples:
+        outputs = [
+            session.run(["dense_decoded:0"], input_feed={
+                INPUT_NAME: np.asarray([plan.apply(PIL_Image.open(io.BytesIO(sample)))])
+            })[0].tolist() for plan, session in zip(plans, sessions)
+        ]
+        matched += outputs[0] == outputs[1]
+    return matched
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('-c', '--config', type="str", default='config.yaml', dest="config")
+    parser.add_option('-m', '--model', type="str", dest="model")
+    parser.add_option('-g', '--graph_path', type="str", default='graph', dest="graph_path")
+    parser.add_option('-o', '--output', type="str", default=None, dest="output")
+    parser.add_option('-i', '--image', type="str", action="append", default=[], dest="images")
+    opt, args = parser.parse_args()
+
+    system_config = Config(conf_path=opt.config, model_path="model", graph_path=opt.graph_path)
+    model_conf = ModelConfig(system_config, opt.model)
+    output_path = opt.output or model_conf.compile_model_path[:-len(".onnx")] + ".uint8.onnx"
+    convert(model_conf.compile_model_path, output_path)
+
+    images = []
+    for path in opt.images:
+        with open(path, "rb") as f:
+            images.append(f.read())
+    if not images:
+        from benchmark import sample_bytes
+        images = [sample_bytes(model_conf)] + [sample_bytes(model_conf, resized=True) for _ in range(31)]
+    print("[Uint8] {} - Output[{}] - Parity[{}/{}]".format(
+        model_conf.model_name, output_path, verify(model_conf, model_conf.compile_model_path, output_path, images),
+        len(images)
+    ))
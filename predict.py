@@ -1,30 +1,38 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
+import numpy as np
 from config import ModelConfig
+import metrics
 
 
 def decode_maps(categories):
     return {index: category for index, category in enumerate(categories, 0)}
 
 
-def predict_func(image_batch, _sess, dense_decoded, op_input, model: ModelConfig, output_split=None):
+def decode_tokens(dense_decoded_code, model: ModelConfig):
+    dense_decoded_code = np.asarray(dense_decoded_code)
+    blank = (dense_decoded_code < 0) | (dense_decoded_code >= model.category_num)
+    return model.category_table[np.where(blank, model.category_num, dense_decoded_code)]
 
-    output_split = model.output_split if output_split is None else output_split
+
+def decode_func(dense_decoded_code, model: ModelConfig):
 
     category_split = model.category_split if model.category_split else ""
 
-    dense_decoded_code = _sess.run(dense_decoded, feed_dict={
-        op_input: image_batch,
-    })
-    decoded_expression = []
-    for item in dense_decoded_code:
-        expression = []
-
-        for i in item:
-            if i == -1 or i == model.category_num:
-                expression.append("")
-            else:
-                expression.append(decode_maps(model.category)[i])
-        decoded_expression.append(category_split.join(expression))
+    return [category_split.join(item) for item in decode_tokens(dense_decoded_code, model).tolist()]
+
+
+def run_func(image_batch, graph_session, model: ModelConfig):
+    with metrics.timer('sess_run', model.model_name):
+        dense_decoded_code = graph_session.run(image_batch)
+    with metrics.timer('ctc_decode', model.model_name):
+        return decode_func(dense_decoded_code, model)
+
+
+def predict_func(image_batch, graph_session, model: ModelConfig, output_split=None):
+
+    output_split = model.output_split if output_split is None else output_split
+
+    decoded_expression = run_func(image_batch, graph_session, model)
     return output_split.join(decoded_expression) if len(decoded_expression) > 1 else decoded_expression[0]
@@ -2,6 +2,13 @@
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
 import cv2
+import time
+import numpy as np
+from types import SimpleNamespace
+from PIL import Image as PIL_Image
+from middleware.impl.gif_frames import concat_frames, blend_frame
+from middleware.impl.rgb_filter import rgb_filter
+import metrics
 
 
 class Pretreatment(object):
@@ -38,5 +45,207 @@ def preprocessing_by_func(exec_map, key, src_arr):
     return cv2.cvtColor(target_arr, cv2.COLOR_BGR2RGB)
 
 
+def code_names(code) -> set:
+    names = set(code.co_names) | set(code.co_varnames) | set(code.co_freevars)
+    for const in code.co_consts:
+        if hasattr(const, 'co_names'):
+            names |= code_names(const)
+    return names
+
+
+class ExecuteScript(object):
+    """
+    The ExecuteMap statements of one param_key compiled once when the model is loaded,
+    "@@" statements are evaluated into target_arr and "$$" statements are executed.
+    The BGR copy of the input is only made if a statement reads target_arr before the first "@@" assigns it.
+    """
+
+    def __init__(self, key, sentences: list):
+        self.key = key
+        self.statements = []
+        for i, sentence in enumerate(sentences):
+            if sentence.startswith("@@"):
+                mode = 'eval'
+            elif sentence.startswith("$$"):
+                mode = 'exec'
+            else:
+                continue
+            try:
+                code = compile(sentence[2:], "<ExecuteMap[{}][{}]>".format(key, i), mode)
+            except SyntaxError as e:
+                raise Exception("ExecuteMap [{}] statement [{}] compile failed: {}".format(key, sentence, e))
+            self.statements.append((mode == 'eval', code))
+
+        self.need_target = False
+        for is_eval, code in self.statements:
+            if 'target_arr' in code_names(code):
+                self.need_target = True
+                break
+            if is_eval:
+                break
+        self.need_convert = self.need_target or any(is_eval for is_eval, _ in self.statements)
+
+    def __call__(self, src_arr, exec_map=None):
+        if not self.need_convert and len(src_arr.shape) == 3 and src_arr.shape[2] == 3:
+            return src_arr
+        namespace = {
+            'src_arr': src_arr,
+            'target_arr': cv2.cvtColor(src_arr, cv2.COLOR_RGB2BGR) if self.need_target else None,
+            'exec_map': exec_map,
+            'key': self.key,
+        }
+        for is_eval, code in self.statements:
+            if is_eval:
+                namespace['target_arr'] = eval(code, globals(), namespace)
+            else:
+                exec(code, globals(), namespace)
+        target_arr = namespace['target_arr']
+        if target_arr is None:
+            target_arr = cv2.cvtColor(src_arr, cv2.COLOR_RGB2BGR)
+        return cv2.cvtColor(target_arr, cv2.COLOR_BGR2RGB)
+
+
+def compile_exec_map(exec_map: dict) -> dict:
+    if not exec_map:
+        return {}
+    return {key: ExecuteScript(key, sentences) for key, sentences in exec_map.items()}
+
+
+class PreprocessPlan(object):
+    """
+    The preprocessing of one model, compiled once when the ModelConfig is loaded.
+    The model flags are resolved into an ordered list of array ops, the request only
+    runs the ops and writes the normalized tensor into a (preallocated) output buffer.
+    The pixels stay uint8 up to the transpose, the cast and the scale are fused into one pass into the output.
+    With `Uint8Resize` the resize is done in uint8 too (up to one level away from the float32 resize),
+    with `InputDtype: uint8` the graph takes the raw pixels and normalizes them itself.
+    A plan is pickled as the model parameters it was compiled from and compiled again when unpickled.
+    """
+
+    scale = np.float32(255.)
+    dtype_map = {
+        'float32': np.float32,
+        'uint8': np.uint8,
+    }
+    params = (
+        'image_channel', 'pre_replace_transparent', 'pre_concat_frames', 'pre_blend_frames', 'model_name', 'exec_map',
+        'resize', 'input_dtype', 'uint8_resize', 'pre_binaryzation', 'pre_horizontal_stitching'
+    )
+
+    def __init__(self, model):
+        model = SimpleNamespace(**{name: getattr(model, name) for name in self.params})
+        self.model = model
+        self.image_channel = model.image_channel
+        self.replace_transparent = model.pre_replace_transparent
+        self.gif_handle = model.pre_concat_frames != -1 or model.pre_blend_frames != -1
+        self.model_name = model.model_name
+        self.exec_map = model.exec_map
+        self.exec_scripts = compile_exec_map(model.exec_map)
+        self.resize_width, self.resize_height = model.resize[0], model.resize[1]
+        self.fixed_width = self.resize_width != -1
+        self.dtype = np.dtype(self.dtype_map.get(str(model.input_dtype).lower(), np.float32))
+        self.uint8_resize = bool(model.uint8_resize) or self.dtype == np.uint8
+
+        if model.pre_concat_frames != -1:
+            self.frame_op = lambda pil_image: concat_frames(pil_image, model.pre_concat_frames)
+        elif model.pre_blend_frames != -1:
+            self.frame_op = lambda pil_image: blend_frame(pil_image, model.pre_blend_frames)
+        else:
+            self.frame_op = np.asarray
+
+        self.ops = []
+        if self.image_channel == 1:
+            self.ops.append(self.to_gray)
+        if model.pre_binaryzation > 0:
+            self.ops.append(lambda im, size: preprocessing(im, model.pre_binaryzation))
+        if model.pre_horizontal_stitching:
+            self.ops.append(self.horizontal_stitching)
+
+    def __reduce__(self):
+        return self.__class__, (self.model, )
+
+    @property
+    def output_shape(self):
+        if not self.fixed_width:
+            return None
+        shape = (self.resize_width, self.resize_height)
+        return shape + (1, ) if self.image_channel == 1 else shape + (self.image_channel, )
+
+    @staticmethod
+    def to_gray(im, size):
+        return cv2.cvtColor(im, cv2.COLOR_RGB2GRAY) if len(im.shape) == 3 else im
+
+    @staticmethod
+    def horizontal_stitching(im, size):
+        up_slice = im[0: int(size[1] / 2), 0: size[0]]
+        down_slice = im[int(size[1] / 2): size[1], 0: size[0]]
+        return np.concatenate((up_slice, down_slice), axis=1)
+
+    def decode(self, pil_image):
+        if pil_image.mode == 'P' and not self.gif_handle:
+            pil_image = pil_image.convert('RGB')
+
+        rgb = pil_image.split()
+        size = pil_image.size
+
+        if (len(rgb) > 3 and self.replace_transparent) and not self.gif_handle:
+            background = PIL_Image.new('RGB', pil_image.size, (255, 255, 255))
+            try:
+                background.paste(pil_image, (0, 0, size[0], size[1]), pil_image)
+                pil_image = background
+            except:
+                pil_image = pil_image.convert('RGB')
+
+        if len(pil_image.split()) > 3 and self.image_channel == 3:
+            pil_image = pil_image.convert('RGB')
+
+        return self.frame_op(pil_image), size
+
+    def dsize(self, size):
+        if self.fixed_width:
+            return self.resize_width, self.resize_height
+        return int(self.resize_height / size[1] * size[0]), self.resize_height
+
+    def apply(self, pil_image, param_key=None, extract_rgb: list = None, out: np.ndarray = None):
+        start_time = time.perf_counter()
+        im, size = self.decode(pil_image)
+        decode_time = time.perf_counter()
+        metrics.observe('image_decode', decode_time - start_time, self.model_name)
+
+        if extract_rgb:
+            im = rgb_filter(im, extract_rgb)
+
+        if self.exec_scripts:
+            im = self.exec_scripts[param_key](im, self.exec_map)
+
+        for op in self.ops:
+            im = op(im, size)
+
+        # Resize in float32 (as the model was trained) unless the uint8 resize is enabled.
+        dsize = self.dsize(size)
+        resize = (im.shape[1], im.shape[0]) != dsize
+        if im.dtype != np.uint8 and self.dtype == np.uint8:
+            im = np.clip(im, 0, 255).astype(np.uint8)
+        if im.dtype == np.uint8 and (self.uint8_resize or not resize):
+            image = cv2.resize(im, dsize) if resize else im
+        else:
+            image = im.astype(np.float32, copy=False)
+            image = cv2.resize(image, dsize) if resize else image
+        transposed_shape = (image.shape[1], image.shape[0]) + image.shape[2:]
+        shape = transposed_shape + (1, ) if self.image_channel == 1 and len(image.shape) == 2 else transposed_shape
+        if out is None or out.shape != shape or out.dtype != self.dtype:
+            out = np.empty(shape, dtype=self.dtype)
+        transposed = out.reshape(transposed_shape)
+        if image.dtype == self.dtype:
+            cv2.transpose(image, transposed)
+            if self.dtype == np.float32:
+                np.divide(out, self.scale, out=out)
+        else:
+            # uint8 -> float32: the cast and the scale in a single pass.
+            np.divide(cv2.transpose(image), self.scale, out=transposed)
+        metrics.observe('preprocess', time.perf_counter() - decode_time, self.model_name)
+        return out
+
+
 if __name__ == '__main__':
     pass
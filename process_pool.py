@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import queue
+import weakref
+import threading
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from config import ModelConfig
+from buffer_pool import LeasedView, Lease
+from decoded_image import DecodedImage
+from pretreatment import PreprocessPlan
+
+# The state of a worker process: the preprocess plan of the model and the view of the shared slots.
+_worker = {}
+
+
+def init_worker(plan: PreprocessPlan, shm_name, shape):
+    # The plan is the one of the loaded model (pickled as its parameters), not the yaml currently on disk.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker['plan'] = plan
+    _worker['shm'] = shm
+    _worker['buffer'] = np.ndarray(shape, dtype=plan.dtype, buffer=shm.buf)
+
+
+def preprocess(source, slot: int, param_key=None, extract_rgb: list = None):
+    out = _worker['buffer'][slot]
+    image = _worker['plan'].apply(
+        DecodedImage.from_source(source).pil, param_key=param_key, extract_rgb=extract_rgb, out=out
+    )
+    if image is not out:
+        raise ValueError("The image size does not match the graph: {}".format(image.shape))
+
+
+class PreprocessPool(object):
+    """
+    Preprocesses the images of one model in worker processes, beyond the GIL.
+    The workers receive the encoded bytes (or the pixels of the crops and frames) and write the tensors into slots of a shared memory block,
+    the parent gets zero-copy views of the slots. A slot returns to the ring once the views of its batch
+    are released (after the batch has been fed to the session), when the ring is full the caller preprocesses
+    the images itself. Only the models with a fixed input width can use it.
+Every model has its own pool of `ProcessPoolWorkers` processes (System default 2, the yaml may override it).
+    """
+
+    def __init__(self, model_conf: ModelConfig):
+        self.model_conf = model_conf
+        self.logger = model_conf.logger
+        self.shape = model_conf.preprocess_plan.output_shape
+        if self.shape is None:
+            raise ValueError("The process pool requires a fixed input width: {}".format(model_conf.model_name))
+        self.workers = model_conf.process_pool_workers or model_conf.conf.process_pool_workers or 1
+        self.slots = model_conf.process_pool_slots or max(self.workers * 4, model_conf.conf.max_batch_size * 2)
+        dtype = model_conf.preprocess_plan.dtype
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slots * int(np.prod(self.shape)) * dtype.itemsize)
+        self.buffer = np.ndarray((self.slots, ) + self.shape, dtype=dtype, buffer=self.shm.buf)
+        self.free = queue.Queue()
+        for slot in range(self.slots):
+            self.free.put(slot)
+        self.lock = threading.Lock()
+        self.closed = False
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(model_conf.preprocess_plan, self.shm.name, self.buffer.shape)
+        )
+
+    def acquire(self, size: int):
+        slots = []
+        with self.lock:
+            if self.closed or self.free.qsize() < size:
+                return None
+            for _ in range(size):
+                slots.append(self.free.get_nowait())
+        return slots
+
+    def release(self, slots: list):
+        for slot in slots:
+            self.free.put(slot)
+
+    def map(self, sources: list, param_key=None, extract_rgb: list = None):
+        """
+        Returns the tensors of the images as views of the shared slots,
+        or None when there are not enough free slots.
+        """
+        slots = self.acquire(len(sources))
+        if slots is None:
+            return None
+        futures = []
+        try:
+            for source, slot in zip(sources, slots):
+                futures.append(self.executor.submit(preprocess, source, slot, param_key, extract_rgb))
+            for future in futures:
+                future.result()
+        except BaseException:
+            # The workers may still write to the slots of the failed batch, wait for them before releasing.
+            for future in futures:
+                future.cancel() or future.exception()
+            self.release(slots)
+            raise
+        # The slots are released when the last view is garbage collected.
+        lease = Lease()
+        views = [LeasedView(self.buffer[slot], lease) for slot in slots]
+        weakref.finalize(lease, self.release, slots)
+        return views
+
+    def shutdown(self):
+        with self.lock:
+            self.closed = True
+        self.executor.shutdown(wait=True)
+        self.buffer = None
+        self.shm.unlink()
+        try:
+            self.shm.close()
+        except BufferError:
+            # The views are still in use, the block is unmapped once they are released.
+            pass
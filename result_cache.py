@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from config import Config
+from decoded_image import DecodedImage
+
+
+class ResultCache(object):
+    """
+    Prediction results keyed by the hash of the request images and the parameters that change the result.
+    The entries are evicted in LRU order once the accounted size exceeds `max_bytes`, expire after `ttl` seconds
+    and are dropped whenever the model they belong to is added, reloaded or removed.
+    """
+
+    entry_overhead = 128
+
+    def __init__(self, conf: Config):
+        self.enable = conf.result_cache_enable and conf.result_cache_max_bytes > 0
+        self.max_bytes = conf.result_cache_max_bytes
+        self.ttl = conf.result_cache_ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(image_batch: list):
+        h = hashlib.blake2b(digest_size=16)
+        for image in image_batch:
+            raw = DecodedImage.of(image).raw
+            h.update(len(raw).to_bytes(8, 'little'))
+            h.update(raw)
+        return h.digest()
+
+    def key(self, image_batch: list, interface, param_key=None, extract_rgb=None, output_split=None, digest=None):
+        # The digest of the images may be computed in advance, off the IOLoop thread.
+        if not self.enable:
+            return None
+        return (
+            interface.name,
+            interface.version,
+            param_key,
+            str(extract_rgb) if extract_rgb else None,
+            output_split,
+            digest or self.digest(image_batch)
+        )
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expire_time = entry
+            if expire_time < time.time():
+                self._pop(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if key is None:
+            return
+        size = self.entry_overhead + len(str(value).encode('utf8'))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._pop(key)
+            self.entries[key] = (value, size, time.time() + self.ttl)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self.entries)))
+
+    def _pop(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+    def invalidate(self, model_name: str):
+        if not self.enable:
+            return
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == model_name]:
+                self._pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    @property
+    def stats(self):
+        return {
+            "enable": self.enable,
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import os
+import io
+import time
+import queue
+import random
+import atexit
+import tarfile
+import hashlib
+import threading
+from collections import OrderedDict
+from config import Config
+from decoded_image import DecodedImage
+
+
+class SampleWriter(object):
+    """
+    Saves the predicted samples to `SavePath` from a background thread, the requests only enqueue them
+    (the encoding and the content hash are done by the writer).
+    The samples are appended to rolling tar shards named `samples-<time>-<pid>-<seq>.tar`, a shard is written
+    as `.tar.part` and renamed once it reaches `ShardMaxBytes` or `ShardMaxAge` seconds.
+    Only `SampleRate` of the samples are kept, the ones already seen (by content hash, among the last
+    `DedupSize` ones) are skipped and the ones that do not fit in the queue are dropped.
+    """
+
+    def __init__(self, conf: Config):
+        self.path = conf.save_path
+        self.sample_rate = float(conf.sample_rate)
+        self.shard_max_bytes = conf.sample_shard_max_bytes
+        self.shard_max_age = conf.sample_shard_max_age
+        self.dedup_size = conf.sample_dedup_size
+        self.enable = bool(self.path) and self.sample_rate > 0
+        self.logger = conf.logger
+        self.queue = queue.Queue(maxsize=max(int(conf.sample_queue_size), 1))
+        self.lock = threading.Lock()
+        self.seen = OrderedDict()
+        self.thread = None
+        self.tar = None
+        self.shard_path = None
+        self.shard_time = 0
+        self.shard_seq = 0
+        self.written = 0
+        self.dropped = 0
+        self.duplicates = 0
+
+    def start(self):
+        if self.enable and not self.thread:
+            os.makedirs(self.path, exist_ok=True)
+            self.thread = threading.Thread(target=self.run, name="sample-writer", daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+        return self
+
+    def duplicate(self, raw: bytes):
+        if self.dedup_size <= 0:
+            return False
+        digest = hashlib.blake2b(raw, digest_size=16).digest()
+        with self.lock:
+            if digest in self.seen:
+                self.seen.move_to_end(digest)
+                self.duplicates += 1
+                return True
+            self.seen[digest] = None
+            if len(self.seen) > self.dedup_size:
+                self.seen.popitem(last=False)
+        return False
+
+    def submit(self, uid, label, image: DecodedImage):
+        if not self.thread or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return False
+        try:
+            self.queue.put_nowait((uid, label, image, time.time()))
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+
+    def open_shard(self):
+        self.shard_seq += 1
+        self.shard_time = time.time()
+        self.shard_path = os.path.join(self.path, "samples-{}-{}-{}.tar.part".format(
+            time.strftime('%Y%m%d%H%M%S', time.localtime(self.shard_time)), os.getpid(), self.shard_seq
+        ))
+        self.tar = tarfile.open(self.shard_path, "w")
+
+    def close_shard(self):
+        if not self.tar:
+            return
+        self.tar.close()
+        os.replace(self.shard_path, self.shard_path[:-len(".part")])
+        self.tar = None
+
+    def save(self, uid, label, image: DecodedImage, mtime: float):
+        image = DecodedImage.of(image)
+        raw = image.raw
+        if self.duplicate(raw):
+            return
+        label = str(label).replace('/', '_').replace('\\', '_')
+        self.write("{}_{}.{}".format(label, uid, image.format or 'png'), raw, mtime)
+
+    def write(self, name: str, raw: bytes, mtime: float):
+        if self.tar and (
+                self.tar.offset >= self.shard_max_bytes or time.time() - self.shard_time >= self.shard_max_age
+        ):
+            self.close_shard()
+        if not self.tar:
+            self.open_shard()
+        info = tarfile.TarInfo(name)
+        info.size = len(raw)
+        info.mtime = mtime
+        self.tar.addfile(info, io.BytesIO(raw))
+        self.written += 1
+
+    def run(self):
+        while True:
+            try:
+                sample = self.queue.get(timeout=1)
+            except queue.Empty:
+                # Idle, make the samples durable and roll an expired shard.
+                if self.tar:
+                    self.tar.fileobj.flush()
+                    if time.time() - self.shard_time >= self.shard_max_age:
+                        self.close_shard()
+                continue
+            if sample is None:
+                break
+            try:
+                self.save(*sample)
+            except (OSError, ValueError) as e:
+                self.logger.error('The sample cannot be saved: {}'.format(e))
+        self.close_shard()
+
+    def close(self):
+        if not self.thread:
+            return
+        thread, self.thread = self.thread, None
+        self.queue.put(None)
+        thread.join()
+
+    @property
+    def stats(self):
+        return {
+            "enable": self.enable,
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+        }
@@ -309,6 +309,8 @@ class ModelConfig(object):
             )
         self.category: list = SPACE_TOKEN + self.category_value
         self.category_num: int = len(self.category)
+        # index -> token lookup, the extra slot decodes the blank (-1 and category_num).
+        self.category_table = np.array(self.category + [""], dtype=object)
         self.image_channel: int = self.field_root.get('ImageChannel')
         self.image_width: int = self.field_root.get('ImageWidth')
         self.image_height: int = self.field_root.get('ImageHeight')
@@ -515,6 +517,12 @@ class Interface(object):
     def decode_maps(categories):
         return {index: category for index, category in enumerate(categories, 0)}
 
+    @staticmethod
+    def decode_tokens(dense_decoded_code, model: ModelConfig):
+        dense_decoded_code = np.asarray(dense_decoded_code)
+        blank = (dense_decoded_code < 0) | (dense_decoded_code >= model.category_num)
+        return model.category_table[np.where(blank, model.category_num, dense_decoded_code)]
+
     def predict_func(self, image_batch, _sess, dense_decoded, op_input, model: ModelConfig, output_split=None):
 
         output_split = model.output_split if output_split is None else output_split
@@ -524,17 +532,9 @@ class Interface(object):
         dense_decoded_code = _sess.run(dense_decoded, feed_dict={
             op_input: image_batch,
         })
-        decoded_expression = []
-
-        for item in dense_decoded_code:
-            expression = []
-            for i in item:
-                if i == -1 or i == model.category_num:
-                    expression.append("")
-                else:
-                    expression.append(self.decode_maps(model.category)[i])
-
-            decoded_expression.append(category_split.join(expression))
+        decoded_expression = [
+            category_split.join(item) for item in self.decode_tokens(dense_decoded_code, model).tolist()
+        ]
 
         if output_split is None:
             output_split = model.output_split
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj, ensure_ascii=True, compact=False) -> bytes:
+    # The default output is the bytes of tornado's json_encode (or of json.dumps(..., ensure_ascii=False)),
+    # `</` is escaped so that the responses can be embedded in a HTML page.
+    # The compact output (the batch items) uses the faster codec when it is installed.
+    body = None
+    if compact and not ensure_ascii and orjson is not None:
+        try:
+            body = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            pass
+    if body is None:
+        separators = (',', ':') if compact else None
+        body = json.dumps(obj, ensure_ascii=ensure_ascii, separators=separators).encode('utf8')
+    return body.replace(b"</", b"<\\/") if b"</" in body else body
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+class ResponseSerializer(object):
+    """
+    Encodes the prediction responses straight to bytes with the keys of `ResponseDef`.
+    The error responses are the same for every request but the uid, they are serialized once per
+    (code, message) into a template and the uid is spliced in. The success responses only encode the message.
+    """
+
+    def __init__(self, response_def_map: dict):
+        self.uid_key = response_def_map['Uid']
+        self.message_key = response_def_map['Message']
+        self.status_bool_key = response_def_map['StatusBool']
+        self.status_code_key = response_def_map['StatusCode']
+        self.templates = {}
+        # {"message": <message>, "code": 0, "success": true, "uid": "<uid>"}
+        self.success_prefix = b'{' + dumps(self.message_key) + b': '
+        self.success_suffix = b', ' + dumps({self.status_code_key: 0, self.status_bool_key: True})[1:-1]
+        self.uid_prefix = b', ' + dumps(self.uid_key) + b': "'
+
+    def template(self, code, message, with_uid: bool, ensure_ascii: bool):
+        key = (code, message, with_uid, ensure_ascii)
+        template = self.templates.get(key)
+        if template is None:
+            body = dumps(
+                {self.message_key: message, self.status_bool_key: False, self.status_code_key: code},
+                ensure_ascii=ensure_ascii
+            )
+            # {"uid": "<uid>", "message": <message>, "success": false, "code": <code>}
+            template = (b'{' + dumps(self.uid_key) + b': "', b'", ' + body[1:]) if with_uid else (body, )
+            self.templates[key] = template
+        return template
+
+    def error(self, code, message="", uid: str = None, ensure_ascii=True) -> bytes:
+        template = self.template(code, message, uid is not None, ensure_ascii)
+        return template[0] + uid.encode('utf8') + template[1] if uid is not None else template[0]
+
+    def success(self, message, uid: str = None) -> bytes:
+        body = self.success_prefix + dumps(message, ensure_ascii=False) + self.success_suffix
+        if uid is not None:
+            body += self.uid_prefix + uid.encode('utf8') + b'"'
+        return body + b'}'
+
+    @staticmethod
+    def encode(response: dict, ensure_ascii=True) -> bytes:
+        return dumps(response, ensure_ascii=ensure_ascii)
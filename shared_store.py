@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import os
+import time
+import tempfile
+import threading
+from multiprocessing.managers import BaseManager
+
+
+class LocalStore(object):
+    """
+    Counters and values shared by the request handlers of one process.
+    The same object is served over a local socket by SharedStore when several
+    worker processes are running.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.windows = {}
+        self.values = {}
+
+    def incr(self, namespace: str, key: str, delta=1):
+        with self.lock:
+            group = self.counters.setdefault(namespace, {})
+            group[key] = group.get(key, 0) + delta
+            return group[key]
+
+    def decr(self, namespace: str, key: str):
+        with self.lock:
+            group = self.counters.get(namespace)
+            if not group or key not in group:
+                return None
+            group[key] -= 1
+            return group[key]
+
+    def count(self, namespace: str, key: str, default=0):
+        group = self.counters.get(namespace)
+        return group.get(key, default) if group else default
+
+    def window_incr(self, namespace: str, key: str, interval: float, delta=1, max_keys=0):
+        """
+        A sliding window counter: the count of the current window plus the count of the previous one
+        weighted by the part of it still covered by the last `interval` seconds.
+        The keys idle for two windows are pruned once per window, beyond `max_keys` the oldest keys are evicted.
+        """
+        now = time.time()
+        index, offset = divmod(now, interval)
+        with self.lock:
+            group = self.windows.get(namespace)
+            if group is None or group['index'] != index:
+                group = self.windows[namespace] = dict(index=index, keys={
+                    k: v for k, v in (group['keys'].items() if group else ()) if v[0] >= index - 1
+                })
+            keys = group['keys']
+            window = keys.get(key)
+            if window is None:
+                window = keys[key] = [index, 0, 0]
+                if max_keys and len(keys) > max_keys:
+                    keys.pop(next(iter(keys)))
+            if window[0] != index:
+                window[2] = window[1] if window[0] == index - 1 else 0
+                window[1] = 0
+                window[0] = index
+            window[1] = max(window[1] + delta, 0)
+            return round(window[1] + window[2] * (1 - offset / interval))
+
+    def window_incr_many(self, calls: list):
+        # Several window_incr calls (tuples of its arguments) in a single call, one round-trip for a worker.
+        return [self.window_incr(*call) for call in calls]
+
+    def clear(self, namespace: str):
+        with self.lock:
+            self.counters.pop(namespace, None)
+            self.windows.pop(namespace, None)
+
+    def get_value(self, name: str, default=None):
+        return self.values.get(name, default)
+
+    def set_value(self, name: str, value):
+        self.values[name] = value
+
+    def list_add_unique(self, name: str, item):
+        # Append the item to the list value unless it is already in it, atomic for all the workers.
+        # Returns whether it was added and the resulting list.
+        with self.lock:
+            items = list(self.values.get(name) or [])
+            if item in items:
+                return False, items
+            items.append(item)
+            self.values[name] = items
+            return True, list(items)
+
+
+_local_store = LocalStore()
+
+
+def local_store():
+    return _local_store
+
+
+class StoreManager(BaseManager):
+    pass
+
+
+StoreManager.register('store', callable=local_store)
+
+
+class SharedStore(object):
+    """
+    Serve one LocalStore to the pre-forked worker processes through a unix socket.
+    start() is called in the master process before forking, connect() in every worker after forking.
+    """
+
+    def __init__(self, address=None):
+        self.address = address if address else os.path.join(
+            tempfile.gettempdir(), "captcha_platform_{}.sock".format(os.getpid())
+        )
+        self.authkey = os.urandom(16)
+        self.server = StoreManager(address=self.address, authkey=self.authkey)
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def connect(self):
+        client = StoreManager(address=self.address, authkey=self.authkey)
+        client.connect()
+        return client.store()
+
+    def shutdown(self):
+        self.server.shutdown()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import io
+import os
+import json
+import base64
+import logging
+import optparse
+import tempfile
+import unittest
+from concurrent.futures import Future
+from types import SimpleNamespace
+import numpy as np
+import tornado.testing
+from PIL import Image
+
+
+def image(width, height):
+    buffer = io.BytesIO()
+    Image.fromarray(np.zeros((height, width, 3), np.uint8)).save(buffer, 'PNG')
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+class FakeInterface(object):
+
+    def __init__(self, size_str):
+        self.name = self.graph_name = "m1"
+        self.version = 1.0
+        self.size_str = size_str
+        self.model_category = []
+        self.model_conf = SimpleNamespace(
+            exec_map=None, external_model=False, corp_params=None, pre_freq_frames=-1, output_split="",
+            output_coord=False
+        )
+
+    def try_acquire(self):
+        return True
+
+    def release(self, *_):
+        pass
+
+    def get_image_batch(self, bytes_batch, param_key=None, extract_rgb=None):
+        return bytes_batch, None
+
+    def predict_texts_async(self, image_batch):
+        future = Future()
+        future.set_result(["ok"] * len(image_batch))
+        return future
+
+
+class BatchPolicyTest(tornado.testing.AsyncHTTPTestCase):
+    """
+    The items of /captcha/batch are checked like /captcha/v1 requests: the RequestSizeLimit
+    and the IP limit (with its blacklist trigger) apply to every item.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # The server module reads (and creates) its config.yaml in the working directory.
+        cls.cwd = os.getcwd()
+        cls.tmp = tempfile.TemporaryDirectory()
+        os.chdir(cls.tmp.name)
+        import tornado_server
+        from constants import SystemConfig
+        from executor import ExecutorManager
+        from interface import InterfaceManager
+        from limiter import Limiter
+        from result_cache import ResultCache
+        from shared_store import LocalStore
+        cls.ts = ts = tornado_server
+        cls.routes = SystemConfig.default_route
+        ts.opt = optparse.Values(dict(low_hour=-1, up_hour=-1))
+        ts.logger = logging.getLogger("test")
+        ts.executor_manager = ExecutorManager.shared(ts.system_config)
+        ts.result_cache = ResultCache(SimpleNamespace(
+            result_cache_enable=False, result_cache_max_bytes=0, result_cache_ttl=0
+        ))
+        ts.interface_manager = InterfaceManager(FakeInterface("20x10"))
+        cls.Limiter, cls.LocalStore = Limiter, LocalStore
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.cwd)
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        super().setUp()
+        self.ts.request_limit = -1
+        self.ts.global_request_limit = -1
+        self.ts.system_config.request_size_limit = {}
+        self.ts.system_config.blacklist_trigger_times = -1
+        self.ts.limiter = self.Limiter(self.ts.system_config, self.LocalStore())
+
+    def get_app(self):
+        return self.ts.make_app(self.routes)
+
+    def batch(self, items):
+        response = self.fetch('/captcha/batch', method='POST', body=json.dumps(items))
+        self.assertEqual(response.code, 200)
+        return {item['id']: item['code'] for item in json.loads(response.body)}
+
+    def test_size_limit_per_item(self):
+        self.ts.system_config.request_size_limit = {"20x10": True}
+        codes = self.batch([
+            dict(id="ok", image=image(20, 10)), dict(id="big", image=image(400, 300)), dict(id="ok2", image=image(20, 10))
+        ])
+        self.assertEqual(codes, {"ok": 0, "big": -250, "ok2": 0})
+        # The rejected item is not counted, as for a /captcha/v1 request.
+        self.assertEqual(self.ts.limiter.hit_all("127.0.0.1", 0), [2, 2])
+
+    def test_ip_limit_and_ban_per_item(self):
+        self.ts.request_limit = 2
+        self.ts.system_config.blacklist_trigger_times = 2
+        codes = self.batch([dict(id=i, image=image(20, 10)) for i in range(5)])
+        self.assertEqual(codes, {0: 0, 1: 0, 2: -444, 3: -444, 4: -444})
+        self.assertTrue(self.ts.limiter.blacklisted("127.0.0.1"))
+        response = self.fetch('/captcha/batch', method='POST', body=json.dumps([dict(id=0, image=image(20, 10))]))
+        self.assertEqual(json.loads(response.body)['code'], -110)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import json
+import time
+import logging
+import unittest
+from types import SimpleNamespace
+from compat import grpc_server, grpc_pb2
+from result_cache import ResultCache
+
+
+class OutputCoordTest(unittest.TestCase):
+
+    def setUp(self):
+        grpc_server.logger = logging.getLogger("test")
+        grpc_server.result_cache = ResultCache(
+            SimpleNamespace(result_cache_enable=True, result_cache_max_bytes=1 << 20, result_cache_ttl=60)
+        )
+
+    def test_coordinates_are_a_string(self):
+        corp_param = dict(start_pos=[0, 0], corp_size=[10, 10], corp_num=[2, 2], interval_size=[0, 0])
+        model_conf = SimpleNamespace(pre_freq_frames=-1, corp_params=[corp_param], output_coord=True)
+        interface = SimpleNamespace(name="m1", model_conf=model_conf, model_category=["CLASSIFICATION"])
+        job = dict(
+            request=grpc_pb2.PredictRequest(id="x"), interface=interface, output_split=",",
+            cache_key="key", size="20x20", start_time=time.time()
+        )
+        result = grpc_server.Predict.finish(grpc_server.Predict.__new__(grpc_server.Predict), job, ["a", "b", "a"])
+        self.assertEqual(result.code, 0)
+        self.assertEqual(result.id, "x")
+        self.assertEqual(json.loads(result.result), [[15, 5]])
+        self.assertEqual(grpc_server.result_cache.get("key"), result.result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import logging
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from interface import InterfaceManager
+from event_handler import FileEventHandler
+
+
+class FakeInterface(object):
+
+    def __init__(self, name, version, size_str="150x50"):
+        self.name = self.graph_name = name
+        self.version = version
+        self.size_str = size_str
+        self.retired = False
+        self.destroyed = threading.Event()
+
+    def retire(self):
+        self.retired = True
+
+    def destroy(self):
+        self.destroyed.set()
+
+
+class ModelUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model_dir = tempfile.TemporaryDirectory()
+        conf = SimpleNamespace(logger=logging.getLogger("test"), default_model="m0", model_load_workers=1)
+        self.manager = InterfaceManager()
+        self.handler = FileEventHandler(conf, self.model_dir.name, self.manager)
+
+    def tearDown(self):
+        self.model_dir.cleanup()
+
+    def commit(self, key, interface):
+        model_conf = SimpleNamespace(model_name=interface.name, size_string=interface.size_str)
+        self.assertTrue(self.handler.commit("{}/{}.yaml".format(self.model_dir.name, key), (model_conf, interface)))
+
+    def test_add_v2_then_delete_v1(self):
+        v1, v2 = FakeInterface("m1", 1.0), FakeInterface("m1", 4.0)
+        self.commit("m1", v1)
+        self.commit("m1_v2", v2)
+        self.assertEqual(self.manager.total, 2)
+        self.assertIs(self.manager.get_by_name("m1"), v2)
+        self.assertIs(self.manager.get_by_size("150x50"), v2)
+
+        self.handler.delete("{}/m1.yaml".format(self.model_dir.name))
+        self.assertTrue(v1.destroyed.wait(5))
+        self.assertEqual(self.manager.total, 1)
+        self.assertIs(self.manager.get_by_name("m1"), v2)
+        self.assertIs(self.manager.default, v2)
+        self.assertFalse(v2.retired)
+
+    def test_lower_version_does_not_evict(self):
+        v2, v1 = FakeInterface("m1", 2.0), FakeInterface("m1", 1.0)
+        self.commit("m1_v2", v2)
+        self.commit("m1", v1)
+        self.assertIs(self.manager.get_by_name("m1"), v2)
+        self.assertIs(self.manager.default, v2)
+        self.assertFalse(v2.retired)
+
+        same = FakeInterface("m1", 2.0)
+        self.commit("m1_copy", same)
+        self.assertIs(self.manager.get_by_name("m1"), v2)
+
+    def test_reload_replaces_in_place(self):
+        old, new = FakeInterface("m1", 1.0), FakeInterface("m1", 1.0)
+        self.commit("m1", old)
+        self.commit("m1", new)
+        self.assertTrue(old.destroyed.wait(5))
+        self.assertEqual(self.manager.total, 1)
+        self.assertIs(self.manager.get_by_name("m1"), new)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+# Author: kerlomz <kerlomz@gmail.com>
+import os
+import json
+import logging
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from config import BLACKLIST_PATH
+from limiter import Limiter
+from shared_store import SharedStore
+
+
+class BanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.shared = SharedStore(os.path.join(self.tmp.name, "store.sock")).start()
+        self.conf = SimpleNamespace(logger=logging.getLogger("test"), limiter_max_keys=0, request_count_interval=60)
+
+    def tearDown(self):
+        self.shared.shutdown()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def worker(self):
+        # A worker process: its own proxy and its own trie.
+        return Limiter(self.conf, self.shared.connect())
+
+    def test_stale_worker_does_not_duplicate(self):
+        first, second = self.worker(), self.worker()
+        self.assertTrue(first.ban("127.0.0.1"))
+        self.assertFalse(second.blacklisted("127.0.0.1"))
+        self.assertFalse(second.ban("127.0.0.1"))
+        self.assertTrue(second.blacklisted("127.0.0.1"))
+        with open(BLACKLIST_PATH, encoding="utf8") as f:
+            self.assertEqual(json.load(f), ["127.0.0.1"])
+
+    def test_concurrent_bans_are_kept(self):
+        workers = [self.worker() for _ in range(4)]
+        ips = ["10.0.0.{}".format(i) for i in range(16)]
+        threads = [
+            threading.Thread(target=workers[i % len(workers)].ban, args=(ip, )) for i, ip in enumerate(ips)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(self.shared.connect().get_value('ip_blacklist')), sorted(ips))
+        with open(BLACKLIST_PATH, encoding="utf8") as f:
+            self.assertEqual(sorted(json.load(f)), sorted(ips))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,83 +15,121 @@ import tornado.ioloop
 import tornado.log
 import tornado.gen
 import tornado.httpserver
-import tornado.options
+import tornado.netutil
+import tornado.httputil
+import tornado.process
 from pytz import utc
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.schedulers.background import BackgroundScheduler
 from tornado.web import RequestHandler
 from constants import Response
 from json.decoder import JSONDecodeError
-from tornado.escape import json_decode, json_encode
+from tornado.escape import json_decode
 from interface import InterfaceManager, Interface
-from config import Config, blacklist, set_blacklist, whitelist, get_version
+from config import Config, whitelist, get_version
 from utils import ImageUtils, ParamUtils, Arithmetic
+from decoded_image import DecodedImage
 from signature import Signature, ServerType
-from tornado.concurrent import run_on_executor
-from concurrent.futures import ThreadPoolExecutor
+from executor import ExecutorManager, ExecutorOverload
+from shared_store import SharedStore, local_store
+from limiter import Limiter
+from result_cache import ResultCache
+from serializer import ResponseSerializer, dumps, loads
+from sample_writer import SampleWriter
 from middleware import *
+import metrics
 from event_loop import event_loop
 
-tornado.options.define('ip_blacklist', default=list(), type=list)
-tornado.options.define('ip_whitelist', default=list(), type=list)
-tornado.options.define('ip_risk_times', default=dict(), type=dict)
-tornado.options.define('request_count', default=dict(), type=dict)
-tornado.options.define('global_request_count', default=0, type=int)
 model_path = "model"
 system_config = Config(conf_path="config.yaml", model_path=model_path, graph_path="graph")
 sign = Signature(ServerType.TORNADO, system_config)
 arithmetic = Arithmetic()
+serializer = ResponseSerializer(system_config.response_def_map)
 semaphore = asyncio.Semaphore(500)
 
 scheduler = BackgroundScheduler(timezone='Asia/Shanghai')
+request_store = local_store()
 
 
 class BaseHandler(RequestHandler):
+    # Only the prediction handlers are counted in the request metrics.
+    track_requests = False
 
     def __init__(self, application, request, **kwargs):
         super().__init__(application, request, **kwargs)
         self.exception = Response(system_config.response_def_map)
-        self.executor = ThreadPoolExecutor(workers)
+        self.executor = executor_manager.preprocess
         self.image_utils = ImageUtils(system_config)
-
-    @property
-    def request_incr(self):
-        if self.request.remote_ip not in tornado.options.options.request_count:
-            tornado.options.options.request_count[self.request.remote_ip] = 1
-        else:
-            tornado.options.options.request_count[self.request.remote_ip] += 1
-        return tornado.options.options.request_count[self.request.remote_ip]
-
-    def request_desc(self):
-        if self.request.remote_ip not in tornado.options.options.request_count:
-            return
+        self.model_name = ''
+        self.response_code = None
+        self.start_time = time.time()
+        self.interfaces = []
+
+    def get_interface(self, model_name=None, size_string=None):
+        # The interface is held until the response is finished, a swap drains it instead of closing it under us.
+        if model_name:
+            interface = interface_manager.get_by_name(model_name, acquire=True)
         else:
-            tornado.options.options.request_count[self.request.remote_ip] -= 1
-
-    @property
-    def global_request_incr(self):
-        tornado.options.options.global_request_count += 1
-        return tornado.options.options.global_request_count
+            interface = interface_manager.get_by_size(size_string, acquire=True)
+        if interface:
+            self.interfaces.append(interface)
+        return interface
+
+    def on_finish(self):
+        interfaces, self.interfaces = self.interfaces, []
+        for interface in interfaces:
+            interface.release()
+        if self.track_requests:
+            code = self.get_status() if self.response_code is None else self.response_code
+            metrics.requests_total.inc(model=self.model_name, code=code)
+
+    def reply(self, response: dict, ensure_ascii=True):
+        self.response_code = response.get(system_config.response_def_map['StatusCode'])
+        with metrics.timer('serialize', self.model_name):
+            body = serializer.encode(response, ensure_ascii)
+        return self.finish(body)
 
     @staticmethod
-    def global_request_desc():
-        tornado.options.options.global_request_count -= 1
-
-    @staticmethod
-    def risk_ip_count(ip):
-        if ip not in tornado.options.options.ip_risk_times:
-            tornado.options.options.ip_risk_times[ip] = 1
-        else:
-            tornado.options.options.ip_risk_times[ip] += 1
-
-    @staticmethod
-    def risk_ip(ip):
-        return tornado.options.options.ip_risk_times[ip]
+    def stage(executor, fn, *args, **kwargs):
+        # Run a CPU bound stage on the executor, the IOLoop thread only awaits it.
+        return asyncio.wrap_future(executor.submit(fn, *args, **kwargs))
+
+    def reply_error(self, code, message="", uid=None, ensure_ascii=True):
+        self.response_code = code
+        with metrics.timer('serialize', self.model_name):
+            body = serializer.error(code, message, uid, ensure_ascii)
+        return self.finish(body)
+
+    def reply_success(self, message, uid=None):
+        self.response_code = 0
+        with metrics.timer('serialize', self.model_name):
+            body = serializer.success(message, uid)
+        return self.finish(body)
+
+    async def limit(self, fn, *args):
+        # With --processes every limiter call is a blocking round-trip to the store process, it runs on the io executor.
+        if limiter.local:
+            return fn(*args)
+        return await self.stage(executor_manager.io, fn, *args)
+
+    def request_desc(self, delta=1):
+        # The IP and the global counters of a rejected request are given back (in the background for a shared store).
+        if limiter.local:
+            limiter.undo_all(self.request.remote_ip, delta)
+            return
+        try:
+            executor_manager.io.submit(limiter.undo_all, self.request.remote_ip, delta)
+        except ExecutorOverload:
+            logger.warning('The request counters are not given back, the io executor is overloaded.')
 
     def data_received(self, chunk):
         pass
 
     def parse_param(self):
+        with metrics.timer('body_parse'):
+            return self._parse_param()
+
+    def _parse_param(self):
         try:
             data = json_decode(self.request.body)
         except JSONDecodeError:
@@ -102,67 +140,128 @@ class BaseHandler(RequestHandler):
             raise tornado.web.HTTPError(400)
         return data
 
+    def log_exception(self, typ, value, tb):
+        if isinstance(value, ExecutorOverload):
+            logger.warning('[{} {}] | Rejected[{}]'.format(self.request.remote_ip, self.request.uri, value))
+            return
+        super().log_exception(typ, value, tb)
+
     def write_error(self, code, **kw):
+        exc_info = kw.get('exc_info')
+        if exc_info and isinstance(exc_info[1], ExecutorOverload):
+            code = 503
+            self.set_status(code)
         err_resp = dict(StatusCode=code, Message=system_config.error_message[code], StatusBool=False)
         if code in system_config.error_message:
             code_dict = Response.parse(err_resp, system_config.response_def_map)
         else:
             code_dict = self.exception.find(code)
-        return self.finish(json.dumps(code_dict, ensure_ascii=False))
+        return self.finish(dumps(code_dict, ensure_ascii=False))
 
 
 class NoAuthHandler(BaseHandler):
+    track_requests = True
     uid_key: str = system_config.response_def_map['Uid']
     message_key: str = system_config.response_def_map['Message']
     status_bool_key = system_config.response_def_map['StatusBool']
     status_code_key = system_config.response_def_map['StatusCode']
 
     @staticmethod
-    def save_image(uid, label, image_bytes):
-        if system_config.save_path:
-            if not os.path.exists(system_config.save_path):
-                os.makedirs(system_config.save_path)
-            save_name = "{}_{}.png".format(label, uid)
-            with open(os.path.join(system_config.save_path, save_name), "wb") as f:
-                f.write(image_bytes)
-
-    @run_on_executor
-    def predict(self, interface: Interface, image_batch, split_char):
-        result = interface.predict_batch(image_batch, split_char)
+    def calc_arithmetic(interface: Interface, result: str):
         if 'ARITHMETIC' in interface.model_category:
             if '=' in result or '+' in result or '-' in result or '×' in result or '÷' in result:
-                result = result.replace("×", "*").replace("÷", "/")
-                result = str(int(arithmetic.calc(result)))
+                value = arithmetic.calc(result)
+                # The malformed formula is returned as it was recognized.
+                result = result if value is None else str(int(value))
         return result
 
+    async def predict(self, interface: Interface, image_batch, split_char):
+        result = await asyncio.wrap_future(interface.predict_async(image_batch, split_char))
+        return self.calc_arithmetic(interface, result)
+
     @staticmethod
     def match_blacklist(ip: str):
-        for black_ip in tornado.options.options.ip_blacklist:
-            if ip.startswith(black_ip):
-                return True
-        return False
+        return limiter.blacklisted(ip)
 
     @staticmethod
     def match_whitelist(ip: str):
-        for white_ip in tornado.options.options.ip_whitelist:
-            if ip.startswith(white_ip):
-                return True
-        return False
+        return limiter.whitelisted(ip)
+
+    @staticmethod
+    def check_policy(ip: str, size_string: str, request_count: int, global_count: int):
+        # The access policy of one image (a request or an item of a batch), returns (message, code, reason) or None.
+        if system_config.request_size_limit and size_string not in system_config.request_size_limit:
+            msg = system_config.request_size_limit.get("msg")
+            msg = msg if msg else "The size of the picture is wrong. " \
+                                  "Only the original image is supported. " \
+                                  "Please do not take a screenshot!"
+            return msg, -250, "Image size is invalid."
+        if system_config.use_whitelist and not NoAuthHandler.match_whitelist(ip):
+            return "Only allow IP access in the whitelist", -111, "Whitelist limit"
+        if global_request_limit != -1 and global_count > global_request_limit:
+            return system_config.exceeded_msg, -555, "Maximum number of requests exceeded (G)"
+        if NoAuthHandler.match_blacklist(ip):
+            return system_config.exceeded_msg, -110, "The ip is on the risk blacklist (IP)"
+        if request_limit != -1 and request_count > request_limit:
+            return system_config.exceeded_msg, -444, "Maximum number of requests exceeded (IP)"
 
     async def options(self):
         self.set_status(204)
         return self.finish()
 
-    @tornado.gen.coroutine
-    def post(self):
-        uid = str(uuid.uuid1())
-        start_time = time.time()
-        data = self.parse_param()
-        request_def_map = system_config.request_def_map
-        input_data_key = request_def_map['InputData']
-        model_name_key = request_def_map['ModelName']
-        if input_data_key not in data.keys():
+    async def post(self):
+        # The stages: parse -> decode -> preprocess -> infer -> postprocess,
+        # every CPU bound one runs on an executor, the IOLoop thread only does the I/O.
+        data = await self.stage(executor_manager.decode, self.parse_param)
+        if system_config.request_def_map['InputData'] not in data.keys():
             raise tornado.web.HTTPError(400)
+        return await self.handle(data)
+
+    def load_images(self, data: dict):
+        with metrics.timer('base64_decode'):
+            return self.image_utils.get_bytes_batch(data[system_config.request_def_map['InputData']])
+
+    def decode(self, data: dict):
+        bytes_batch, response = self.load_images(data)
+        if not bytes_batch:
+            return None, response, None, None
+        image_size = ImageUtils.size_of_image(bytes_batch[0])
+        digest = result_cache.digest(bytes_batch) if result_cache.enable else None
+        return bytes_batch, response, "{}x{}".format(image_size[0], image_size[1]), digest
+
+    @staticmethod
+    def split_images(model_conf, bytes_batch):
+        if model_conf.corp_params:
+            bytes_batch = corp_to_multi.parse_multi_img(bytes_batch, model_conf.corp_params)
+        if model_conf.pre_freq_frames != -1:
+            bytes_batch = gif_frames.all_frames(bytes_batch)
+        return bytes_batch
+
+    @staticmethod
+    def postprocess(model_conf, predict_result):
+        # Returns the label of the sample and the message of the response.
+        if model_conf.pre_freq_frames != -1:
+            predict_result = predict_result.split(model_conf.output_split)
+            predict_result = [
+                i for i in predict_result
+                if model_conf.max_label_num >= len(i) >= model_conf.min_label_num
+            ]
+            predict_result = gif_frames.get_continuity_max(predict_result)
+        label = predict_result
+        if model_conf.corp_params and model_conf.output_coord:
+            # final_result = auxiliary_result + "," + predict_result
+            # if auxiliary_result else predict_result
+            predict_result = corp_to_multi.get_coordinate(
+                label=predict_result,
+                param_group=model_conf.corp_params,
+                title_index=[0]
+            )
+        return label, predict_result
+
+    async def handle(self, data: dict):
+        uid = str(uuid.uuid1())
+        start_time = self.start_time
+        model_name_key = system_config.request_def_map['ModelName']
 
         model_name = ParamUtils.filter(data.get(model_name_key))
         output_split = ParamUtils.filter(data.get('output_split'))
@@ -170,176 +269,91 @@ class NoAuthHandler(BaseHandler):
         param_key = ParamUtils.filter(data.get('param_key'))
         extract_rgb = ParamUtils.filter(data.get('extract_rgb'))
 
-        request_incr = self.request_incr
-        global_count = self.global_request_incr
+        request_incr, global_count = await self.limit(limiter.hit_all, self.request.remote_ip)
         request_count = " - Count[{}]".format(request_incr)
         log_params = " - ParamKey[{}]".format(param_key) if param_key else ""
         log_params += " - NeedColor[{}]".format(need_color) if need_color else ""
 
         if interface_manager.total == 0:
             self.request_desc()
-            self.global_request_desc()
             logger.info('There is currently no model deployment and services are not available.')
-            return self.finish(json_encode(
-                {self.uid_key: uid, self.message_key: "", self.status_bool_key: False, self.status_code_key: -999}
-            ))
-        bytes_batch, response = self.image_utils.get_bytes_batch(data[input_data_key])
+            return self.reply_error(-999, "", uid)
+        bytes_batch, response, size_string, digest = await self.stage(executor_manager.decode, self.decode, data)
 
         if not (opt.low_hour == -1 or opt.up_hour == -1) and not (opt.low_hour <= time.localtime().tm_hour <= opt.up_hour):
             logger.info("[{}] - [{} {}] | - Response[{}] - {} ms".format(
                 uid, self.request.remote_ip, self.request.uri, "Not in open time.",
                 (time.time() - start_time) * 1000)
             )
-            return self.finish(json.dumps({
-                self.uid_key: uid,
-                self.message_key: system_config.illegal_time_msg.format(opt.low_hour, opt.up_hour),
-                self.status_bool_key: False,
-                self.status_code_key: -250
-            }, ensure_ascii=False))
+            return self.reply_error(-250, system_config.illegal_time_msg.format(opt.low_hour, opt.up_hour), uid, ensure_ascii=False)
 
         if not bytes_batch:
             logger.error('[{}] - [{} {}] | - Response[{}] - {} ms'.format(
                 uid, self.request.remote_ip, self.request.uri, response,
                 (time.time() - start_time) * 1000)
             )
-            return self.finish(json_encode(response))
-
-        image_sample = bytes_batch[0]
-        image_size = ImageUtils.size_of_image(image_sample)
-        size_string = "{}x{}".format(image_size[0], image_size[1])
-        if system_config.request_size_limit and size_string not in system_config.request_size_limit:
-            self.request_desc()
-            self.global_request_desc()
-            logger.info('[{}] - [{} {}] | Size[{}] - [{}][{}] - Error[{}] - {} ms'.format(
-                uid, self.request.remote_ip, self.request.uri, size_string, global_count, log_params,
-                "Image size is invalid.",
-                round((time.time() - start_time) * 1000))
-            )
-            msg = system_config.request_size_limit.get("msg")
-            msg = msg if msg else "The size of the picture is wrong. " \
-                                  "Only the original image is supported. " \
-                                  "Please do not take a screenshot!"
-            return self.finish(json.dumps({
-                self.uid_key: uid,
-                self.message_key: msg,
-                self.status_bool_key: False,
-                self.status_code_key: -250
-            }, ensure_ascii=False))
-
-        if system_config.use_whitelist:
-            assert_whitelist = self.match_whitelist(self.request.remote_ip)
-            if not assert_whitelist:
-                logger.info('[{}] - [{} {}] | Size[{}]{}{} - Error[{}] - {} ms'.format(
-                    uid, self.request.remote_ip, self.request.uri, size_string, request_count, log_params,
-                    "Whitelist limit",
-                    round((time.time() - start_time) * 1000))
-                )
-                return self.finish(json.dumps({
-                    self.uid_key: uid,
-                    self.message_key: "Only allow IP access in the whitelist",
-                    self.status_bool_key: False,
-                    self.status_code_key: -111
-                }, ensure_ascii=False))
-
-        if global_request_limit != -1 and global_count > global_request_limit:
-            logger.info('[{}] - [{} {}] | Size[{}]{}{} - Error[{}] - {} ms'.format(
-                uid, self.request.remote_ip, self.request.uri, size_string, global_count, log_params,
-                "Maximum number of requests exceeded (G)",
-                round((time.time() - start_time) * 1000))
-            )
-            return self.finish(json.dumps({
-                self.uid_key: uid,
-                self.message_key: system_config.exceeded_msg,
-                self.status_bool_key: False,
-                self.status_code_key: -555
-            }, ensure_ascii=False))
-
-        assert_blacklist = self.match_blacklist(self.request.remote_ip)
-        if assert_blacklist:
-            logger.info('[{}] - [{} {}] | Size[{}]{}{} - Error[{}] - {} ms'.format(
-                uid, self.request.remote_ip, self.request.uri, size_string, request_count, log_params,
-                "The ip is on the risk blacklist (IP)",
-                round((time.time() - start_time) * 1000))
-            )
-            return self.finish(json.dumps({
-                self.uid_key: uid,
-                self.message_key: system_config.exceeded_msg,
-                self.status_bool_key: False,
-                self.status_code_key: -110
-            }, ensure_ascii=False))
-        if request_limit != -1 and request_incr > request_limit:
-            self.risk_ip_count(self.request.remote_ip)
-            assert_blacklist_trigger = system_config.blacklist_trigger_times != -1
-            if self.risk_ip(
-                    self.request.remote_ip) > system_config.blacklist_trigger_times and assert_blacklist_trigger:
-                if self.request.remote_ip not in blacklist():
-                    set_blacklist(self.request.remote_ip)
-                    update_blacklist()
+            return self.reply(response)
+
+        rejection = self.check_policy(self.request.remote_ip, size_string, request_incr, global_count)
+        if rejection:
+            message, code, reason = rejection
+            if code == -250:
+                self.request_desc()
+            elif code == -444:
+                await self.limit(limiter.strike, self.request.remote_ip)
             logger.info('[{}] - [{} {}] | Size[{}]{}{} - Error[{}] - {} ms'.format(
                 uid, self.request.remote_ip, self.request.uri, size_string, request_count, log_params,
-                "Maximum number of requests exceeded (IP)",
+                reason,
                 round((time.time() - start_time) * 1000))
             )
-            return self.finish(json.dumps({
-                self.uid_key: uid,
-                self.message_key: system_config.exceeded_msg,
-                self.status_bool_key: False,
-                self.status_code_key: -444
-            }, ensure_ascii=False))
+            return self.reply_error(code, message, uid, ensure_ascii=False)
         if model_name_key in data and data[model_name_key]:
-            interface: Interface = interface_manager.get_by_name(model_name)
+            interface: Interface = self.get_interface(model_name=model_name)
         else:
-            interface: Interface = interface_manager.get_by_size(size_string)
+            interface: Interface = self.get_interface(size_string=size_string)
         if not interface:
             self.request_desc()
-            self.global_request_desc()
             logger.info('Service is not ready!')
-            return self.finish(json_encode(
-                {self.uid_key: uid, self.message_key: "", self.status_bool_key: False, self.status_code_key: 999}
-            ))
+            return self.reply_error(999, "", uid)
+        self.model_name = interface.name
 
         output_split = output_split if 'output_split' in data else interface.model_conf.output_split
 
-        if interface.model_conf.corp_params:
-            bytes_batch = corp_to_multi.parse_multi_img(bytes_batch, interface.model_conf.corp_params)
-        if interface.model_conf.pre_freq_frames != -1:
-            bytes_batch = gif_frames.all_frames(bytes_batch)
         exec_map = interface.model_conf.exec_map
         if exec_map and len(exec_map.keys()) > 1 and not param_key:
             self.request_desc()
-            self.global_request_desc()
             logger.info('[{}] - [{} {}] | [{}] - Size[{}]{}{} - Error[{}] - {} ms'.format(
                 uid, self.request.remote_ip, self.request.uri, interface.name, size_string, request_count, log_params,
                 "The model is missing the param_key parameter because the model is configured with ExecuteMap.",
                 round((time.time() - start_time) * 1000))
             )
-            return self.finish(json_encode(
-                {
-                    self.uid_key: uid,
-                    self.message_key: "Missing the parameter [param_key].",
-                    self.status_bool_key: False,
-                    self.status_code_key: 474
-                }
-            ))
+            return self.reply_error(474, "Missing the parameter [param_key].", uid)
         elif exec_map and param_key and param_key not in exec_map:
             self.request_desc()
-            self.global_request_desc()
             logger.info('[{}] - [{} {}] | [{}] - Size[{}]{}{} - Error[{}] - {} ms'.format(
                 uid, self.request.remote_ip, self.request.uri, interface.name, size_string, request_count, log_params,
                 "The param_key parameter is not support in the model.",
                 round((time.time() - start_time) * 1000))
             )
-            return self.finish(json_encode(
-                {
-                    self.uid_key: uid,
-                    self.message_key: "Not support the parameter [param_key].",
-                    self.status_bool_key: False,
-                    self.status_code_key: 474
-                }
-            ))
+            return self.reply_error(474, "Not support the parameter [param_key].", uid)
         elif exec_map and len(exec_map.keys()) == 1:
             param_key = list(interface.model_conf.exec_map.keys())[0]
 
+        cache_key = result_cache.key(bytes_batch, interface, param_key, extract_rgb, output_split, digest)
+        cached_result = result_cache.get(cache_key)
+        if cached_result is not None:
+            logger.info('[{}] - [{} {}] | [{}] - Size[{}]{}{} - Predict[{}] - Cached - {} ms'.format(
+                uid, self.request.remote_ip, self.request.uri, interface.name, size_string, request_count, log_params,
+                cached_result,
+                round((time.time() - start_time) * 1000))
+            )
+            return self.reply_success(cached_result, uid)
+
+        if interface.model_conf.corp_params or interface.model_conf.pre_freq_frames != -1:
+            bytes_batch = await self.stage(
+                executor_manager.decode, self.split_images, interface.model_conf, bytes_batch
+            )
+
         if interface.model_conf.external_model and interface.model_conf.corp_params:
             result = []
             len_of_result = []
@@ -352,16 +366,13 @@ class NoAuthHandler(BaseHandler):
                 pre_corp_num = corp_num
                 size_string = "{}x{}".format(corp_size[0], corp_size[1])
 
-                sub_interface = interface_manager.get_by_size(size_string)
+                sub_interface = self.get_interface(size_string=size_string)
 
-                image_batch, response = ImageUtils.get_image_batch(
-                    sub_interface.model_conf, sub_bytes_batch, param_key=param_key
+                image_batch, response = await self.stage(
+                    self.executor, sub_interface.get_image_batch, sub_bytes_batch, param_key=param_key
                 )
 
-                text = yield self.predict(
-                    sub_interface, image_batch, output_split, size_string, start_time, log_params, request_count,
-                    uid=uid
-                )
+                text = await self.predict(sub_interface, image_batch, output_split)
                 result.append(text)
                 len_of_result.append(len(result[0].split(sub_interface.model_conf.category_split)))
 
@@ -375,33 +386,34 @@ class NoAuthHandler(BaseHandler):
                     param_group=interface.model_conf.corp_params,
                     title_index=[i for i in range(len_of_result[0])]
                 )
-            return self.finish(json.dumps(response, ensure_ascii=False).replace("</", "<\\/"))
+            result_cache.put(cache_key, response[self.message_key])
+            return self.reply(response, ensure_ascii=False)
         else:
-            image_batch, response = ImageUtils.get_image_batch(
-                interface.model_conf,
+            image_batch, response = await self.stage(
+                self.executor,
+                interface.get_image_batch,
                 bytes_batch,
                 param_key=param_key,
                 extract_rgb=extract_rgb
             )
 
-        if not image_batch:
+        if image_batch is None:
             self.request_desc()
-            self.global_request_desc()
             logger.error('[{}] - [{} {}] | [{}] - Size[{}] - Response[{}] - {} ms'.format(
                 uid, self.request.remote_ip, self.request.uri, interface.name, size_string, response,
                 round((time.time() - start_time) * 1000))
             )
             response[self.uid_key] = uid
-            return self.finish(json_encode(response))
-
-        predict_result = yield self.predict(interface, image_batch, output_split)
-        if interface.model_conf.pre_freq_frames != -1:
-            predict_result = predict_result.split(interface.model_conf.output_split)
-            predict_result = [
-                i for i in predict_result
-                if interface.model_conf.max_label_num >= len(i) >= interface.model_conf.min_label_num
-            ]
-            predict_result = gif_frames.get_continuity_max(predict_result)
+            return self.reply(response)
+
+        predict_result = await self.predict(interface, image_batch, output_split)
+        label = predict_result
+        if interface.model_conf.pre_freq_frames != -1 or (
+                interface.model_conf.corp_params and interface.model_conf.output_coord
+        ):
+            label, predict_result = await self.stage(
+                executor_manager.decode, self.postprocess, interface.model_conf, predict_result
+            )
         # if need_color:
         #     # only support six label and size [90x35].
         #     color_batch = np.resize(image_batch[0], (90, 35, 3))
@@ -411,22 +423,90 @@ class NoAuthHandler(BaseHandler):
         uid_str = "[{}] - ".format(uid)
         logger.info('{}[{} {}] | [{}] - Size[{}]{}{} - Predict[{}] - {} ms'.format(
             uid_str, self.request.remote_ip, self.request.uri, interface.name, size_string, request_count, log_params,
-            predict_result,
+            label,
             round((time.time() - start_time) * 1000))
         )
-        response[self.message_key] = predict_result
-        response[self.uid_key] = uid
-        self.executor.submit(self.save_image, uid, response[self.message_key], bytes_batch[0])
-        if interface.model_conf.corp_params and interface.model_conf.output_coord:
-            # final_result = auxiliary_result + "," + response[self.message_key]
-            # if auxiliary_result else response[self.message_key]
-            final_result = response[self.message_key]
-            response[self.message_key] = corp_to_multi.get_coordinate(
-                label=final_result,
-                param_group=interface.model_conf.corp_params,
-                title_index=[0]
-            )
-        return self.finish(json.dumps(response, ensure_ascii=False).replace("</", "<\\/"))
+        sample_writer.submit(uid, label, bytes_batch[0])
+        result_cache.put(cache_key, predict_result)
+        return self.reply_success(predict_result, uid)
+
+
+@tornado.web.stream_request_body
+class StreamHandler(NoAuthHandler):
+    """
+    The image is posted as the raw body (image/*) or as the files of a multipart/form-data body,
+    the parameters are passed in the query arguments or in the X-* headers (multipart fields are also accepted).
+    The body is streamed into a buffer preallocated from the Content-Length, without JSON or base64.
+    """
+
+    param_headers = {
+        system_config.request_def_map['ModelName']: 'X-Model-Name',
+        'output_split': 'X-Output-Split',
+        'need_color': 'X-Need-Color',
+        'param_key': 'X-Param-Key',
+        'extract_rgb': 'X-Extract-RGB',
+    }
+
+    def prepare(self):
+        max_body_size = system_config.stream_max_body_size
+        content_length = self.request.headers.get('Content-Length')
+        if content_length is None:
+            # Chunked transfer encoding, the buffer grows as the body arrives.
+            content_length = 0
+        elif not content_length.strip().isdigit():
+            raise tornado.web.HTTPError(400)
+        content_length = int(content_length)
+        if content_length > max_body_size:
+            raise tornado.web.HTTPError(413)
+        self.request.connection.set_max_body_size(max_body_size)
+        self.buffer = bytearray(content_length)
+        self.received = 0
+
+    def data_received(self, chunk):
+        end = self.received + len(chunk)
+        if end > len(self.buffer):
+            self.buffer.extend(bytes(max(end - len(self.buffer), len(self.buffer))))
+        self.buffer[self.received: end] = chunk
+        self.received = end
+
+    def parse_param(self):
+        with metrics.timer('body_parse'):
+            if self.received < len(self.buffer):
+                del self.buffer[self.received:]
+            data = {}
+            for key, header in self.param_headers.items():
+                value = self.get_query_argument(key, None)
+                value = self.request.headers.get(header) if value is None else value
+                if value is not None:
+                    data[key] = value
+            images = []
+            content_type = self.request.headers.get('Content-Type', '')
+            if content_type.startswith('multipart/form-data'):
+                arguments, files = {}, {}
+                tornado.httputil.parse_body_arguments(content_type, bytes(self.buffer), arguments, files)
+                for key, value in arguments.items():
+                    if key in self.param_headers and key not in data:
+                        data[key] = ParamUtils.filter(value)
+                images = [f['body'] for file_list in files.values() for f in file_list]
+            elif self.buffer:
+                images = [self.buffer]
+            if not images:
+                raise tornado.web.HTTPError(400)
+            if data.get('extract_rgb'):
+                try:
+                    data['extract_rgb'] = [int(i) for i in str(data['extract_rgb']).split(',')]
+                except ValueError:
+                    raise tornado.web.HTTPError(400)
+            data[system_config.request_def_map['InputData']] = images
+            return data
+
+    def load_images(self, data: dict):
+        response = Response(system_config.response_def_map)
+        images = data[system_config.request_def_map['InputData']]
+        image_formats = [ImageUtils.test_image(i) for i in images]
+        if None in image_formats:
+            return None, response.INVALID_IMAGE_FORMAT
+        return [DecodedImage(raw=i, image_format=f) for i, f in zip(images, image_formats)], response.SUCCESS
 
 
 class AuthHandler(NoAuthHandler):
@@ -437,40 +517,40 @@ class AuthHandler(NoAuthHandler):
 
 
 class SimpleHandler(BaseHandler):
+    track_requests = True
     uid_key: str = system_config.response_def_map['Uid']
     message_key: str = system_config.response_def_map['Message']
     status_bool_key = system_config.response_def_map['StatusBool']
     status_code_key = system_config.response_def_map['StatusCode']
 
+    @tornado.gen.coroutine
     def post(self):
         uid = str(uuid.uuid1())
         param_key = None
         start_time = time.time()
         if interface_manager.total == 0:
             logger.info('There is currently no model deployment and services are not available.')
-            return self.finish(json_encode(
-                {self.uid_key: uid, self.message_key: "", self.status_bool_key: False, self.status_code_key: -999}
-            ))
+            return self.reply_error(-999, "", uid)
 
-        bytes_batch, response = self.image_utils.get_bytes_batch(self.request.body)
+        with metrics.timer('base64_decode'):
+            bytes_batch, response = self.image_utils.get_bytes_batch(self.request.body)
 
         if not bytes_batch:
             logger.error('Response[{}] - {} ms'.format(
                 response,
                 (time.time() - start_time) * 1000)
             )
-            return self.finish(json_encode(response))
+            return self.reply(response)
 
         image_sample = bytes_batch[0]
         image_size = ImageUtils.size_of_image(image_sample)
         size_string = "{}x{}".format(image_size[0], image_size[1])
 
-        interface = interface_manager.get_by_size(size_string)
+        interface = self.get_interface(size_string=size_string)
         if not interface:
             logger.info('Service is not ready!')
-            return self.finish(json_encode(
-                {self.message_key: "", self.status_bool_key: False, self.status_code_key: 999}
-            ))
+            return self.reply_error(999)
+        self.model_name = interface.name
 
         exec_map = interface.model_conf.exec_map
         if exec_map and len(exec_map.keys()) > 1:
@@ -479,46 +559,320 @@ class SimpleHandler(BaseHandler):
                 "The model is configured with ExecuteMap, but the api do not support this param.",
                 round((time.time() - start_time) * 1000))
             )
-            return self.finish(json_encode(
-                {
-                    self.message_key: "the api do not support [ExecuteMap].",
-                    self.status_bool_key: False,
-                    self.status_code_key: 474
-                }
-            ))
+            return self.reply_error(474, "the api do not support [ExecuteMap].")
         elif exec_map and len(exec_map.keys()) == 1:
             param_key = list(interface.model_conf.exec_map.keys())[0]
 
-        image_batch, response = ImageUtils.get_image_batch(interface.model_conf, bytes_batch, param_key=param_key)
+        cache_key = result_cache.key(bytes_batch, interface, param_key)
+        result = result_cache.get(cache_key)
+        if result is not None:
+            logger.info('[{}] - [{}] | [{}] - Size[{}] - Predict[{}] - Cached - {} ms'.format(
+                uid, self.request.remote_ip, interface.name, size_string, result, (time.time() - start_time) * 1000)
+            )
+            return self.reply_success(result, uid)
 
-        if not image_batch:
+        image_batch, response = yield self.executor.submit(
+            interface.get_image_batch, bytes_batch, param_key=param_key
+        )
+
+        if image_batch is None:
             logger.error('[{}] - [{}] | [{}] - Size[{}] - Response[{}] - {} ms'.format(
                 uid, self.request.remote_ip, interface.name, size_string, response,
                 (time.time() - start_time) * 1000)
             )
-            return self.finish(json_encode(response))
+            return self.reply(response)
 
-        result = interface.predict_batch(image_batch, None)
+        result = yield interface.predict_async(image_batch, None)
+        result_cache.put(cache_key, result)
         logger.info('[{}] - [{}] | [{}] - Size[{}] - Predict[{}] - {} ms'.format(
             uid, self.request.remote_ip, interface.name, size_string, result, (time.time() - start_time) * 1000)
         )
-        response[self.uid_key] = uid
-        response[self.message_key] = result
-        return self.write(json.dumps(response, ensure_ascii=False).replace("</", "<\\/"))
+        return self.reply_success(result, uid)
+
+
+class BatchHandler(BaseHandler):
+    """
+    Many captchas in one request: a JSON array (or {"items": [...]}) or NDJSON body of items,
+    each with its own image, model_name, param_key, output_split, extract_rgb and id.
+    The items are grouped by model and parameters, every group is preprocessed and predicted as one batch,
+    and the per-item results are streamed back (NDJSON or a JSON array) as soon as their group completes.
+    """
+
+    uid_key: str = system_config.response_def_map['Uid']
+    message_key: str = system_config.response_def_map['Message']
+    status_bool_key = system_config.response_def_map['StatusBool']
+    status_code_key = system_config.response_def_map['StatusCode']
+    id_key = 'id'
+
+    def __init__(self, application, request, **kwargs):
+        super().__init__(application, request, **kwargs)
+        self.ndjson = False
+        self.written = 0
+
+    def parse_items(self):
+        content_type = self.request.headers.get('Content-Type', '')
+        self.ndjson = 'ndjson' in content_type or 'ndjson' in self.request.headers.get('Accept', '')
+        with metrics.timer('body_parse'):
+            try:
+                if 'ndjson' in content_type:
+                    items = [loads(line) for line in self.request.body.splitlines() if line.strip()]
+                else:
+                    items = loads(self.request.body)
+                    items = items.get('items') if isinstance(items, dict) else items
+            except (ValueError, UnicodeDecodeError):
+                raise tornado.web.HTTPError(400)
+        if not items or not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise tornado.web.HTTPError(400)
+        if len(items) > system_config.batch_max_items:
+            raise tornado.web.HTTPError(413)
+        return items
+
+    def item_result(self, item_id, message, code, model_name=''):
+        metrics.requests_total.inc(model=model_name, code=code)
+        return {
+            self.id_key: item_id,
+            self.message_key: message,
+            self.status_bool_key: code == 0,
+            self.status_code_key: code
+        }
+
+    def emit(self, results: list):
+        with metrics.timer('serialize'):
+            lines = [dumps(result, ensure_ascii=False, compact=True) for result in results]
+        for line in lines:
+            if self.ndjson:
+                self.write(line + b"\n")
+            else:
+                self.write((b"[" if not self.written else b",") + line)
+            self.written += 1
+        return self.flush()
+
+    def prepare_item(self, index: int, item: dict, groups: dict, request_count: int, global_count: int):
+        # Returns the result of the item when it is answered without the session, otherwise adds it to its group.
+        # The item is checked like a /captcha/v1 request, `request_count` and `global_count` are its own counts.
+        request_def_map = system_config.request_def_map
+        item_id = item.get(self.id_key, index)
+        if request_def_map['InputData'] not in item:
+            return self.item_result(item_id, "Missing the parameter [{}].".format(request_def_map['InputData']), 400)
+        with metrics.timer('base64_decode'):
+            bytes_batch, response = self.image_utils.get_bytes_batch(item[request_def_map['InputData']])
+        if not bytes_batch:
+            return self.item_result(item_id, response[self.message_key], response[self.status_code_key])
+
+        image_size = ImageUtils.size_of_image(bytes_batch[0])
+        size_string = "{}x{}".format(image_size[0], image_size[1])
+        rejection = NoAuthHandler.check_policy(self.request.remote_ip, size_string, request_count, global_count)
+        if rejection:
+            return self.item_result(item_id, rejection[0], rejection[1])
+
+        model_name = item.get(request_def_map['ModelName'])
+        param_key = item.get('param_key')
+        extract_rgb = item.get('extract_rgb')
+        if model_name:
+            interface: Interface = self.get_interface(model_name=model_name)
+        else:
+            interface: Interface = self.get_interface(size_string=size_string)
+        if not interface:
+            return self.item_result(item_id, "", 999)
+        model_conf = interface.model_conf
+        if model_conf.external_model and model_conf.corp_params:
+            return self.item_result(item_id, "The model is not supported by the batch api.", 474, interface.name)
+
+        exec_map = model_conf.exec_map
+        if exec_map and len(exec_map.keys()) > 1 and not param_key:
+            return self.item_result(item_id, "Missing the parameter [param_key].", 474, interface.name)
+        elif exec_map and param_key and param_key not in exec_map:
+            return self.item_result(item_id, "Not support the parameter [param_key].", 474, interface.name)
+        elif exec_map and len(exec_map.keys()) == 1:
+            param_key = list(exec_map.keys())[0]
+        output_split = item['output_split'] if 'output_split' in item else model_conf.output_split
+
+        cache_key = result_cache.key(bytes_batch, interface, param_key, extract_rgb, output_split)
+        cached_result = result_cache.get(cache_key)
+        if cached_result is not None:
+            return self.item_result(item_id, cached_result, 0, interface.name)
+
+        if model_conf.corp_params:
+            bytes_batch = corp_to_multi.parse_multi_img(bytes_batch, model_conf.corp_params)
+        if model_conf.pre_freq_frames != -1:
+            bytes_batch = gif_frames.all_frames(bytes_batch)
+
+        group_key = (interface.name, param_key, str(extract_rgb) if extract_rgb else None)
+        group = groups.setdefault(group_key, dict(
+            interface=interface, param_key=param_key, extract_rgb=extract_rgb, entries=[]
+        ))
+        group['entries'].append(dict(id=item_id, images=bytes_batch, output_split=output_split, cache_key=cache_key))
+
+    def prepare_items(self, items: list, request_count: int, global_count: int):
+        # Runs on the decode executor: the base64 decode, the size probe, the crops and the frames of every item.
+        # Returns the immediate results, the groups to run and the number of items rejected by size and by IP limit.
+        groups = {}
+        immediate = []
+        rejected_size = rejected_limit = 0
+        # The items are counted in order, as many successive requests.
+        request_count -= len(items)
+        global_count -= len(items)
+        for index, item in enumerate(items):
+            try:
+                result = self.prepare_item(index, item, groups, request_count + index + 1, global_count + index + 1)
+            except (OSError, ValueError):
+                response = self.exception.IMAGE_DAMAGE
+                result = self.item_result(
+                    item.get(self.id_key, index), response[self.message_key], response[self.status_code_key]
+                )
+            except Exception as e:
+                logger.error('Failed to prepare the batch item: {}'.format(e))
+                result = self.item_result(item.get(self.id_key, index), system_config.error_message[500], 500)
+            if result is not None:
+                immediate.append(result)
+                rejected_size += result[self.status_code_key] == -250
+                rejected_limit += result[self.status_code_key] == -444
+        return immediate, groups, rejected_size, rejected_limit
+
+    @staticmethod
+    def preprocess_group(interface: Interface, entries: list, param_key=None, extract_rgb=None):
+        return [
+            interface.get_image_batch(entry['images'], param_key=param_key, extract_rgb=extract_rgb)
+            for entry in entries
+        ]
+
+    @tornado.gen.coroutine
+    def run_group(self, group: dict):
+        interface: Interface = group['interface']
+        model_conf = interface.model_conf
+        entries = group['entries']
+        prepared = yield self.executor.submit(
+            self.preprocess_group, interface, entries, group['param_key'], group['extract_rgb']
+        )
+        results = []
+        image_batch = []
+        valid_entries = []
+        for entry, (entry_batch, response) in zip(entries, prepared):
+            if entry_batch is None:
+                results.append(self.item_result(
+                    entry['id'], response[self.message_key], response[self.status_code_key], interface.name
+                ))
+                continue
+            valid_entries.append((entry, len(entry_batch)))
+            image_batch.extend(entry_batch)
+        if not image_batch:
+            return results
+        try:
+            texts = yield interface.predict_texts_async(image_batch)
+        except Exception as e:
+            code = 503 if isinstance(e, ExecutorOverload) else 500
+            if code == 500:
+                logger.error('[{}] - Batch prediction failed: {}'.format(interface.name, e))
+            return results + [
+                self.item_result(entry['id'], system_config.error_message[code], code, interface.name)
+                for entry, _ in valid_entries
+            ]
+        offset = 0
+        for entry, size in valid_entries:
+            entry_texts = texts[offset: offset + size]
+            offset += size
+            if model_conf.pre_freq_frames != -1:
+                predict_result = gif_frames.get_continuity_max([
+                    i for i in entry_texts if model_conf.max_label_num >= len(i) >= model_conf.min_label_num
+                ])
+            else:
+                predict_result = NoAuthHandler.calc_arithmetic(interface, entry['output_split'].join(entry_texts))
+            if model_conf.corp_params and model_conf.output_coord:
+                predict_result = corp_to_multi.get_coordinate(
+                    label=predict_result,
+                    param_group=model_conf.corp_params,
+                    title_index=[0]
+                )
+            result_cache.put(entry['cache_key'], predict_result)
+            results.append(self.item_result(entry['id'], predict_result, 0, interface.name))
+        return results
+
+    @tornado.gen.coroutine
+    def run_group_safe(self, group: dict):
+        # A failed group answers an error for each of its items, the other groups are still streamed.
+        try:
+            results = yield self.run_group(group)
+        except Exception as e:
+            interface: Interface = group['interface']
+            code = 503 if isinstance(e, ExecutorOverload) else 500
+            if code == 500:
+                logger.error('[{}] - Batch group failed: {}'.format(interface.name, e))
+            results = [
+                self.item_result(entry['id'], system_config.error_message[code], code, interface.name)
+                for entry in group['entries']
+            ]
+        return results
+
+    @tornado.gen.coroutine
+    def post(self):
+        uid = str(uuid.uuid1())
+        start_time = self.start_time
+        items = self.parse_items()
+        remote_ip = self.request.remote_ip
+
+        error = None
+        if interface_manager.total == 0:
+            error = ("", -999)
+        elif system_config.use_whitelist and not NoAuthHandler.match_whitelist(remote_ip):
+            error = ("Only allow IP access in the whitelist", -111)
+        elif NoAuthHandler.match_blacklist(remote_ip):
+            error = (system_config.exceeded_msg, -110)
+        if error:
+            logger.info('[{}] - [{} {}] | Items[{}] - Error[{}] - {} ms'.format(
+                uid, remote_ip, self.request.uri, len(items), error[1], round((time.time() - start_time) * 1000)
+            ))
+            return self.reply_error(error[1], error[0], uid, ensure_ascii=False)
+
+        # Every item counts as one request for the limits, the size and the limits are checked per item.
+        request_count, global_count = yield self.limit(limiter.hit_all, remote_ip, len(items))
+        immediate, groups, rejected_size, rejected_limit = yield executor_manager.decode.submit(
+            self.prepare_items, items, request_count, global_count
+        )
+        if rejected_size:
+            self.request_desc(rejected_size)
+        if rejected_limit:
+            yield self.limit(limiter.strike, remote_ip, rejected_limit)
+        self.set_header("Content-Type", "application/x-ndjson" if self.ndjson else "application/json")
+        try:
+            if immediate:
+                yield self.emit(immediate)
+            waiter = tornado.gen.WaitIterator(*[self.run_group_safe(group) for group in groups.values()])
+            while not waiter.done():
+                results = yield waiter.next()
+                yield self.emit(results)
+        finally:
+            # The array is closed even if the stream failed after the first flush.
+            if not self.ndjson:
+                self.write("]" if self.written else "[]")
+        logger.info('[{}] - [{} {}] | Items[{}] - Groups[{}] - {} ms'.format(
+            uid, remote_ip, self.request.uri, len(items), len(groups), round((time.time() - start_time) * 1000)
+        ))
+        return self.finish()
 
 
 class ServiceHandler(BaseHandler):
 
     def get(self):
         response = {
+            "ready": interface_manager.ready.is_set(),
             "total": interface_manager.total,
             "online": interface_manager.online_names,
             "invalid": interface_manager.invalid_group,
-            "blacklist": tornado.options.options.ip_blacklist
+            "warm_up": {i.name: i.warm_up_time for i in interface_manager.group},
+            "blacklist": limiter.blacklist.addresses,
+            "cache": result_cache.stats,
+            "samples": sample_writer.stats
         }
         return self.finish(json.dumps(response, ensure_ascii=False, indent=2))
 
 
+class MetricsHandler(BaseHandler):
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        return self.finish(metrics.registry.render())
+
+
 class FileHandler(tornado.web.StaticFileHandler):
     def data_received(self, chunk):
         pass
@@ -530,19 +884,27 @@ class FileHandler(tornado.web.StaticFileHandler):
 class HeartBeatHandler(BaseHandler):
 
     def get(self):
+        # Not ready until the models found at startup are loaded, the load balancer keeps the traffic away.
+        if not interface_manager.ready.is_set():
+            self.set_status(503)
+            return self.finish("")
         self.finish("")
 
 
-def clear_specific_job():
-    tornado.options.options.request_count = {}
+def update_blacklist():
+    limiter.refresh()
 
 
-def clear_global_job():
-    tornado.options.options.global_request_count = 0
+def monitor_loop_lag(interval=0.5):
+    # The delay of a periodic callback is the time the IOLoop thread was blocked by something else.
+    state = dict(expected=time.perf_counter() + interval)
 
+    def check():
+        now = time.perf_counter()
+        metrics.observe('ioloop_lag', max(now - state['expected'], 0.))
+        state['expected'] = now + interval
 
-def update_blacklist():
-    tornado.options.options.ip_blacklist = blacklist()
+    tornado.ioloop.PeriodicCallback(check, interval * 1000).start()
 
 
 def make_app(route: list):
@@ -556,13 +918,11 @@ def make_app(route: list):
     )
 
 
-trigger_specific = IntervalTrigger(seconds=system_config.request_count_interval)
-trigger_global = IntervalTrigger(seconds=system_config.g_request_count_interval)
-trigger_blacklist = IntervalTrigger(seconds=10)
-scheduler.add_job(update_blacklist, trigger_blacklist)
-scheduler.add_job(clear_specific_job, trigger_specific)
-scheduler.add_job(clear_global_job, trigger_global)
-scheduler.start()
+def start_scheduler():
+    # The request counters are sliding windows, only the blacklist is refreshed periodically.
+    trigger_blacklist = IntervalTrigger(seconds=10)
+    scheduler.add_job(update_blacklist, trigger_blacklist)
+    scheduler.start()
 
 if __name__ == "__main__":
     parser = optparse.OptionParser()
@@ -571,7 +931,8 @@ if __name__ == "__main__":
     global_request_limit = system_config.global_request_limit
 
     parser.add_option('-p', '--port', type="int", default=system_config.default_port, dest="port")
-    parser.add_option('-w', '--workers', type="int", default=50, dest="workers")
+    parser.add_option('-w', '--workers', type="int", default=None, dest="workers")
+    parser.add_option('--processes', type="int", default=1, dest="processes")
     parser.add_option('--up_hour', type="int", default=-1, dest="up_hour")
     parser.add_option('--low_hour', type="int", default=-1, dest="low_hour")
 
@@ -582,21 +943,43 @@ if __name__ == "__main__":
         # os.system("chcp 65001")
         os.system("title=Eve-DL Platform v0.1({}) ^| [{}]".format(get_version(), server_port))
 
-    workers = opt.workers
     logger = system_config.logger
     # print('=============WITHOUT_LOGGER=============', system_config.without_logger)
     tornado.log.enable_pretty_logging(logger=logger)
-    interface_manager = InterfaceManager()
+
+    server_host = "0.0.0.0"
+    sockets = tornado.netutil.bind_sockets(server_port, server_host)
+
+    # Pre-fork the workers: the sockets and the imported modules are shared copy-on-write,
+    # the sessions are created by every worker after forking since they are not fork-safe.
+    # The request counters and the blacklist are served to the workers by a shared store.
+    task_id = None
+    if opt.processes != 1:
+        shared_store = SharedStore().start()
+        task_id = tornado.process.fork_processes(opt.processes)
+        request_store = shared_store.connect()
+
+    if opt.workers:
+        system_config.executor_preprocess_workers = opt.workers
+    executor_manager = ExecutorManager.shared(system_config)
+    limiter = Limiter(system_config, request_store, executor_manager.io)
+    result_cache = ResultCache(system_config)
+    sample_writer = SampleWriter(system_config).start()
+    interface_manager = InterfaceManager(cache=result_cache)
+    metrics.register_service(executor_manager, result_cache, interface_manager, sample_writer)
     threading.Thread(target=lambda: event_loop(system_config, model_path, interface_manager)).start()
 
     sign.set_auth([{'accessKey': system_config.access_key, 'secretKey': system_config.secret_key}])
 
-    tornado.options.options.ip_whitelist = whitelist()
+    limiter.load_whitelist(whitelist())
+    update_blacklist()
+    start_scheduler()
 
-    server_host = "0.0.0.0"
-    logger.info('Running on http://{}:{}/ <Press CTRL + C to quit>'.format(server_host, server_port))
+    logger.info('Running on http://{}:{}/ <Press CTRL + C to quit>{}'.format(
+        server_host, server_port, "" if task_id is None else " - Worker[{}]".format(task_id)
+    ))
     app = make_app(system_config.route_map)
     http_server = tornado.httpserver.HTTPServer(app)
-    http_server.bind(server_port, server_host)
-    http_server.start(1)
-    tornado.ioloop.IOLoop.instance().start()
+    http_server.add_sockets(sockets)
+    monitor_loop_lag()
+    tornado.ioloop.IOLoop.current().start()
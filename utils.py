@@ -1,10 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
 # Author: kerlomz <kerlomz@gmail.com>
-import io
 import re
 import os
-import cv2
+import math
 import time
 import base64
 import functools
@@ -12,42 +11,106 @@ import binascii
 import datetime
 import hashlib
 import numpy as np
-import tensorflow as tf
-from PIL import Image as PIL_Image
+from concurrent.futures.process import BrokenProcessPool
 from constants import Response, SystemConfig
-from pretreatment import preprocessing, preprocessing_by_func
 from config import ModelConfig, Config
-from middleware.impl.gif_frames import concat_frames, blend_frame
-from middleware.impl.rgb_filter import rgb_filter
+from decoded_image import DecodedImage
 
 
 class Arithmetic(object):
+    """
+    Evaluates the recognized formula of an arithmetic captcha such as `(3+5)×2=?`, the text after `=` is ignored.
+    The tokens are converted to reverse polish notation (shunting-yard) and evaluated on a stack,
+    the results are memoized by the formula string. A malformed formula is evaluated to None.
+    """
+
+    token_pattern = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|(.))')
+    operators = {
+        '+': (1, lambda a, b: a + b),
+        '-': (1, lambda a, b: a - b),
+        '*': (2, lambda a, b: a * b),
+        '/': (2, lambda a, b: a / b),
+    }
+    aliases = {'×': '*', 'x': '*', 'X': '*', '÷': '/'}
+    # The unary minus binds tighter than the binary operators.
+    negative = 'neg'
+
+    def calc(self, formula: str):
+        return self.evaluate(formula)
 
-    def calc(self, formula):
-        formula = re.sub(' ', '', formula)
-        formula_ret = 0
-        match_brackets = re.search(r'\([^()]+\)', formula)
-        if match_brackets:
-            calc_result = self.calc(match_brackets.group().strip("(,)"))
-            formula = formula.replace(match_brackets.group(), str(calc_result))
-            return self.calc(formula)
-        else:
-            formula = formula.replace('--', '+').replace('++', '+').replace('-+', '-').replace('+-', '-')
-            while re.findall(r"[*/]", formula):
-                get_formula = re.search(r"[.\d]+[*/]+[-]?[.\d]+", formula)
-                if get_formula:
-                    get_formula_str = get_formula.group()
-                    if get_formula_str.count("*"):
-                        formula_list = get_formula_str.split("*")
-                        ret = float(formula_list[0]) * float(formula_list[1])
-                    else:
-                        formula_list = get_formula_str.split("/")
-                        ret = float(formula_list[0]) / float(formula_list[1])
-                    formula = formula.replace(get_formula_str, str(ret)).replace('--', '+').replace('++', '+')
-            formula = re.findall(r'[-]?[.\d]+', formula)
-            for num in formula:
-                formula_ret += float(num)
-        return formula_ret
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def evaluate(formula: str):
+        try:
+            value = Arithmetic.execute(Arithmetic.compile(formula))
+        except (ValueError, IndexError, ZeroDivisionError, OverflowError):
+            return None
+        return value if math.isfinite(value) else None
+
+    @staticmethod
+    def compile(formula: str):
+        formula = formula.split('=', 1)[0].replace('?', '').replace('？', '')
+        output, stack = [], []
+        operand = False
+        for number, symbol in Arithmetic.token_pattern.findall(formula.strip()):
+            if number:
+                if operand:
+                    raise ValueError(formula)
+                output.append(float(number))
+                operand = True
+                continue
+            symbol = Arithmetic.aliases.get(symbol, symbol)
+            if symbol == '(':
+                if operand:
+                    raise ValueError(formula)
+                stack.append(symbol)
+            elif symbol == ')':
+                if not operand:
+                    raise ValueError(formula)
+                while stack and stack[-1] != '(':
+                    output.append(stack.pop())
+                if not stack:
+                    raise ValueError(formula)
+                stack.pop()
+            elif symbol in Arithmetic.operators:
+                if not operand:
+                    if symbol == '-':
+                        stack.append(Arithmetic.negative)
+                    elif symbol != '+':
+                        raise ValueError(formula)
+                    continue
+                precedence = Arithmetic.operators[symbol][0]
+                while stack and stack[-1] != '(' and (
+                        stack[-1] == Arithmetic.negative or Arithmetic.operators[stack[-1]][0] >= precedence
+                ):
+                    output.append(stack.pop())
+                stack.append(symbol)
+                operand = False
+            else:
+                raise ValueError(formula)
+        if not operand:
+            raise ValueError(formula)
+        while stack:
+            symbol = stack.pop()
+            if symbol == '(':
+                raise ValueError(formula)
+            output.append(symbol)
+        return tuple(output)
+
+    @staticmethod
+    def execute(tokens: tuple):
+        stack = []
+        for token in tokens:
+            if isinstance(token, float):
+                stack.append(token)
+            elif token == Arithmetic.negative:
+                stack.append(-stack.pop())
+            else:
+                b, a = stack.pop(), stack.pop()
+                stack.append(Arithmetic.operators[token][1](a, b))
+        if len(stack) != 1:
+            raise ValueError(tokens)
+        return stack[0]
 
 
 class ParamUtils(object):
@@ -88,6 +151,7 @@ class ImageUtils(object):
         self.conf = conf
 
     def get_bytes_batch(self, base64_or_bytes):
+        # Note that the batch items are DecodedImage objects, the bytes are parsed only once per request.
         response = Response(self.conf.response_def_map)
         b64_filter_s = lambda s: re.sub("data:image/.+?base64,", "", s, 1) if ',' in s else s
         b64_filter_b = lambda s: re.sub(b"data:image/.+?base64,", b"", s, 1) if b',' in s else s
@@ -112,80 +176,43 @@ class ImageUtils(object):
 
         if None in what_img:
             return None, response.INVALID_IMAGE_FORMAT
-        return bytes_batch, response.SUCCESS
+        return [DecodedImage(raw=i, image_format=f) for i, f in zip(bytes_batch, what_img)], response.SUCCESS
 
     @staticmethod
-    def get_image_batch(model: ModelConfig, bytes_batch, param_key=None, extract_rgb: list = None):
+    def get_image_batch(model: ModelConfig, bytes_batch, param_key=None, extract_rgb: list = None,
+                        preprocess_pool=None, buffer_pool=None):
         # Note that there are two return objects here.
         # 1.image_batch, 2.response
 
         response = Response(model.conf.response_def_map)
 
-        def load_image(image_bytes: bytes):
-            data_stream = io.BytesIO(image_bytes)
-            pil_image = PIL_Image.open(data_stream)
-
-            gif_handle = model.pre_concat_frames != -1 or model.pre_blend_frames != -1
-
-            if pil_image.mode == 'P' and not gif_handle:
-                pil_image = pil_image.convert('RGB')
-
-            rgb = pil_image.split()
-            size = pil_image.size
-
-            if (len(rgb) > 3 and model.pre_replace_transparent) and not gif_handle:
-                background = PIL_Image.new('RGB', pil_image.size, (255, 255, 255))
+        plan = model.preprocess_plan
+        output_shape = plan.output_shape
+        try:
+            if preprocess_pool:
                 try:
-                    background.paste(pil_image, (0, 0, size[0], size[1]), pil_image)
-                    pil_image = background
-                except:
-                    pil_image = pil_image.convert('RGB')
-
-            if len(pil_image.split()) > 3 and model.image_channel == 3:
-                pil_image = pil_image.convert('RGB')
-
-            if model.pre_concat_frames != -1:
-                im = concat_frames(pil_image, model.pre_concat_frames)
-            elif model.pre_blend_frames != -1:
-                im = blend_frame(pil_image, model.pre_blend_frames)
-            else:
-                im = np.asarray(pil_image)
-
-            if extract_rgb:
-                im = rgb_filter(im, extract_rgb)
-
-            im = preprocessing_by_func(
-                exec_map=model.exec_map,
-                key=param_key,
-                src_arr=im
-            )
-
-            if model.image_channel == 1 and len(im.shape) == 3:
-                im = cv2.cvtColor(im, cv2.COLOR_RGB2GRAY)
-
-            im = preprocessing(
-                image=im,
-                binaryzation=model.pre_binaryzation,
-            )
-
-            if model.pre_horizontal_stitching:
-                up_slice = im[0: int(size[1] / 2), 0: size[0]]
-                down_slice = im[int(size[1] / 2): size[1], 0: size[0]]
-                im = np.concatenate((up_slice, down_slice), axis=1)
-
-            image = im.astype(np.float32)
-            if model.resize[0] == -1:
-                ratio = model.resize[1] / size[1]
-                resize_width = int(ratio * size[0])
-                image = cv2.resize(image, (resize_width, model.resize[1]))
+                    image_batch = preprocess_pool.map(
+                        [DecodedImage.of(image).source for image in bytes_batch], param_key, extract_rgb
+                    )
+                    if image_batch is not None:
+                        return image_batch, response.SUCCESS
+                except BrokenProcessPool as e:
+                    model.logger.error('The process pool of {} is broken: {}'.format(model.model_name, e))
+            if not output_shape:
+                batch = None
+            elif buffer_pool:
+                batch = buffer_pool.acquire(len(bytes_batch))
             else:
-                image = cv2.resize(image, (model.resize[0], model.resize[1]))
-            image = image.swapaxes(0, 1)
-            return (image[:, :, np.newaxis] if model.image_channel == 1 else image[:, :]) / 255.
-
-        try:
-            image_batch = [load_image(i) for i in bytes_batch]
-            return image_batch, response.SUCCESS
+                batch = np.empty((len(bytes_batch),) + output_shape, dtype=plan.dtype)
+            image_batch = []
+            for i, image in enumerate(bytes_batch):
+                out = None if batch is None else batch[i]
+                image = plan.apply(DecodedImage.of(image).pil, param_key=param_key, extract_rgb=extract_rgb, out=out)
+                image_batch.append(image)
+                if image is not out:
+                    batch = None
+            # The images are written in place, the batch is fed to the session without stacking.
+            return image_batch if batch is None else batch, response.SUCCESS
         except OSError:
             return None, response.IMAGE_DAMAGE
         except ValueError as _e:
@@ -193,16 +220,8 @@ class ImageUtils(object):
             return None, response.IMAGE_SIZE_NOT_MATCH_GRAPH
 
     @staticmethod
-    def size_of_image(image_bytes: bytes):
-        _null_size = tuple((-1, -1))
-        try:
-            data_stream = io.BytesIO(image_bytes)
-            size = PIL_Image.open(data_stream).size
-            return size
-        except OSError:
-            return _null_size
-        except ValueError:
-            return _null_size
+    def size_of_image(image):
+        return DecodedImage.of(image).size
 
     @staticmethod
     def test_image(h):